@@ -0,0 +1,73 @@
+import torch
+from torch.utils.data import DataLoader
+
+import os, sys
+import argparse
+from tqdm import tqdm
+
+from utils import convert_arg_line_to_args
+from new_networks.NewCRFDepth import NewCRFDepth
+from checkpoints import load_backbone
+from dataloaders.anywhu_dataloader import DataLoadPreprocess, preprocessing_transforms, BORDER_WIDTH
+from dataloaders.device_preprocess import DevicePreprocess
+from dataloaders.feature_cache import FeatureCache
+
+
+parser = argparse.ArgumentParser(description='Precompute the frozen DINOv2 features of a split file.',
+                                 fromfile_prefix_chars='@')
+parser.convert_arg_line_to_args = convert_arg_line_to_args
+
+parser.add_argument('--encoder', type=str, help='type of encoder, vits, vitb, vitl, vitg', default='vitl')
+parser.add_argument('--pretrain', type=str, help='path of pretrained encoder', required=True)
+parser.add_argument('--data_path', type=str, help='path to the data', required=True)
+parser.add_argument('--filenames_file', type=str, help='path to the filenames text file', required=True)
+parser.add_argument('--feature_cache', type=str, help='output directory of the feature cache', required=True)
+parser.add_argument('--batch_size', type=int, help='batch size', default=4)
+parser.add_argument('--num_threads', type=int, help='number of threads to use for data loading', default=1)
+parser.add_argument('--shard_size', type=int, help='number of samples per shard file', default=1024)
+
+if sys.argv.__len__() == 2:
+    arg_filename_with_prefix = '@' + sys.argv[1]
+    args, _ = parser.parse_known_args([arg_filename_with_prefix])
+else:
+    args, _ = parser.parse_known_args()
+
+
+def main():
+    # the images are read as in training, not augmented; they stay unpadded uint8 so that the flipped entry is the
+    # flip of the unpadded image, padded afterwards like the training samples
+    args.mode = 'test'
+    args.distributed = False
+    args.uint8_transport = True
+    dataset = DataLoadPreprocess(args, 'test', transform=preprocessing_transforms('test'))
+    dataloader = DataLoader(dataset, args.batch_size, shuffle=False, num_workers=args.num_threads, pin_memory=True)
+
+    model = NewCRFDepth(encoder=args.encoder, inv_depth=False)
+    load_backbone(model, args.pretrain)
+    model.eval()
+    model.cuda()
+
+    preprocess = DevicePreprocess(BORDER_WIDTH, device='cuda')
+    cache = None
+    idx = 0
+    with torch.no_grad():
+        for sample in tqdm(dataloader):
+            image = preprocess.to_unit(sample['image'])
+            for flip in (False, True):
+                feats = model.forward_features(preprocess.pad_normalize(image.flip(-1) if flip else image))
+                feats = [feat.half().cpu().numpy() for feat in feats]
+                if cache is None:
+                    cache = FeatureCache.create(args.feature_cache, len(dataset), [feat.shape[1:] for feat in feats],
+                                                shard_size=args.shard_size, encoder=args.encoder,
+                                                layers=model.intermediate_layer_idx[args.encoder],
+                                                filenames_file=os.path.abspath(args.filenames_file))
+                for b in range(image.shape[0]):
+                    cache.write(idx + b, flip, [feat[b] for feat in feats])
+            idx += image.shape[0]
+
+    cache.flush()
+    print('== Cached features of {} samples in {}'.format(idx, args.feature_cache))
+
+
+if __name__ == '__main__':
+    main()
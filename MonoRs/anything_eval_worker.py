@@ -0,0 +1,158 @@
+import torch
+import torch.backends.cudnn as cudnn
+
+import os, sys, time
+import argparse
+
+from tensorboardX import SummaryWriter
+
+from utils import eval_metrics, convert_arg_line_to_args
+from new_networks.NewCRFDepth import NewCRFDepth
+from tta import DEFAULT_VIEWS
+from metrics import NEW_THRESHOLDS
+from precision import PRECISIONS
+from checkpoints import BestCheckpoints, pending_snapshots, load_backbone, load_model_checkpoint
+from evaluation import online_eval, write_eval_log
+
+
+parser = argparse.ArgumentParser(description='Evaluate the snapshots that anything_train.py drops in --eval_queue. '
+                                             'Takes the training arguments file.', fromfile_prefix_chars='@')
+parser.convert_arg_line_to_args = convert_arg_line_to_args
+
+parser.add_argument('--model_name', type=str, help='model name', default='iebins')
+parser.add_argument('--encoder', type=str, help='type of encoder, base07, large07, tiny07', default='large07')
+parser.add_argument('--pretrain', type=str, help='path of pretrained encoder', default=None)
+parser.add_argument('--max_depth', type=float, help='maximum depth in estimation', default=10)
+parser.add_argument('--loader', type=str, help='data loader, whu (dataloaders.anywhu_dataloader) or wild '
+                                               '(dataloaders.anything_wild_dataloader)', default='whu',
+                    choices=['whu', 'wild'])
+parser.add_argument('--eval_queue', type=str, help='directory the snapshots are queued in', required=True)
+parser.add_argument('--eval_summary_directory', type=str, help='output directory for eval summary,'
+                                                               'if empty outputs to the log folder of the run',
+                    default='')
+parser.add_argument('--poll_interval', type=float, help='seconds between two looks at an empty queue', default=10)
+parser.add_argument('--latest_only', help='if set, only evaluate the newest queued snapshot and drop the older ones',
+                    action='store_true')
+parser.add_argument('--exit_when_empty', help='if set, exit once the queue is empty instead of waiting',
+                    action='store_true')
+parser.add_argument('--keep_snapshots', help='if set, keep the evaluated snapshots in <eval_queue>/done',
+                    action='store_true')
+
+# Online eval
+parser.add_argument('--data_path_eval', type=str, help='path to the data for online evaluation', required=True)
+parser.add_argument('--gt_path_eval', type=str, help='path to the groundtruth data for online evaluation',
+                    required=True)
+parser.add_argument('--filenames_file_eval', type=str, help='path to the filenames text file for online evaluation',
+                    required=True)
+parser.add_argument('--batch_size_eval', type=int, help='online evaluation batch size', default=1)
+parser.add_argument('--num_threads_eval', type=int, help='number of threads for online evaluation data loading',
+                    default=1)
+parser.add_argument('--device_metrics', help='if set, online eval computes the metrics of the whole batch on the '
+                                             'device with metrics.compute_errors instead of per image with '
+                                             'utils.compute_errors', action='store_true')
+parser.add_argument('--new_thresholds', type=float, nargs=3, help='with --device_metrics, ratio thresholds of d1_new, '
+                                                                   'd2_new and d3_new', default=list(NEW_THRESHOLDS))
+parser.add_argument('--min_depth_eval', type=float, help='minimum depth for evaluation', default=10)
+parser.add_argument('--max_depth_eval', type=float, help='maximum depth for evaluation', default=80)
+parser.add_argument('--exit_threshold', type=float, help='if set, online eval stops refining an image once its mean '
+                                                         'uncertainty is below this value', default=None)
+parser.add_argument('--exit_min_delta', type=float, help='with --exit_threshold, also stop once the uncertainty '
+                                                         'improves by less than this value', default=None)
+parser.add_argument('--exit_tile', type=int, help='with --exit_threshold, decide per tile of this size (in 1/4 '
+                                                  'resolution pixels) instead of per image', default=None)
+parser.add_argument('--tta_views', type=str, nargs='+', help='online eval test-time augmentation views run as one '
+                                                             'batch, e.g. identity hflip vflip scale0.75',
+                    default=list(DEFAULT_VIEWS))
+parser.add_argument('--precision', type=str, help='autocast precision of the backbone, the CRFs and the GRU',
+                    default='fp32', choices=PRECISIONS)
+parser.add_argument('--uint8_transport', help='if set, the loader workers emit uint8 images that are cast, padded '
+                                              'and normalised on the GPU', action='store_true')
+parser.add_argument('--split_cache', type=str, help='directory of the memory-mapped split file index cache',
+                    default='')
+parser.add_argument('--thread_loader_modes', type=str, nargs='*', help='loader modes that decode with a thread pool '
+                                                                       'of the main process', default=[],
+                    choices=['train', 'online_eval'])
+parser.add_argument('--loader_threads', type=int, help='number of threads of the thread-pool loader', default=8)
+
+# the training arguments file is accepted as is, the options of training only are ignored
+if sys.argv.__len__() == 2:
+    arg_filename_with_prefix = '@' + sys.argv[1]
+    args, _ = parser.parse_known_args([arg_filename_with_prefix])
+else:
+    args, _ = parser.parse_known_args()
+
+if args.loader == 'wild':
+    from dataloaders.anything_wild_dataloader import NewDataLoader
+else:
+    from dataloaders.anywhu_dataloader import NewDataLoader
+
+
+def main():
+    args.distributed = False
+    args.multiprocessing_distributed = False
+
+    model = NewCRFDepth(encoder=args.encoder, inv_depth=False, max_depth=args.max_depth)
+    if args.pretrain:
+        load_backbone(model, args.pretrain)
+    model = torch.nn.DataParallel(model)
+    model.cuda()
+    model.eval()
+    cudnn.benchmark = True
+
+    dataloader_eval = NewDataLoader(args, 'online_eval')
+    # one writer and one set of best checkpoints per training run, keyed on its log folder
+    runs = {}
+    print('== Waiting for snapshots in {}'.format(args.eval_queue))
+
+    while True:
+        snapshots = pending_snapshots(args.eval_queue)
+        if not snapshots:
+            if args.exit_when_empty:
+                break
+            time.sleep(args.poll_interval)
+            continue
+        if args.latest_only:
+            for path in snapshots[:-1]:
+                os.remove(path)
+            snapshots = snapshots[-1:]
+
+        path = snapshots[0]
+        snapshot = torch.load(path, map_location='cpu')
+        global_step, log_path = snapshot['global_step'], snapshot['log_path']
+        print('== Evaluating {} (global_step {})'.format(os.path.basename(path), global_step))
+        load_model_checkpoint(model, snapshot, args.pretrain, backbone_loaded=bool(args.pretrain))
+
+        with torch.no_grad():
+            eval_measures = online_eval(model, dataloader_eval, 0, args, post_process=True)
+
+        if log_path not in runs:
+            if args.eval_summary_directory != '':
+                eval_summary_path = os.path.join(args.eval_summary_directory, args.model_name)
+            else:
+                eval_summary_path = os.path.join(log_path, 'eval')
+            # the best values of the run are restored from its best.json after a restart
+            best_checkpoints = BestCheckpoints(log_path, eval_metrics)
+            runs[log_path] = (SummaryWriter(eval_summary_path, flush_secs=30), best_checkpoints)
+        eval_summary_writer, best_checkpoints = runs[log_path]
+
+        write_eval_log(log_path, global_step, eval_measures)
+        for i in range(9):
+            eval_summary_writer.add_scalar(eval_metrics[i], eval_measures[i].cpu(), int(global_step))
+        # the best checkpoints hold the weights of the snapshot, in its format, but no optimizer state
+        best_checkpoints.update(global_step, eval_measures,
+                                lambda: {k: v for k, v in snapshot.items()
+                                         if k in ('global_step', 'model', 'backbone')})
+        eval_summary_writer.flush()
+
+        if args.keep_snapshots:
+            os.makedirs(os.path.join(args.eval_queue, 'done'), exist_ok=True)
+            os.replace(path, os.path.join(args.eval_queue, 'done', os.path.basename(path)))
+        else:
+            os.remove(path)
+
+    for eval_summary_writer, _ in runs.values():
+        eval_summary_writer.close()
+
+
+if __name__ == '__main__':
+    main()
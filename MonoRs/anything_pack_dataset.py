@@ -0,0 +1,65 @@
+from torch.utils.data import Dataset, DataLoader
+
+import os, sys
+import argparse
+from tqdm import tqdm
+
+from utils import convert_arg_line_to_args
+from dataloaders.anywhu_dataloader import DataLoadPreprocess
+from dataloaders.packed_store import PackedStore
+
+
+parser = argparse.ArgumentParser(description='Pack the decoded images and masked depths of a split file into '
+                                             'memory-mapped shards.', fromfile_prefix_chars='@')
+parser.convert_arg_line_to_args = convert_arg_line_to_args
+
+parser.add_argument('--data_path', type=str, help='path to the data', required=True)
+parser.add_argument('--gt_path', type=str, help='path to the groundtruth data', required=True)
+parser.add_argument('--filenames_file', type=str, help='path to the filenames text file', required=True)
+parser.add_argument('--packed_path', type=str, help='output directory of the packed store', required=True)
+parser.add_argument('--depth_dtype', type=str, help='storage type of the depth; float16 steps are 0.25 m above '
+                                                    '256 m', default='float16', choices=['float16', 'float32'])
+parser.add_argument('--num_threads', type=int, help='number of threads to use for decoding', default=4)
+parser.add_argument('--shard_size', type=int, help='number of samples per shard file', default=1024)
+
+if sys.argv.__len__() == 2:
+    arg_filename_with_prefix = '@' + sys.argv[1]
+    args, _ = parser.parse_known_args([arg_filename_with_prefix])
+else:
+    args, _ = parser.parse_known_args()
+
+
+class DecodedSamples(Dataset):
+    """The decoded, un-augmented samples of a DataLoadPreprocess."""
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __getitem__(self, idx):
+        return idx, self.dataset.load_image(idx), self.dataset.load_depth(idx)[:, :, 0]
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+def main():
+    args.distributed = False
+    dataset = DataLoadPreprocess(args, 'train')
+    dataloader = DataLoader(DecodedSamples(dataset), batch_size=None, shuffle=False, num_workers=args.num_threads)
+
+    store = None
+    for idx, image, depth in tqdm(dataloader):
+        image, depth = image.numpy(), depth.numpy()
+        if store is None:
+            store = PackedStore.create(args.packed_path, dataset.filenames, image.shape, depth_dtype=args.depth_dtype,
+                                       shard_size=args.shard_size)
+        if image.shape != tuple(store.meta['image_shape']):
+            raise ValueError('{} has shape {}, the packed store holds {}'.format(
+                dataset.image_path(idx), image.shape, tuple(store.meta['image_shape'])))
+        store.write(int(idx), image, depth)
+
+    store.flush()
+    print('== Packed {} samples in {}'.format(len(store), os.path.abspath(args.packed_path)))
+
+
+if __name__ == '__main__':
+    main()
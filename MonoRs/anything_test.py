@@ -12,9 +12,12 @@ import cv2
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 
-from utils import post_process_depth, flip_lr
+from tta import TestTimeAugmentation, newcrf_predict, DEFAULT_VIEWS
+from precision import PRECISIONS
+from checkpoints import load_model_checkpoint
 from new_networks.NewCRFDepth import NewCRFDepth
-from dataloaders.anywhu_dataloader import NewDataLoader
+from dataloaders.anywhu_dataloader import NewDataLoader, unpadded_size, BORDER_WIDTH
+from dataloaders.device_preprocess import DevicePreprocess
 
 def convert_arg_line_to_args(arg_line):
     for arg in arg_line.split():
@@ -33,6 +36,24 @@ parser.add_argument('--filenames_file', type=str, help='path to the filenames te
 parser.add_argument('--max_depth', type=float, help='maximum depth in estimation', default=10)
 parser.add_argument('--min_depth', type=float, help='maximum depth in estimation', default=0.01)
 parser.add_argument('--checkpoint_path', type=str, help='path to a specific checkpoint to load', default='')
+parser.add_argument('--pretrain', type=str, help='path of the pretrained encoder a trainable-only checkpoint was '
+                                                 'trained with, defaults to the path recorded in it', default=None)
+parser.add_argument('--exit_threshold', type=float, help='if set, stop refining an image once its mean uncertainty '
+                                                         'is below this value', default=None)
+parser.add_argument('--exit_min_delta', type=float, help='with --exit_threshold, also stop once the uncertainty '
+                                                         'improves by less than this value', default=None)
+parser.add_argument('--exit_tile', type=int, help='with --exit_threshold, decide per tile of this size (in 1/4 '
+                                                  'resolution pixels) instead of per image', default=None)
+parser.add_argument('--uint8_transport', help='if set, the loader workers emit uint8 images that are cast, '
+                                              'normalized and padded on the GPU', action='store_true')
+parser.add_argument('--thread_loader', help='if set, decode with a thread pool of the main process instead of '
+                                            'a worker process', action='store_true')
+parser.add_argument('--loader_threads', type=int, help='number of decoding threads of --thread_loader', default=4)
+parser.add_argument('--precision', type=str, help='autocast precision of the backbone, the CRFs and the GRU',
+                    default='fp32', choices=PRECISIONS)
+parser.add_argument('--tta_views', type=str, nargs='+', help='test-time augmentation views run as one batch, e.g. '
+                                                             'identity hflip vflip scale0.75 scale0.75+hflip',
+                    default=list(DEFAULT_VIEWS))
 
 
 
@@ -59,14 +80,15 @@ def get_num_lines(file_path):
 def test(params):
     """Test function."""
     args.mode = 'test'
+    args.thread_loader_modes = ['test'] if args.thread_loader else []
     dataloader = NewDataLoader(args, 'test')
 
     model = NewCRFDepth(encoder='vitl', inv_depth=False, max_depth=args.max_depth,min_depth=args.min_depth)
     print("ok")
     model = torch.nn.DataParallel(model)
 
-    checkpoint = torch.load(args.checkpoint_path)
-    model.load_state_dict(checkpoint['model'])
+    checkpoint = torch.load(args.checkpoint_path, map_location='cpu')
+    load_model_checkpoint(model, checkpoint, args.pretrain)
     model.eval()
     model.cuda()
 
@@ -80,21 +102,27 @@ def test(params):
 
     print('now testing {} files with {}'.format(num_test_samples, args.checkpoint_path))
 
+    early_exit = None
+    if args.exit_threshold is not None:
+        early_exit = {'threshold': args.exit_threshold, 'min_delta': args.exit_min_delta, 'tile': args.exit_tile}
+    num_iters = []
+    tta = TestTimeAugmentation(newcrf_predict(model, precision=args.precision, early_exit=early_exit),
+                               views=args.tta_views)
+
+    preprocess = DevicePreprocess(BORDER_WIDTH, device='cuda')
+
     pred_depths = []
     start_time = time.time()
     with torch.no_grad():
         for step, sample in enumerate(tqdm(dataloader.data)):
-            image = Variable(sample['image'].cuda())
+            image = Variable(preprocess(sample['image']))
            
 
             # Predict
 
-            pred_depths_r_list, _, _ = model(image)
-            post_process = True
-            if post_process:
-                image_flipped = flip_lr(image)
-                pred_depths_r_list_flipped, _, _ = model(image_flipped)
-                pred_depth = post_process_depth(pred_depths_r_list[-1], pred_depths_r_list_flipped[-1])
+            pred_depth, iters = tta(image, target_size=unpadded_size(image.shape[-2:]))
+            if early_exit is not None:
+                num_iters.append(iters.item())
 
             pred_depth = pred_depth.cpu().numpy().squeeze()
 
@@ -106,6 +134,8 @@ def test(params):
 
     elapsed_time = time.time() - start_time
     print('Elapesed time: %s' % str(elapsed_time))
+    if early_exit is not None:
+        print('Average refinement iterations: {:.2f}'.format(np.mean(num_iters)))
     print('Done.')
 
     save_name = 'result_' + args.model_name
@@ -128,6 +158,11 @@ def test(params):
         cv2.imwrite(filename_pred_png, pred_depth_scaled, [cv2.IMWRITE_PNG_COMPRESSION, 0])
         plt.imsave(filename_pred_png, pred_depth_scaled, cmap='viridis')
 
+    if early_exit is not None:
+        with open(save_name + '/iterations.txt', 'w') as f:
+            for s in range(num_test_samples):
+                f.write('{} {}\n'.format(lines[s].split()[0], num_iters[s]))
+
     return
 
 
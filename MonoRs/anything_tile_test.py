@@ -0,0 +1,84 @@
+import torch
+
+import os, sys
+import argparse
+import time
+import numpy as np
+from PIL import Image
+
+from utils import convert_arg_line_to_args
+from tta import TestTimeAugmentation, newcrf_predict
+from tiling import TiledInference
+from precision import PRECISIONS
+from checkpoints import load_model_checkpoint
+from new_networks.NewCRFDepth import NewCRFDepth
+
+
+parser = argparse.ArgumentParser(description='Tiled inference of NewCRFDepth over large scenes.',
+                                 fromfile_prefix_chars='@')
+parser.convert_arg_line_to_args = convert_arg_line_to_args
+
+parser.add_argument('--encoder', type=str, help='type of encoder, vits, vitb, vitl, vitg', default='vitl')
+parser.add_argument('--max_depth', type=float, help='maximum depth in estimation', default=10)
+parser.add_argument('--min_depth', type=float, help='minimum depth in estimation', default=0.01)
+parser.add_argument('--checkpoint_path', type=str, help='path to a specific checkpoint to load', required=True)
+parser.add_argument('--pretrain', type=str, help='path of the pretrained encoder a trainable-only checkpoint was '
+                                                 'trained with, defaults to the path recorded in it', default=None)
+parser.add_argument('--image', type=str, help='scene image, or an (H, W, 3) .npy that is memory-mapped',
+                    required=True)
+parser.add_argument('--output', type=str, help='output .npy of the (H, W) float32 depth, written memory-mapped',
+                    required=True)
+parser.add_argument('--tile_height', type=int, help='tile height, a multiple of 28', default=392)
+parser.add_argument('--tile_width', type=int, help='tile width, a multiple of 28', default=784)
+parser.add_argument('--overlap_height', type=int, help='vertical overlap of neighbouring tiles', default=56)
+parser.add_argument('--overlap_width', type=int, help='horizontal overlap of neighbouring tiles', default=112)
+parser.add_argument('--batch_size', type=int, help='number of tiles per forward pass', default=4)
+parser.add_argument('--tta_views', type=str, nargs='+', help='test-time augmentation views of every tile',
+                    default=['identity'])
+parser.add_argument('--precision', type=str, help='autocast precision of the backbone, the CRFs and the GRU',
+                    default='fp32', choices=PRECISIONS)
+
+if sys.argv.__len__() == 2:
+    arg_filename_with_prefix = '@' + sys.argv[1]
+    args, _ = parser.parse_known_args([arg_filename_with_prefix])
+else:
+    args, _ = parser.parse_known_args()
+
+
+def load_scene(path):
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    # orthophotos exceed the decompression bomb limit of PIL
+    Image.MAX_IMAGE_PIXELS = None
+    return np.asarray(Image.open(path).convert('RGB'))
+
+
+def main():
+    model = NewCRFDepth(encoder=args.encoder, inv_depth=False, max_depth=args.max_depth, min_depth=args.min_depth)
+    model = torch.nn.DataParallel(model)
+    checkpoint = torch.load(args.checkpoint_path, map_location='cpu')
+    load_model_checkpoint(model, checkpoint, args.pretrain)
+    model.eval()
+    model.cuda()
+
+    predict = newcrf_predict(model, precision=args.precision)
+    if args.tta_views != ['identity']:
+        predict = TestTimeAugmentation(predict, views=args.tta_views)
+    engine = TiledInference(predict, (args.tile_height, args.tile_width), (args.overlap_height, args.overlap_width),
+                            batch_size=args.batch_size)
+
+    scene = load_scene(args.image)
+    ys, xs = engine.tiles(*scene.shape[:2])
+    print('== Scene {}x{}, {} tiles of {}x{}'.format(scene.shape[0], scene.shape[1], len(ys) * len(xs),
+                                                      args.tile_height, args.tile_width))
+
+    out = np.lib.format.open_memmap(args.output, mode='w+', dtype=np.float32, shape=scene.shape[:2])
+    start_time = time.time()
+    engine(scene, out)
+    out.flush()
+    print('Elapesed time: %s' % str(time.time() - start_time))
+    print('== Saved depth to {}'.format(os.path.abspath(args.output)))
+
+
+if __name__ == '__main__':
+    main()
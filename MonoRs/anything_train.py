@@ -9,16 +9,18 @@ import os, sys, time
 from telnetlib import IP
 import argparse
 import numpy as np
-from tqdm import tqdm
 
 from tensorboardX import SummaryWriter
 
-from utils import post_process_depth, flip_lr, silog_loss, compute_errors, eval_metrics, entropy_loss, colormap, \
+from utils import silog_loss, eval_metrics, entropy_loss, colormap, \
     block_print, enable_print, normalize_result, inv_normalize, convert_arg_line_to_args, colormap_magma
 from new_networks.NewCRFDepth import NewCRFDepth
 from new_networks.depth_update import *
 from datetime import datetime
 from sum_depth import Sum_depth
+from tta import DEFAULT_VIEWS
+from metrics import NEW_THRESHOLDS
+from precision import autocast, grad_scaler, PRECISIONS
 from networks.losses import *
 
 parser = argparse.ArgumentParser(description='IEBins PyTorch implementation.', fromfile_prefix_chars='@')
@@ -34,10 +36,22 @@ parser.add_argument('--dataset', type=str, help='dataset to train on, kitti or n
 parser.add_argument('--data_path', type=str, help='path to the data', required=True)
 parser.add_argument('--gt_path', type=str, help='path to the groundtruth data', required=True)
 parser.add_argument('--filenames_file', type=str, help='path to the filenames text file', required=True)
+parser.add_argument('--loader', type=str, help='data loader, whu (dataloaders.anywhu_dataloader) or wild '
+                                               '(dataloaders.anything_wild_dataloader)', default='whu',
+                    choices=['whu', 'wild'])
 parser.add_argument('--input_height', type=int, help='input height', default=480)
 parser.add_argument('--input_width', type=int, help='input width', default=640)
+parser.add_argument('--do_random_crop', help='with --loader wild, randomly crop the training samples to input_height '
+                                             'x input_width, reading only that window of the memory-mapped depth',
+                    action='store_true')
 parser.add_argument('--max_depth', type=float, help='maximum depth in estimation', default=10)
 parser.add_argument('--min_depth', type=float, help='minimum depth in estimation', default=0.1)
+parser.add_argument('--feature_cache', type=str, help='directory of precomputed backbone features, '
+                                                      'see anything_cache_features.py', default='')
+parser.add_argument('--packed_path', type=str, help='directory of the packed training samples, '
+                                                    'see anything_pack_dataset.py', default='')
+parser.add_argument('--split_cache', type=str, help='if set, directory where the parsed split files are cached as '
+                                                    'memory-mapped .npy', default='')
 
 # Log and save
 parser.add_argument('--log_directory', type=str, help='directory to save checkpoints and summaries', default='')
@@ -65,9 +79,20 @@ parser.add_argument('--degree', type=float, help='random rotation maximum degree
 parser.add_argument('--do_kb_crop', help='if set, crop input images as kitti benchmark images', action='store_true')
 parser.add_argument('--use_right', help='if set, will randomly use right images when train on KITTI',
                     action='store_true')
+parser.add_argument('--uint8_transport', help='if set, the loader workers emit uint8 images that are cast, '
+                                              'normalized and padded on the GPU', action='store_true')
+parser.add_argument('--device_augment', help='with --uint8_transport, if set, the flip, the gamma, brightness and '
+                                             'color augmentation and Cut_Flip run batched on the GPU',
+                    action='store_true')
+parser.add_argument('--augment_seed', type=int, help='seed of the GPU augmentation, offset by the rank', default=0)
 
 # Multi-gpu training
 parser.add_argument('--num_threads', type=int, help='number of threads to use for data loading', default=1)
+parser.add_argument('--thread_loader_modes', type=str, nargs='*', help='loader modes (train, online_eval) that decode '
+                    'with a thread pool of the main process instead of worker processes', default=[],
+                    choices=['train', 'online_eval'])
+parser.add_argument('--loader_threads', type=int, help='number of decoding threads of --thread_loader_modes',
+                    default=4)
 parser.add_argument('--world_size', type=int, help='number of nodes for distributed training', default=1)
 parser.add_argument('--rank', type=int, help='node rank for distributed training', default=0)
 parser.add_argument('--dist_url', type=str, help='url used to set up distributed training',
@@ -78,6 +103,12 @@ parser.add_argument('--multiprocessing_distributed', help='Use multi-processing
                                                           'N processes per node, which has N GPUs. This is the '
                                                           'fastest way to use PyTorch for either single node or '
                                                           'multi node data parallel training', action='store_true', )
+parser.add_argument('--precision', type=str, help='autocast precision of the backbone, the CRFs and the GRU, the '
+                                                 'bins and the losses stay in float32; fp16 uses loss scaling',
+                    default='fp32', choices=PRECISIONS)
+parser.add_argument('--find_unused_parameters', help='if set, DDP searches the graph for unused parameters every '
+                                                      'step instead of freezing the unused modules found by one '
+                                                      'dummy step at start-up', action='store_true')
 # Online eval
 parser.add_argument('--do_online_eval', help='if set, perform online eval in every eval_freq steps',
                     action='store_true')
@@ -86,6 +117,14 @@ parser.add_argument('--gt_path_eval', type=str, help='path to the groundtruth da
                     required=False)
 parser.add_argument('--filenames_file_eval', type=str, help='path to the filenames text file for online evaluation',
                     required=False)
+parser.add_argument('--batch_size_eval', type=int, help='online evaluation batch size', default=1)
+parser.add_argument('--num_threads_eval', type=int, help='number of threads for online evaluation data loading',
+                    default=1)
+parser.add_argument('--device_metrics', help='if set, online eval computes the metrics of the whole batch on the '
+                                             'device with metrics.compute_errors instead of per image with '
+                                             'utils.compute_errors', action='store_true')
+parser.add_argument('--new_thresholds', type=float, nargs=3, help='with --device_metrics, ratio thresholds of d1_new, '
+                                                                   'd2_new and d3_new', default=list(NEW_THRESHOLDS))
 parser.add_argument('--min_depth_eval', type=float, help='minimum depth for evaluation', default=10)
 parser.add_argument('--max_depth_eval', type=float, help='maximum depth for evaluation', default=80)
 parser.add_argument('--eigen_crop', help='if set, crops according to Eigen NIPS14', action='store_true')
@@ -93,6 +132,18 @@ parser.add_argument('--garg_crop', help='if set, crops according to Garg  ECCV16
 parser.add_argument('--eval_freq', type=int, help='Online evaluation frequency in global steps', default=500)
 parser.add_argument('--eval_summary_directory', type=str, help='output directory for eval summary,'
                                                                'if empty outputs to checkpoint folder', default='')
+parser.add_argument('--exit_threshold', type=float, help='if set, online eval stops refining an image once its mean '
+                                                         'uncertainty is below this value', default=None)
+parser.add_argument('--exit_min_delta', type=float, help='with --exit_threshold, also stop once the uncertainty '
+                                                         'improves by less than this value', default=None)
+parser.add_argument('--exit_tile', type=int, help='with --exit_threshold, decide per tile of this size (in 1/4 '
+                                                  'resolution pixels) instead of per image', default=None)
+parser.add_argument('--eval_queue', type=str, help='if set, online eval drops a snapshot of the trainable weights '
+                                                     'in this directory for anything_eval_worker.py instead of '
+                                                     'evaluating in the training loop', default='')
+parser.add_argument('--tta_views', type=str, nargs='+', help='online eval test-time augmentation views run as one '
+                                                             'batch, e.g. identity hflip vflip scale0.75',
+                    default=list(DEFAULT_VIEWS))
 
 if sys.argv.__len__() == 2:
     arg_filename_with_prefix = '@' + sys.argv[1]
@@ -101,59 +152,37 @@ else:
     args = parser.parse_args()
 
 
-from dataloaders.anywhu_dataloader import NewDataLoader
-
-
-def online_eval(model, dataloader_eval, gpu, epoch, ngpus, group, post_process=False):
-    eval_measures = torch.zeros(13).cuda(device=gpu)
-    for _, eval_sample_batched in enumerate(tqdm(dataloader_eval.data)):
-        with torch.no_grad():
-            image = torch.autograd.Variable(eval_sample_batched['image'].cuda(gpu, non_blocking=True))
-            gt_depth = eval_sample_batched['depth']
-
-            pred_depths_r_list, _, _ = model(image)
-
-            if post_process:
-                image_flipped = flip_lr(image)
-                pred_depths_r_list_flipped, _, _ = model(image_flipped)
-                pred_depth = post_process_depth(pred_depths_r_list[-1], pred_depths_r_list_flipped[-1])
-
-            pred_depth = pred_depth.cpu().numpy().squeeze()
-            gt_depth = gt_depth.cpu().numpy().squeeze()
-
-
-
-        pred_depth[pred_depth < args.min_depth_eval] = args.min_depth_eval
-        pred_depth[pred_depth > args.max_depth_eval] = args.max_depth_eval
-        pred_depth[np.isinf(pred_depth)] = args.max_depth_eval
-        pred_depth[np.isnan(pred_depth)] = args.min_depth_eval
-
-
-        valid_mask = np.logical_and(gt_depth > args.min_depth_eval, gt_depth < args.max_depth_eval)
-
-        measures = compute_errors(gt_depth[valid_mask], pred_depth[valid_mask])
-
-        eval_measures[:12] += torch.tensor(measures).cuda(device=gpu)
-        eval_measures[12] += 1
-
-    if args.multiprocessing_distributed:
-
-        dist.all_reduce(tensor=eval_measures, op=dist.ReduceOp.SUM, group=group)
-
-    if not args.multiprocessing_distributed or gpu == 0:
-        eval_measures_cpu = eval_measures.cpu()
-        cnt = eval_measures_cpu[12].item()
-        eval_measures_cpu /= cnt
-        print('Computing errors for {} eval samples'.format(int(cnt)), ', post_process: ', post_process)
-        print("{:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}".format('silog', 'abs_rel', 'log10', 'rms',
-                                                                                     'sq_rel', 'log_rms', 'd1', 'd2',
-                                                                                     'd3','d1_new','d2_new','d3_new'))
-        for i in range(11):
-            print('{:7.4f}, '.format(eval_measures_cpu[i]), end='')
-        print('{:7.4f}'.format(eval_measures_cpu[11]))
-        return eval_measures_cpu
-
-    return None
+if args.loader == 'wild':
+    if args.feature_cache or args.packed_path:
+        raise ValueError('--feature_cache and --packed_path need --loader whu')
+    from dataloaders.anything_wild_dataloader import NewDataLoader, BORDER_WIDTH
+else:
+    from dataloaders.anywhu_dataloader import NewDataLoader, BORDER_WIDTH
+from dataloaders.device_preprocess import DevicePreprocess
+from dataloaders.device_augment import DeviceAugment
+from evaluation import online_eval, write_eval_log
+from trainable import trainable_parameters, unused_modules, optimizer_param_names, load_optimizer_state
+from checkpoints import BestCheckpoints, save_snapshot, load_backbone, model_checkpoint, load_model_checkpoint
+
+
+def freeze_unused_modules(model, device):
+    """Run one training step of ``model`` on a dummy batch, then freeze and list the modules whose trainable
+    parameters got no gradient, so that DDP can run without ``find_unused_parameters``."""
+    # which parameters are used does not depend on the input size; eval mode leaves the batch norm statistics alone
+    image = torch.rand(1, 3, 196, 392, device='cuda' if device is None else device)
+    model.eval()
+    pred_depths_r_list, _, _ = model(image)
+    sum(pred.mean() for pred in pred_depths_r_list).backward()
+    model.train()
+    modules = unused_modules(model)
+    for p in model.parameters():
+        p.grad = None
+    for name in modules:
+        for p in model.get_submodule(name).parameters():
+            p.requires_grad = False
+    if modules:
+        print("== Frozen unused modules: {}".format(', '.join(modules)))
+    return modules
 
 
 def main_worker(gpu, ngpus_per_node, args):
@@ -173,13 +202,11 @@ def main_worker(gpu, ngpus_per_node, args):
     # model = NewCRFDepth(encoder=args.encoder, inv_depth=False,max_depth=args.max_depth,  pretrained=args.pretrain)
     model = NewCRFDepth(encoder=args.encoder, inv_depth=False,max_depth=args.max_depth)
     if args.pretrain:
-        model.load_state_dict({k: v for k, v in torch.load(args.pretrain, map_location='cpu').items() if 'pretrained' in k}, strict=False)
+        load_backbone(model, args.pretrain)
     model.train()
 
     #冻结backbone
-    for name,param in model.named_parameters():
-        if 'pretrained' in name:
-            param.requires_grad=False
+    model.freeze_backbone()
 
     num_params = sum([np.prod(p.size()) for p in model.parameters()])
     print("== Total number of parameters: {}".format(num_params))
@@ -195,10 +222,17 @@ def main_worker(gpu, ngpus_per_node, args):
             torch.cuda.set_device(args.gpu)
             model.cuda(args.gpu)
             args.batch_size = int(args.batch_size / ngpus_per_node)
-            model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[args.gpu], find_unused_parameters=True)
         else:
             model.cuda()
-            model = torch.nn.parallel.DistributedDataParallel(model, find_unused_parameters=True)
+        if not args.find_unused_parameters:
+            # the all-reduce then covers exactly the parameters every step produces gradients for
+            freeze_unused_modules(model, args.gpu)
+        if args.gpu is not None:
+            model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[args.gpu],
+                                                              find_unused_parameters=args.find_unused_parameters)
+        else:
+            model = torch.nn.parallel.DistributedDataParallel(model,
+                                                              find_unused_parameters=args.find_unused_parameters)
     else:
         model = torch.nn.DataParallel(model)
         model.cuda()
@@ -209,13 +243,12 @@ def main_worker(gpu, ngpus_per_node, args):
         print("== Model Initialized")
 
     global_step = 0
-    best_eval_measures_lower_better = torch.zeros(6).cpu() + 1e3
-    best_eval_measures_higher_better = torch.zeros(3).cpu()
-    best_eval_steps = np.zeros(9, dtype=np.int32)
+    best_checkpoints = BestCheckpoints(os.path.join(args.log_directory, args.model_name), eval_metrics)
 
     # Training parameters
-    optimizer = torch.optim.Adam([{'params': model.module.parameters()}],
+    optimizer = torch.optim.Adam([{'params': trainable_parameters(model.module)}],
                                  lr=args.learning_rate)
+    scaler = grad_scaler(args.precision)
 
     model_just_loaded = False
     if args.checkpoint_path != '':
@@ -226,18 +259,26 @@ def main_worker(gpu, ngpus_per_node, args):
             else:
                 loc = 'cuda:{}'.format(args.gpu)
                 checkpoint = torch.load(args.checkpoint_path, map_location=loc)
-            model.load_state_dict(checkpoint['model'])
-            optimizer.load_state_dict(checkpoint['optimizer'])
+            # a trainable-only checkpoint is completed with the backbone of --pretrain, loaded above
+            load_model_checkpoint(model, checkpoint, args.pretrain, backbone_loaded=bool(args.pretrain))
+            # the best checkpoints of anything_eval_worker.py hold the weights only
+            if 'optimizer' in checkpoint:
+                load_optimizer_state(optimizer, checkpoint['optimizer'], model.module,
+                                     checkpoint.get('optimizer_param_names'))
+            else:
+                print("== Warning: '{}' has no optimizer state, the optimizer starts afresh".format(
+                    args.checkpoint_path))
+            if 'scaler' in checkpoint:
+                scaler.load_state_dict(checkpoint['scaler'])
             if not args.retrain:
                 try:
                     global_step = checkpoint['global_step']
-                    best_eval_measures_higher_better = checkpoint['best_eval_measures_higher_better'].cpu()
-                    best_eval_measures_lower_better = checkpoint['best_eval_measures_lower_better'].cpu()
-                    best_eval_steps = checkpoint['best_eval_steps']
+                    best_checkpoints.load_state(checkpoint)
                 except KeyError:
                     print("Could not load values for online evaluation")
 
-            print("== Loaded checkpoint '{}' (global_step {})".format(args.checkpoint_path, checkpoint['global_step']))
+            print("== Loaded checkpoint '{}' (global_step {})".format(args.checkpoint_path,
+                                                                       checkpoint.get('global_step')))
         else:
             print("== No checkpoint found at '{}'".format(args.checkpoint_path))
         model_just_loaded = True
@@ -246,14 +287,22 @@ def main_worker(gpu, ngpus_per_node, args):
     cudnn.benchmark = True
 
     dataloader = NewDataLoader(args, 'train')
-    dataloader_eval = NewDataLoader(args, 'online_eval')
+    if args.do_online_eval and not args.eval_queue:
+        dataloader_eval = NewDataLoader(args, 'online_eval')
+    preprocess = DevicePreprocess(BORDER_WIDTH, device=args.gpu)
+    augment = None
+    if args.device_augment:
+        if not args.uint8_transport:
+            raise ValueError('--device_augment needs --uint8_transport')
+        # the wild loader does not Cut_Flip its samples
+        augment = DeviceAugment(args.augment_seed + args.rank, device=args.gpu, cut_flip=args.loader != 'wild')
 
 
 
     # Logging
     if not args.multiprocessing_distributed or (args.multiprocessing_distributed and args.rank % ngpus_per_node == 0):
         writer = SummaryWriter(args.log_directory + '/' + args.model_name + '/summaries', flush_secs=30)
-        if args.do_online_eval:
+        if args.do_online_eval and not args.eval_queue:
             if args.eval_summary_directory != '':
                 eval_summary_path = os.path.join(args.eval_summary_directory, args.model_name)
             else:
@@ -293,31 +342,49 @@ def main_worker(gpu, ngpus_per_node, args):
 
 
 
-            image = torch.autograd.Variable(sample_batched['image'].cuda(args.gpu, non_blocking=True))
             depth_gt = torch.autograd.Variable(sample_batched['depth'].cuda(args.gpu, non_blocking=True))
 
-
-            pred_depths_r_list, pred_depths_c_list, uncertainty_maps_list = model(image, epoch, step)
+            if 'feats' in sample_batched:
+                feats = [feat.cuda(args.gpu, non_blocking=True).float() for feat in sample_batched['feats']]
+                with autocast(args.precision, args.gpu):
+                    pred_depths_r_list, pred_depths_c_list, uncertainty_maps_list = model(
+                        None, epoch, step, feats=feats, target_size=depth_gt.shape[-2:])
+            else:
+                if augment is not None:
+                    image, depth_gt = augment(preprocess.to_unit(sample_batched['image']), depth_gt)
+                    image = preprocess.pad_normalize(image)
+                else:
+                    image = torch.autograd.Variable(preprocess(sample_batched['image']))
+                with autocast(args.precision, args.gpu):
+                    pred_depths_r_list, pred_depths_c_list, uncertainty_maps_list = model(
+                        image, epoch, step, target_size=depth_gt.shape[-2:])
+            # the losses are computed in float32
+            pred_depths_r_list = [pred.float() for pred in pred_depths_r_list]
 
             mask = depth_gt > 1.0
             max_tree_depth = len(pred_depths_r_list)
 
+            # the clustered target only depends on depth_gt, build it once for all iterations
+            ad_target = Multi_Modal_Target(depth_gt, mask.to(torch.bool), maxdepth=args.max_depth, m=1, n=9, top_k=9,
+                                           epsilon=3, min_samples=1)
+
             for curr_tree_depth in range(max_tree_depth):
 
 
                 si_loss += silog_criterion.forward(pred_depths_r_list[curr_tree_depth], depth_gt, mask.to(torch.bool))
-                ad_loss+=Adaptive_Multi_Modal_Cross_Entropy_Loss(pred_depths_r_list[curr_tree_depth],depth_gt,mask.to(torch.bool),maxdepth=args.max_depth,m=1,n=9,top_k=9,epsilon=3,min_samples=1)
+                ad_loss += Multi_Modal_Cross_Entropy_Loss(pred_depths_r_list[curr_tree_depth], ad_target)
 
             #loss = si_loss
             loss = 0.5*si_loss+0.5*ad_loss
 
-            loss.backward()  # 不同308-315
+            scaler.scale(loss).backward()  # 不同308-315
             for param_group in optimizer.param_groups:
                 current_lr = (args.learning_rate - end_learning_rate) * (
                             1 - global_step / num_total_steps) ** 0.9 + end_learning_rate
                 param_group['lr'] = current_lr
 
-            optimizer.step()
+            scaler.step(optimizer)
+            scaler.update()
 
             if not args.multiprocessing_distributed or (
                     args.multiprocessing_distributed and args.rank % ngpus_per_node == 0):
@@ -345,61 +412,37 @@ def main_worker(gpu, ngpus_per_node, args):
                 if not args.multiprocessing_distributed or (args.multiprocessing_distributed
                                                             and args.rank % ngpus_per_node == 0):
                     writer.add_scalar('silog_loss', si_loss, global_step)
+                    writer.add_scalar('cluster_steps', ad_target['cluster_steps'].item(), global_step)
                     # writer.add_scalar('var_loss', var_loss, global_step)
                     writer.add_scalar('learning_rate', current_lr, global_step)
                     writer.add_scalar('var average', var_sum.item() / var_cnt, global_step)
 
                     writer.flush()
 
-            if args.do_online_eval and global_step and global_step % args.eval_freq == 0 and not model_just_loaded:
+            if args.do_online_eval and args.eval_queue and global_step and global_step % args.eval_freq == 0 \
+                    and not model_just_loaded:
+                # the eval worker evaluates the snapshot while training goes on
+                if not args.multiprocessing_distributed or (args.multiprocessing_distributed
+                                                            and args.rank % ngpus_per_node == 0):
+                    save_snapshot(args.eval_queue, model, global_step, epoch,
+                                  os.path.join(args.log_directory, args.model_name), pretrain=args.pretrain)
+
+            elif args.do_online_eval and global_step and global_step % args.eval_freq == 0 and not model_just_loaded:
                 time.sleep(0.1)
                 model.eval()
                 with torch.no_grad():
-                    eval_measures = online_eval(model, dataloader_eval, gpu, epoch, ngpus_per_node, group,post_process=True)
+                    eval_measures = online_eval(model, dataloader_eval, gpu, args, group, post_process=True)
                 if eval_measures is not None:
-                    exp_name = '%s' % (datetime.now().strftime('%m%d'))
-                    log_txt = os.path.join(args.log_directory + '/' + args.model_name, exp_name + '_logs.txt')
-                    with open(log_txt, 'a') as txtfile:
-                        txtfile.write(
-                            ">>>>>>>>>>>>>>>>>>>>>>>>>Step:%d>>>>>>>>>>>>>>>>>>>>>>>>>\n" % (int(global_step)))
-                        txtfile.write("{:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}, {:>7}\n".format('silog',
-                                        'abs_rel','log10','rms','sq_rel','log_rms','d1','d2','d3','d1_new','d2_new','d3_new'))
-                        txtfile.write("depth estimation\n")
-                        line = ''
-                        for i in range(12):
-                            line += '{:7.4f}, '.format(eval_measures[i])
-                        txtfile.write(line + '\n')  # 356-367额外添加
+                    write_eval_log(os.path.join(args.log_directory, args.model_name), global_step, eval_measures)
 
                     for i in range(9):
                         eval_summary_writer.add_scalar(eval_metrics[i], eval_measures[i].cpu(), int(global_step))
-                        measure = eval_measures[i]
-                        is_best = False
-                        if i < 6 and measure < best_eval_measures_lower_better[i]:
-                            old_best = best_eval_measures_lower_better[i].item()
-                            best_eval_measures_lower_better[i] = measure.item()
-                            is_best = True
-                        elif i >= 6 and measure > best_eval_measures_higher_better[i - 6]:
-                            old_best = best_eval_measures_higher_better[i - 6].item()
-                            best_eval_measures_higher_better[i - 6] = measure.item()
-                            is_best = True
-                        if is_best:
-                            old_best_step = best_eval_steps[i]
-                            old_best_name = '/model-{}-best_{}_{:.5f}'.format(old_best_step, eval_metrics[i], old_best)
-                            model_path = args.log_directory + '/' + args.model_name + old_best_name
-                            if os.path.exists(model_path):
-                                command = 'rm {}'.format(model_path)
-                                os.system(command)
-                            best_eval_steps[i] = global_step
-                            model_save_name = '/model-{}-best_{}_{:.5f}'.format(global_step, eval_metrics[i], measure)
-                            print('New best for {}. Saving model: {}'.format(eval_metrics[i], model_save_name))
-                            checkpoint = {'global_step': global_step,
-                                          'model': model.state_dict(),
-                                          'optimizer': optimizer.state_dict(),
-                                          'best_eval_measures_higher_better': best_eval_measures_higher_better,
-                                          'best_eval_measures_lower_better': best_eval_measures_lower_better,
-                                          'best_eval_steps': best_eval_steps
-                                          }
-                            torch.save(checkpoint, args.log_directory + '/' + args.model_name + model_save_name)
+                    best_checkpoints.update(global_step, eval_measures,
+                                            lambda: dict(model_checkpoint(model, args.pretrain),
+                                                         global_step=global_step,
+                                                         optimizer=optimizer.state_dict(),
+                                                         optimizer_param_names=optimizer_param_names(model.module),
+                                                         scaler=scaler.state_dict()))
                     eval_summary_writer.flush()
                 model.train()
                 block_print()
@@ -412,7 +455,7 @@ def main_worker(gpu, ngpus_per_node, args):
 
     if not args.multiprocessing_distributed or (args.multiprocessing_distributed and args.rank % ngpus_per_node == 0):
         writer.close()
-        if args.do_online_eval:
+        if args.do_online_eval and not args.eval_queue:
             eval_summary_writer.close()
 
 
@@ -455,6 +498,9 @@ def main():
         print("You have specified --do_online_eval.")
         print("This will evaluate the model every eval_freq {} steps and save best models for individual eval metrics."
               .format(args.eval_freq))
+        if args.eval_queue:
+            os.makedirs(args.eval_queue, exist_ok=True)
+            print("The snapshots are queued in {} for anything_eval_worker.py.".format(args.eval_queue))
 
     if args.multiprocessing_distributed:
         args.world_size = ngpus_per_node * args.world_size
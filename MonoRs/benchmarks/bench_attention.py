@@ -0,0 +1,64 @@
+import argparse
+
+import torch
+
+from common import timeit, peak_memory, default_device
+from new_netwokrs.dinov2 import DINOv2
+from new_netwokrs.dinov2_layers.attention import (ATTENTION_BACKENDS, check_attention_backend,
+                                                   set_attention_backend)
+
+
+def available_backends():
+    backends = []
+    for backend in ATTENTION_BACKENDS:
+        try:
+            backends.append(check_attention_backend(backend))
+        except ValueError:
+            pass
+    return backends
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DINOv2 backbone forward with each attention backend')
+    parser.add_argument('--encoder', type=str, default='vitl')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4])
+    # 384x768 padded by BORDER_WIDTH
+    parser.add_argument('--height', type=int, default=392)
+    parser.add_argument('--width', type=int, default=784)
+    parser.add_argument('--backends', type=str, nargs='+', default=None,
+                        help='defaults to the available ones of xformers sdpa math')
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--device', type=str, default=default_device())
+    args = parser.parse_args()
+    backends = args.backends or available_backends()
+
+    torch.manual_seed(0)
+    model = DINOv2(args.encoder).to(args.device).eval()
+    tokens = (args.height // model.patch_size) * (args.width // model.patch_size) + 1
+    print('device: {}, encoder: {}, input: {}x{}, {} tokens'.format(args.device, args.encoder, args.height,
+                                                                     args.width, tokens))
+    print('{:>5}, {:>8}, {:>10}, {:>10}, {:>14}, {:>10}'.format('batch', 'backend', 'ms', 'peak MiB',
+                                                               'attn mat MiB', 'max diff'))
+    for batch_size in args.batch_sizes:
+        image = torch.rand(batch_size, 3, args.height, args.width, device=args.device)
+        # the (B, heads, N, N) matrix of one layer that the math backend materialises
+        attn_mib = batch_size * model.num_heads * tokens ** 2 * 4 / 2 ** 20
+
+        def forward():
+            with torch.no_grad():
+                return model.get_intermediate_layers(image, 4)[-1]
+
+        set_attention_backend(model, 'math')
+        reference = forward()
+        for backend in backends:
+            set_attention_backend(model, backend)
+            diff = (forward() - reference).abs().max().item()
+            peak = peak_memory(forward, args.device)
+            ms = timeit(forward, args.device, warmup=1, iters=args.iters)
+            print('{:5d}, {:>8}, {:10.1f}, {:>10}, {:>14}, {:10.2e}'.format(
+                batch_size, backend, ms, 'n/a' if peak is None else '{:.1f}'.format(peak),
+                '{:.1f}'.format(attn_mib) if backend == 'math' else '-', diff))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import copy
+import random
+
+import numpy as np
+import torch
+
+from common import timeit, default_device
+from dataloaders.device_augment import DeviceAugment
+
+
+def augment_numpy(image, depth_gt):
+    """The per-sample train_preprocess of the loaders, kept as the reference."""
+    if random.random() > 0.5:
+        image = (image[:, ::-1, :]).copy()
+        depth_gt = (depth_gt[:, ::-1, :]).copy()
+
+    if random.random() > 0.5:
+        gamma = random.uniform(0.9, 1.1)
+        image_aug = image ** gamma
+        brightness = random.uniform(0.9, 1.1)
+        image_aug = image_aug * brightness
+        colors = np.random.uniform(0.9, 1.1, size=3)
+        white = np.ones((image.shape[0], image.shape[1]))
+        color_image = np.stack([white * colors[i] for i in range(3)], axis=2)
+        image_aug *= color_image
+        image = np.clip(image_aug, 0, 1)
+
+    return image, depth_gt
+
+
+def cut_flip_copy(image, depth):
+    """The deep-copy Cut_Flip of the loaders, kept as the reference."""
+    if random.random() < 0.5:
+        return image, depth
+    image_copy = copy.deepcopy(image)
+    depth_copy = copy.deepcopy(depth)
+    h = image.shape[0]
+    h_list = [random.randint(int(0.2 * h), int(0.8 * h)), h, 0]
+    h_list.sort()
+    h_list_inv = np.array([h] * 3) - np.array(h_list)
+    h_interval_list = [h_list[i + 1] - h_list[i] for i in range(2)]
+    for i in range(2):
+        image[h_list[i]:h_list[i + 1]] = image_copy[h_list_inv[i] - h_interval_list[i]:h_list_inv[i]]
+        depth[h_list[i]:h_list[i + 1]] = depth_copy[h_list_inv[i] - h_interval_list[i]:h_list_inv[i]]
+    return image, depth
+
+
+def cut_flip_gather(image, depth):
+    """The row-gather Cut_Flip of the loaders."""
+    if random.random() < 0.5:
+        return image, depth
+    h = image.shape[0]
+    cut = random.randint(int(0.2 * h), int(0.8 * h))
+    rows = (np.arange(h) - cut) % h
+    return image[rows], depth[rows]
+
+
+def check_cut_flip(augment, image, depth):
+    """Replay the drawn cuts of the batched Cut_Flip through the per-sample gather."""
+    state = augment.generator.get_state()
+    out, out_depth = augment.cut_flip_rows(image, depth)
+    augment.generator.set_state(state)
+    do_cut = torch.rand(image.shape[0], generator=augment.generator) >= 0.5
+    cut = torch.randint(int(0.2 * image.shape[-2]), int(0.8 * image.shape[-2]) + 1, (image.shape[0],),
+                        generator=augment.generator) * do_cut
+    for b in range(image.shape[0]):
+        assert torch.equal(out[b], image[b].roll(int(cut[b]), dims=-2))
+        assert torch.equal(out_depth[b], depth[b].roll(int(cut[b]), dims=-2))
+
+
+def check(augment, image, depth):
+    """Replay the drawn parameters of the batched path through the NumPy formula."""
+    state = augment.generator.get_state()
+    do_flip, do_augment, gamma, factor = augment.sample_params(image.shape[0])
+    augment.generator.set_state(state)
+    out, out_depth = augment(image.clone(), depth.clone())
+    for b in range(image.shape[0]):
+        ref = image[b].cpu().numpy().transpose(1, 2, 0).astype(np.float64)
+        if do_augment[b]:
+            ref = np.clip(ref ** gamma[b].item() * factor[b].view(1, 1, 3).cpu().numpy(), 0, 1)
+        ref_depth = depth[b].cpu().numpy()
+        if do_flip[b]:
+            ref, ref_depth = ref[:, ::-1], ref_depth[:, :, ::-1]
+        assert np.abs(out[b].cpu().numpy().transpose(1, 2, 0) - ref).max() < 1e-5
+        assert np.array_equal(out_depth[b].cpu().numpy(), ref_depth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='augmentation: per-sample NumPy vs batched torch')
+    parser.add_argument('--height', type=int, help='image height', default=384)
+    parser.add_argument('--width', type=int, help='image width', default=768)
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--device', type=str, default=default_device())
+    args = parser.parse_args()
+
+    augment = DeviceAugment(seed=0, device=args.device)
+    print('device: {}, image size: {}x{}'.format(args.device, args.height, args.width))
+    print('{:>5}, {:>10}, {:>10}, {:>7}'.format('batch', 'numpy ms', 'torch ms', 'speedup'))
+    for b in args.batch_sizes:
+        images = [np.random.rand(args.height, args.width, 3).astype(np.float32) for _ in range(b)]
+        depths = [np.random.rand(args.height, args.width, 1).astype(np.float32) for _ in range(b)]
+        image = torch.from_numpy(np.stack(images)).permute(0, 3, 1, 2).contiguous().to(args.device)
+        depth = torch.from_numpy(np.stack(depths)).permute(0, 3, 1, 2).contiguous().to(args.device)
+        check(augment, image, depth)
+        t_numpy = timeit(lambda: [augment_numpy(i, d) for i, d in zip(images, depths)], 'cpu')
+        # in place on the same batch, the values stay in [0, 1]
+        t_torch = timeit(lambda: augment(image, depth), args.device)
+        print('{:5d}, {:10.3f}, {:10.3f}, {:6.2f}x'.format(b, t_numpy, t_torch, t_numpy / t_torch))
+
+    print('Cut_Flip')
+    print('{:>5}, {:>10}, {:>10}, {:>10}'.format('batch', 'copy ms', 'gather ms', 'batched ms'))
+    for b in args.batch_sizes:
+        images = [np.random.rand(args.height, args.width, 3).astype(np.float32) for _ in range(b)]
+        depths = [np.random.rand(args.height, args.width, 1).astype(np.float32) for _ in range(b)]
+        for i, d in zip(images, depths):
+            state = random.getstate()
+            ref = cut_flip_copy(i.copy(), d.copy())
+            random.setstate(state)
+            out = cut_flip_gather(i, d)
+            assert np.array_equal(ref[0], out[0]) and np.array_equal(ref[1], out[1])
+        image = torch.from_numpy(np.stack(images)).permute(0, 3, 1, 2).contiguous().to(args.device)
+        depth = torch.from_numpy(np.stack(depths)).permute(0, 3, 1, 2).contiguous().to(args.device)
+        check_cut_flip(augment, image, depth)
+        t_copy = timeit(lambda: [cut_flip_copy(i, d) for i, d in zip(images, depths)], 'cpu')
+        t_gather = timeit(lambda: [cut_flip_gather(i, d) for i, d in zip(images, depths)], 'cpu')
+        t_batched = timeit(lambda: augment.cut_flip_rows(image, depth), args.device)
+        print('{:5d}, {:10.3f}, {:10.3f}, {:10.3f}'.format(b, t_copy, t_gather, t_batched))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import argparse
+
+import torch
+
+from common import timeit, peak_memory, default_device
+from new_netwokrs.NewCRFDepth import NewCRFDepth
+
+
+def saved_for_backward(fn):
+    """MiB of the tensors autograd saves for the backward pass during ``fn()``."""
+    saved = [0]
+
+    def pack(t):
+        saved[0] += t.numel() * t.element_size()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        fn()
+    return saved[0] / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description='training step with the frozen backbone recorded by autograd or '
+                                                 'run under no_grad (freeze_backbone)')
+    parser.add_argument('--encoder', type=str, default='vitl')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[4, 8])
+    # 384x768 padded by BORDER_WIDTH
+    parser.add_argument('--height', type=int, default=392)
+    parser.add_argument('--width', type=int, default=784)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--device', type=str, default=default_device())
+    args = parser.parse_args()
+
+    model = NewCRFDepth(encoder=args.encoder, inv_depth=False).to(args.device).train()
+    print('device: {}, encoder: {}, input: {}x{}'.format(args.device, args.encoder, args.height, args.width))
+    print('{:>5}, {:>13}, {:>10}, {:>12}, {:>10}'.format('batch', 'backbone', 'ms', 'saved MiB', 'peak MiB'))
+    for batch_size in args.batch_sizes:
+        image = torch.rand(batch_size, 3, args.height, args.width, device=args.device)
+        for mode in ('requires_grad', 'no_grad'):
+            for param in model.pretrained.parameters():
+                param.requires_grad = False
+            model.backbone_frozen = mode == 'no_grad'
+
+            def forward():
+                return model(image)[0]
+
+            def step():
+                model.zero_grad(set_to_none=True)
+                sum(pred.mean() for pred in forward()).backward()
+
+            saved = saved_for_backward(forward)
+            peak = peak_memory(step, args.device)
+            ms = timeit(step, args.device, warmup=1, iters=args.iters)
+            print('{:5d}, {:>13}, {:10.1f}, {:12.1f}, {:>10}'.format(
+                batch_size, mode, ms, saved, 'n/a' if peak is None else '{:.1f}'.format(peak)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse
+
+import torch
+
+from common import timeit, default_device
+from new_netwokrs.depth_update import get_label, update_sample
+
+
+def get_label_loop(gt_depth_img, bin_edges, depth_num):
+    """The per-bin loop get_label used to run, kept as the reference."""
+    with torch.no_grad():
+        gt_label = torch.zeros(gt_depth_img.size(), dtype=torch.int64, device=gt_depth_img.device)
+        for i in range(depth_num):
+            bin_mask = torch.ge(gt_depth_img, bin_edges[:, i])
+            bin_mask = torch.logical_and(bin_mask, torch.lt(gt_depth_img, bin_edges[:, i + 1]))
+            gt_label[bin_mask] = i
+        return gt_label
+
+
+def make_inputs(b, h, w, depth_num, min_depth, max_depth, device):
+    depth_r = torch.rand(b, 1, h, w, device=device) * (max_depth - min_depth) + min_depth
+    uncertainty = torch.rand(b, 1, h, w, device=device) * (max_depth - min_depth) / 4
+    bin_edges = torch.zeros(b, depth_num + 1, h, w, device=device)
+    bin_edges, _ = update_sample(bin_edges, None, None, depth_r, None, depth_num, min_depth, max_depth, uncertainty)
+    # the refined depth mostly falls inside the bins, with some outliers on both sides
+    depth = depth_r.squeeze(1) + torch.randn(b, h, w, device=device) * uncertainty.squeeze(1) / 2
+    return depth, bin_edges
+
+
+def main():
+    parser = argparse.ArgumentParser(description='get_label: per-bin loop vs batched searchsorted')
+    parser.add_argument('--height', type=int, help='input height', default=392)
+    parser.add_argument('--width', type=int, help='input width', default=784)
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--depth_num', type=int, default=16)
+    parser.add_argument('--min_depth', type=float, default=1e-3)
+    parser.add_argument('--max_depth', type=float, default=350)
+    parser.add_argument('--device', type=str, default=default_device())
+    args = parser.parse_args()
+
+    # BasicUpdateBlockDepth runs at 1/4 of the input resolution
+    h, w = args.height // 4, args.width // 4
+    print('device: {}, feature size: {}x{}, depth_num: {}'.format(args.device, h, w, args.depth_num))
+    print('{:>5}, {:>10}, {:>10}, {:>7}'.format('batch', 'loop ms', 'search ms', 'speedup'))
+    for b in args.batch_sizes:
+        depth, bin_edges = make_inputs(b, h, w, args.depth_num, args.min_depth, args.max_depth, args.device)
+        assert torch.equal(get_label_loop(depth, bin_edges, args.depth_num), get_label(depth, bin_edges, args.depth_num))
+        t_loop = timeit(lambda: get_label_loop(depth, bin_edges, args.depth_num), args.device)
+        t_search = timeit(lambda: get_label(depth, bin_edges, args.depth_num), args.device)
+        print('{:5d}, {:10.3f}, {:10.3f}, {:6.2f}x'.format(b, t_loop, t_search, t_loop / t_search))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+
+from common import default_device
+from dataloaders.thread_loader import ThreadDataLoader
+
+
+class SyntheticSamples(Dataset):
+    """PNG images and 16 bit PNG depths decoded like the loaders do, for when no split file is given."""
+    def __init__(self, root, num_samples, height, width):
+        self.root = root
+        self.num_samples = num_samples
+        rng = np.random.RandomState(0)
+        for i in range(num_samples):
+            Image.fromarray(rng.randint(0, 256, (height, width, 3)).astype(np.uint8)).save(self.path(i, 'image'))
+            cv2.imwrite(self.path(i, 'depth'), rng.randint(0, 2 ** 16, (height, width)).astype(np.uint16))
+
+    def path(self, idx, kind):
+        return os.path.join(self.root, '{}_{}.png'.format(kind, idx))
+
+    def __getitem__(self, idx):
+        image = np.asarray(Image.open(self.path(idx, 'image')), dtype=np.float32) / 255.0
+        depth = cv2.imread(self.path(idx, 'depth'), cv2.IMREAD_UNCHANGED).astype(np.float32)[None]
+        return {'image': torch.from_numpy(image.transpose(2, 0, 1)), 'depth': torch.from_numpy(depth), 'focal': 1.0}
+
+    def __len__(self):
+        return self.num_samples
+
+
+def throughput(loader, device, num_batches):
+    """Samples per second of ``loader``, including the copy to ``device``."""
+    n = 0
+    start = None
+    for b, batch in enumerate(loader):
+        if b == 1:
+            # the first batch includes the worker start-up
+            start = time.time()
+            n = 0
+        batch['image'].to(device, non_blocking=True)
+        batch['depth'].to(device, non_blocking=True)
+        n += batch['image'].shape[0]
+        if b == num_batches:
+            break
+    if device != 'cpu':
+        torch.cuda.synchronize()
+    return n / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='loader throughput: process workers vs thread pool')
+    parser.add_argument('--data_path', type=str, help='with --gt_path and --filenames_file, benchmark the WHU '
+                                                      'training loader instead of synthetic samples', default='')
+    parser.add_argument('--gt_path', type=str, default='')
+    parser.add_argument('--filenames_file', type=str, default='')
+    parser.add_argument('--num_samples', type=int, help='number of synthetic samples', default=64)
+    parser.add_argument('--height', type=int, default=384)
+    parser.add_argument('--width', type=int, default=768)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--num_batches', type=int, default=6)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--device', type=str, default=default_device())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        if args.filenames_file:
+            from dataloaders.anywhu_dataloader import DataLoadPreprocess, preprocessing_transforms
+            args.mode = 'train'
+            dataset = DataLoadPreprocess(args, 'train', transform=preprocessing_transforms('train'))
+        else:
+            dataset = SyntheticSamples(root, args.num_samples, args.height, args.width)
+
+        pin_memory = args.device != 'cpu'
+        print('device: {}, {} samples, batch {}'.format(args.device, len(dataset), args.batch_size))
+        print('{:>7}, {:>16}, {:>16}'.format('workers', 'process samples/s', 'thread samples/s'))
+        for k in args.workers:
+            process = DataLoader(dataset, args.batch_size, shuffle=True, num_workers=k, pin_memory=pin_memory)
+            thread = ThreadDataLoader(dataset, args.batch_size, shuffle=True, num_threads=k, pin_memory=pin_memory)
+            print('{:7d}, {:17.1f}, {:16.1f}'.format(k, throughput(process, args.device, args.num_batches),
+                                                     throughput(thread, args.device, args.num_batches)))
+
+
+if __name__ == '__main__':
+    main()
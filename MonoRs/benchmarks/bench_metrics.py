@@ -0,0 +1,64 @@
+import argparse
+
+import numpy as np
+import torch
+
+from common import timeit, default_device
+from metrics import compute_errors, compute_errors_reference, clip_prediction, METRIC_NAMES, NEW_THRESHOLDS
+
+
+def reference(gt, pred, min_depth, max_depth, new_thresholds=NEW_THRESHOLDS):
+    """The per-image loop of online_eval before batching."""
+    measures = []
+    for g, p in zip(gt, pred):
+        p = p.copy()
+        p[p < min_depth] = min_depth
+        p[p > max_depth] = max_depth
+        p[np.isinf(p)] = max_depth
+        p[np.isnan(p)] = min_depth
+        valid_mask = np.logical_and(g > min_depth, g < max_depth)
+        measures.append(compute_errors_reference(g[valid_mask], p[valid_mask], new_thresholds=new_thresholds))
+    return np.array(measures, dtype=np.float64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='batched torch metrics vs the per-image NumPy reference')
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--height', type=int, default=384)
+    parser.add_argument('--width', type=int, default=768)
+    parser.add_argument('--min_depth_eval', type=float, default=10)
+    parser.add_argument('--max_depth_eval', type=float, default=80)
+    parser.add_argument('--new_thresholds', type=float, nargs=3, default=list(NEW_THRESHOLDS))
+    parser.add_argument('--device', type=str, default=default_device())
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    shape = (args.batch_size, args.height, args.width)
+    gt = rng.uniform(0, 100, shape).astype(np.float32)
+    # a zero padded band, as left by a border, and a few non-finite predictions
+    gt[:, :, -16:] = 0
+    pred = (gt * rng.uniform(0.8, 1.25, shape) + rng.uniform(0, 5, shape)).astype(np.float32)
+    pred.reshape(-1)[rng.randint(0, pred.size, 100)] = np.inf
+    pred.reshape(-1)[rng.randint(0, pred.size, 100)] = np.nan
+
+    def batched():
+        g = torch.from_numpy(gt).to(args.device)
+        p = clip_prediction(torch.from_numpy(pred).to(args.device), args.min_depth_eval, args.max_depth_eval)
+        valid = torch.logical_and(g > args.min_depth_eval, g < args.max_depth_eval)
+        return compute_errors(g, p, valid, new_thresholds=args.new_thresholds).cpu().numpy()
+
+    ref = reference(gt, pred, args.min_depth_eval, args.max_depth_eval, args.new_thresholds)
+    out = batched()
+    print('device: {}, batch {} of {}x{}'.format(args.device, args.batch_size, args.height, args.width))
+    print('{:>8}, {:>12}, {:>12}'.format('metric', 'mean', 'max abs diff'))
+    for i, name in enumerate(METRIC_NAMES):
+        print('{:>8}, {:12.6f}, {:12.3e}'.format(name, ref[:, i].mean(), np.abs(ref[:, i] - out[:, i]).max()))
+
+    print('per-image NumPy: {:.1f} ms, batched torch: {:.1f} ms'.format(
+        timeit(lambda: reference(gt, pred, args.min_depth_eval, args.max_depth_eval, args.new_thresholds), 'cpu',
+               warmup=1, iters=3),
+        timeit(batched, args.device, warmup=1, iters=3)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import copy
+
+import torch
+
+from common import timeit, peak_memory, default_device
+from new_netwokrs.NewCRFDepth import NewCRFDepth
+from precision import autocast
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NewCRFDepth inference and training step under the --precision '
+                                                 'autocast, and the deviation of its depth from fp32')
+    parser.add_argument('--encoder', type=str, default='vitl')
+    parser.add_argument('--batch_size', type=int, default=4)
+    # 384x768 padded by BORDER_WIDTH
+    parser.add_argument('--height', type=int, default=392)
+    parser.add_argument('--width', type=int, default=784)
+    parser.add_argument('--precisions', type=str, nargs='+', default=None,
+                        help='defaults to fp32 bf16 fp16 on a GPU and fp32 bf16 on the CPU')
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--device', type=str, default=default_device())
+    args = parser.parse_args()
+    if args.precisions is None:
+        args.precisions = ['fp32', 'bf16', 'fp16'] if args.device.startswith('cuda') else ['fp32', 'bf16']
+
+    torch.manual_seed(0)
+    model = NewCRFDepth(encoder=args.encoder, inv_depth=False).to(args.device)
+    for param in model.pretrained.parameters():
+        param.requires_grad = False
+    image = torch.rand(args.batch_size, 3, args.height, args.width, device=args.device)
+    target_size = (args.height, args.width)
+
+    def inference(precision):
+        model.eval()
+        with torch.no_grad(), autocast(precision, args.device):
+            return model(image, inference=True, target_size=target_size)[0][-1].float()
+
+    reference = inference('fp32')
+    # the training steps update the batch norm statistics
+    state = copy.deepcopy(model.state_dict())
+    print('device: {}, encoder: {}, batch: {}, input: {}x{}'.format(args.device, args.encoder, args.batch_size,
+                                                                    args.height, args.width))
+    print('{:>9}, {:>12}, {:>12}, {:>14}, {:>13}'.format('precision', 'infer ms', 'step ms', 'step peak MiB',
+                                                         'abs rel diff'))
+    for precision in args.precisions:
+        def step():
+            model.train()
+            model.zero_grad(set_to_none=True)
+            with autocast(precision, args.device):
+                preds = model(image, target_size=target_size)[0]
+            sum(pred.float().mean() for pred in preds).backward()
+
+        model.load_state_dict(state)
+        diff = ((inference(precision) - reference).abs() / reference.abs().clamp(min=1e-6)).mean().item()
+        infer_ms = timeit(lambda: inference(precision), args.device, warmup=1, iters=args.iters)
+        step_ms = timeit(step, args.device, warmup=1, iters=args.iters)
+        peak = peak_memory(step, args.device)
+        print('{:>9}, {:12.1f}, {:12.1f}, {:>14}, {:13.2e}'.format(
+            precision, infer_ms, step_ms, 'n/a' if peak is None else '{:.1f}'.format(peak), diff))
+
+
+if __name__ == '__main__':
+    main()
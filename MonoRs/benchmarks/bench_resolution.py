@@ -0,0 +1,40 @@
+import argparse
+
+import torch
+
+from common import timeit, peak_memory, default_device
+from new_netwokrs.NewCRFDepth import NewCRFDepth
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NewCRFDepth inference latency and memory versus input size')
+    parser.add_argument('--encoder', type=str, default='vitl')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[196, 392, 280, 560, 392, 784, 504, 1008],
+                        help='flat list of H W pairs, both multiples of 28')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--device', type=str, default=default_device())
+    args = parser.parse_args()
+
+    model = NewCRFDepth(encoder=args.encoder, inv_depth=False).to(args.device).eval()
+    sizes = list(zip(args.sizes[::2], args.sizes[1::2]))
+
+    print('device: {}, encoder: {}, batch: {}'.format(args.device, args.encoder, args.batch_size))
+    print('{:>11}, {:>10}, {:>10}'.format('input', 'ms', 'peak MiB'))
+    for h, w in sizes:
+        assert h % 28 == 0 and w % 28 == 0, 'input size must be a multiple of 28, got {}x{}'.format(h, w)
+        image = torch.rand(args.batch_size, 3, h, w, device=args.device)
+
+        def run():
+            with torch.no_grad():
+                return model(image, inference=True)
+
+        assert run()[0][-1].shape[-2:] == (h, w)
+        t = timeit(run, args.device, warmup=1, iters=args.iters)
+        mem = peak_memory(run, args.device)
+        print('{:>11}, {:10.1f}, {:>10}'.format('{}x{}'.format(h, w), t,
+                                                 '-' if mem is None else '{:.0f}'.format(mem)))
+
+
+if __name__ == '__main__':
+    main()
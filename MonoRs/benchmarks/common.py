@@ -0,0 +1,40 @@
+import os, sys
+import time
+
+import torch
+
+# the benchmarks import the model code from the MonoRs directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synchronize(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def timeit(fn, device, warmup=3, iters=20):
+    """Average wall time of ``fn()`` in milliseconds."""
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    start = time.time()
+    for _ in range(iters):
+        fn()
+    synchronize(device)
+    return (time.time() - start) / iters * 1000
+
+
+def peak_memory(fn, device):
+    """Peak CUDA memory of ``fn()`` in MiB, None on CPU."""
+    if torch.device(device).type != 'cuda':
+        fn()
+        return None
+    torch.cuda.empty_cache()
+    torch.cuda.reset_peak_memory_stats(device)
+    fn()
+    synchronize(device)
+    return torch.cuda.max_memory_allocated(device) / 2 ** 20
+
+
+def default_device():
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
@@ -0,0 +1,241 @@
+import os
+import glob
+import hashlib
+import json
+import re
+import shutil
+
+import numpy as np
+import torch
+
+
+def atomic_save(obj, path):
+    """torch.save to a temporary file renamed over ``path``, so that a reader never sees a partial file."""
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    torch.save(obj, tmp)
+    os.replace(tmp, path)
+
+
+def head_state_dict(model):
+    """The state dict of ``model`` without the ``pretrained`` (DINOv2) backbone weights."""
+    return {k: v for k, v in model.state_dict().items() if 'pretrained' not in k}
+
+
+# sha256 of the pretrain files, keyed on path, size and modification time
+_sha256_cache = {}
+
+
+def file_sha256(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _sha256_cache:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 24), b''):
+                sha256.update(chunk)
+        _sha256_cache[key] = sha256.hexdigest()
+    return _sha256_cache[key]
+
+
+def load_backbone(model, pretrain):
+    """Load the ``pretrained`` (DINOv2) weights of the ``pretrain`` file into ``model``."""
+    model.load_state_dict({k: v for k, v in torch.load(pretrain, map_location='cpu').items() if 'pretrained' in k},
+                          strict=False)
+
+
+def model_checkpoint(model, pretrain=None):
+    """The ``model`` entries of a checkpoint of ``model`` (a DataParallel / DDP wrapper).
+
+    With the frozen backbone loaded from ``pretrain``, only the head weights are stored, keyed without the
+    ``module.`` prefix, along with the path and sha256 of ``pretrain``; ``load_model_checkpoint`` rebuilds the full
+    model from both. Without ``pretrain`` the full state dict of the wrapper is stored as before.
+    """
+    if not pretrain:
+        return {'model': model.state_dict()}
+    return {'model': head_state_dict(model.module),
+            'backbone': {'path': pretrain, 'sha256': file_sha256(pretrain)}}
+
+
+def load_model_checkpoint(model, checkpoint, pretrain=None, backbone_loaded=False):
+    """Load a checkpoint saved with ``model_checkpoint`` into ``model`` (a DataParallel / DDP wrapper).
+
+    A trainable-only checkpoint needs the backbone file it was trained with: ``pretrain`` if given, else the path
+    recorded in the checkpoint, checked against the recorded sha256. Its weights are loaded unless
+    ``backbone_loaded`` tells that ``pretrain`` is already in ``model``. A full checkpoint is loaded as is.
+    """
+    if 'backbone' not in checkpoint:
+        model.load_state_dict(checkpoint['model'])
+        return
+
+    backbone = checkpoint['backbone']
+    pretrain = pretrain or backbone['path']
+    if not os.path.isfile(pretrain):
+        raise FileNotFoundError('the checkpoint stores the trainable weights only, its backbone {} is missing, '
+                                'pass it with --pretrain'.format(pretrain))
+    if file_sha256(pretrain) != backbone['sha256']:
+        raise ValueError('{} is not the backbone the checkpoint was trained with (sha256 {})'.format(
+            pretrain, backbone['sha256']))
+    if not backbone_loaded:
+        load_backbone(model.module, pretrain)
+    missing, unexpected = model.module.load_state_dict(checkpoint['model'], strict=False)
+    missing = [k for k in missing if 'pretrained' not in k]
+    if missing or unexpected:
+        raise KeyError('checkpoint does not match the model, missing: {}, unexpected: {}'.format(missing, unexpected))
+
+
+def save_snapshot(queue_dir, model, global_step, epoch, log_path, pretrain=None):
+    """Drop the trainable weights of ``model`` (a DataParallel / DDP wrapper) at ``global_step`` into the eval queue
+    ``queue_dir``; the eval worker reports to ``log_path``."""
+    snapshot = {'global_step': global_step, 'epoch': epoch, 'log_path': log_path}
+    snapshot.update(model_checkpoint(model, pretrain))
+    path = os.path.join(queue_dir, 'snapshot-{:09d}.pth'.format(global_step))
+    atomic_save(snapshot, path)
+    return path
+
+
+def pending_snapshots(queue_dir):
+    """The snapshots waiting in ``queue_dir``, oldest step first."""
+    return sorted(p for p in glob.glob(os.path.join(queue_dir, 'snapshot-*.pth'))
+                  if re.match(r'snapshot-\d+\.pth$', os.path.basename(p)))
+
+
+class HashingWriter(object):
+    """File wrapper computing the sha256 of what ``torch.save`` writes through it."""
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def save_blob(obj, directory):
+    """Save ``obj`` as ``<directory>/<sha256 of the file>.pth`` and return that path; identical contents are stored
+    once."""
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, 'blob.{}.tmp'.format(os.getpid()))
+    with open(tmp, 'wb') as f:
+        writer = HashingWriter(f)
+        torch.save(obj, writer)
+    path = os.path.join(directory, writer.sha256.hexdigest() + '.pth')
+    os.replace(tmp, path)
+    return path
+
+
+def atomic_link(src, dst):
+    """Make ``dst`` a hard link to ``src``, or a copy where the file system has no hard links."""
+    tmp = '{}.{}.tmp'.format(dst, os.getpid())
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class BestCheckpoints(object):
+    """Best value and step of the first nine eval metrics, and the checkpoint of each best step in ``directory``.
+
+    The six error metrics are lower-better and d1-d3 higher-better. ``state()`` and ``load_state`` use the
+    ``best_eval_*`` keys of the training checkpoints.
+
+    The checkpoint of a step is written once, content-addressed as ``blobs/<sha256>.pth``. The
+    ``model-<step>-best_<metric>_<value>`` file of every metric it is best for is a hard link to that blob, and
+    ``best.json`` records the step, value, file and blob of each metric. Every file is written under a temporary
+    name and renamed; superseded files and the blobs no metric refers to any more are removed last.
+    """
+    def __init__(self, directory, metric_names):
+        self.directory = directory
+        self.metric_names = list(metric_names)[:9]
+        self.lower_better = torch.zeros(6).cpu() + 1e3
+        self.higher_better = torch.zeros(3).cpu()
+        self.steps = np.zeros(9, dtype=np.int32)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path()):
+            self.load_manifest()
+
+    def manifest_path(self):
+        return os.path.join(self.directory, 'best.json')
+
+    def blob_dir(self):
+        return os.path.join(self.directory, 'blobs')
+
+    def load_manifest(self):
+        with open(self.manifest_path(), 'r') as f:
+            self.manifest = json.load(f)
+        for i, name in enumerate(self.metric_names):
+            if name in self.manifest:
+                self.steps[i] = self.manifest[name]['step']
+                if i < 6:
+                    self.lower_better[i] = self.manifest[name]['value']
+                else:
+                    self.higher_better[i - 6] = self.manifest[name]['value']
+
+    def state(self):
+        return {'best_eval_measures_higher_better': self.higher_better,
+                'best_eval_measures_lower_better': self.lower_better,
+                'best_eval_steps': self.steps}
+
+    def load_state(self, checkpoint):
+        self.higher_better = checkpoint['best_eval_measures_higher_better'].cpu()
+        self.lower_better = checkpoint['best_eval_measures_lower_better'].cpu()
+        self.steps = checkpoint['best_eval_steps']
+
+    def path(self, global_step, i, measure):
+        return os.path.join(self.directory, 'model-{}-best_{}_{:.5f}'.format(global_step, self.metric_names[i],
+                                                                               measure))
+
+    def update(self, global_step, eval_measures, make_checkpoint):
+        """Record ``eval_measures`` of ``global_step``. If any metric improved, ``make_checkpoint()`` is saved once
+        and becomes the best checkpoint of all of them; returns the indices of the improved metrics."""
+        improved = []
+        # the files of bests restored through load_state are not in the manifest
+        old_paths = {}
+        for i in range(9):
+            measure = eval_measures[i]
+            if i < 6 and measure < self.lower_better[i]:
+                old_paths[i] = self.path(self.steps[i], i, self.lower_better[i].item())
+                self.lower_better[i] = measure.item()
+            elif i >= 6 and measure > self.higher_better[i - 6]:
+                old_paths[i] = self.path(self.steps[i], i, self.higher_better[i - 6].item())
+                self.higher_better[i - 6] = measure.item()
+            else:
+                continue
+            self.steps[i] = global_step
+            improved.append(i)
+        if not improved:
+            return improved
+
+        checkpoint = make_checkpoint()
+        checkpoint.update(self.state())
+        blob = save_blob(checkpoint, self.blob_dir())
+
+        superseded = []
+        for i in improved:
+            name = self.metric_names[i]
+            path = self.path(global_step, i, eval_measures[i])
+            print('New best for {}. Saving model: {}'.format(name, os.path.basename(path)))
+            atomic_link(blob, path)
+            old_path = os.path.join(self.directory, self.manifest[name]['file']) if name in self.manifest \
+                else old_paths[i]
+            if old_path != path:
+                superseded.append(old_path)
+            self.manifest[name] = {'step': int(global_step), 'value': float(eval_measures[i]),
+                                   'file': os.path.basename(path), 'blob': os.path.basename(blob)}
+
+        tmp = '{}.{}.tmp'.format(self.manifest_path(), os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path())
+
+        for path in superseded:
+            if os.path.exists(path):
+                os.remove(path)
+        referenced = {entry['blob'] for entry in self.manifest.values()}
+        for name in os.listdir(self.blob_dir()):
+            if name.endswith('.pth') and name not in referenced:
+                os.remove(os.path.join(self.blob_dir(), name))
+        return improved
@@ -7,11 +7,24 @@ import numpy as np
 from PIL import Image,ImageOps
 import os
 import random
-import copy
 
 import cv2
 
 from utils import DistributedSamplerNoEvenlyDivisible
+from .split_index import SplitIndex
+from .thread_loader import make_loader
+
+# (left, top, right, bottom) padding of the images, applied on the device with --uint8_transport
+BORDER_WIDTH = (0, 0, 16, 8)
+
+
+def pad_image(image):
+    """Pad a decoded (H, W, 3) image by ``BORDER_WIDTH``, scaled to [0, 1] if it is uint8."""
+    left, top, right, bottom = BORDER_WIDTH
+    image = np.pad(image, ((top, bottom), (left, right), (0, 0)), mode='constant', constant_values=0)
+    if image.dtype == np.uint8:
+        return image.astype(np.float32) / 255.0
+    return image
 
 
 def _is_pil_image(img):
@@ -37,11 +50,11 @@ class NewDataLoader(object):
             else:
                 self.train_sampler = None
 
-            self.data = DataLoader(self.training_samples, args.batch_size,
-                                   shuffle=(self.train_sampler is None),
-                                   num_workers=args.num_threads,
-                                   pin_memory=True,
-                                   sampler=self.train_sampler)
+            self.data = make_loader(args, mode, self.training_samples, args.batch_size,
+                                     shuffle=(self.train_sampler is None),
+                                     num_workers=args.num_threads,
+                                     pin_memory=True,
+                                     sampler=self.train_sampler)
 
         elif mode == 'online_eval':
             self.testing_samples = DataLoadPreprocess(args, mode, transform=preprocessing_transforms(mode))
@@ -51,16 +64,16 @@ class NewDataLoader(object):
             else:
                 self.eval_sampler = None
 
-            self.data = DataLoader(self.testing_samples, 1,
-                                   shuffle=False,
-                                   num_workers=1,
-                                   pin_memory=True,
-                                   sampler=self.eval_sampler)
+            self.data = make_loader(args, mode, self.testing_samples, getattr(args, 'batch_size_eval', 1),
+                                     shuffle=False,
+                                     num_workers=getattr(args, 'num_threads_eval', 1),
+                                     pin_memory=True,
+                                     sampler=self.eval_sampler)
             # print("ok123")
 
         elif mode == 'test':
             self.testing_samples = DataLoadPreprocess(args, mode, transform=preprocessing_transforms(mode))
-            self.data = DataLoader(self.testing_samples, 1, shuffle=False, num_workers=1)
+            self.data = make_loader(args, mode, self.testing_samples, 1, shuffle=False, num_workers=1)
 
         else:
             print('mode should be one of \'train, test\'. Got {}'.format(mode))
@@ -71,49 +84,63 @@ class DataLoadPreprocess(Dataset):
     def __init__(self, args, mode, transform=None):
         self.args = args
 
-        if mode == 'online_eval':
-            with open(args.filenames_file_eval, 'r') as f:
-                self.filenames = f.readlines()
-        else:
-            with open(args.filenames_file, 'r') as f:
-                self.filenames = f.readlines()
+        filenames_file = args.filenames_file_eval if mode == 'online_eval' else args.filenames_file
+        self.filenames = SplitIndex.load(filenames_file, cache_dir=getattr(args, 'split_cache', ''))
 
         self.mode = mode
         self.transform = transform
         self.to_tensor = ToTensor
+        # with --uint8_transport the images stay unpadded uint8, see dataloaders.device_preprocess
+        self.uint8_transport = getattr(args, 'uint8_transport', False)
+        # with --do_random_crop the training samples are cropped to input_height x input_width, reading only that
+        # window of the memory-mapped depth (the PNG image is still decoded whole)
+        self.do_random_crop = getattr(args, 'do_random_crop', False)
+        # with --device_augment the flip and the photometric augmentation run on the batch, see
+        # dataloaders.device_augment
+        self.device_augment = getattr(args, 'device_augment', False)
 
     def __getitem__(self, idx):
-        sample_path = self.filenames[idx]
         focal = 518.8579
 
         if self.mode == 'train':
-            rgb_file = sample_path.split()[0]
-            depth_file = sample_path.split()[1]
+            rgb_file = self.filenames.field(idx, 0)
+            depth_file = self.filenames.field(idx, 1)
 
             image_path = os.path.join(self.args.data_path, rgb_file)
             depth_path = os.path.join(self.args.gt_path, depth_file)
 
             image = Image.open(image_path)
 
-            #padding
-            # (left, top, right, bottom)
-            border_width = (0, 0, 16, 8)  # 边框宽度
-            border_color = (0, 0, 0)  # 灰色填充
-            image = ImageOps.expand(image, border=border_width, fill=border_color)
-            image = np.asarray(image, dtype=np.float32) / 255.0
-           
+            if self.do_random_crop:
+                #图片太大需要裁剪
+                # the depth is memory-mapped, so only the rows of the cropped window are read
+                depth_gt = np.load(depth_path, mmap_mode='r')[:, :, None]
+                image, depth_gt = self.random_crop(np.asarray(image), depth_gt,
+                                                     self.args.input_height, self.args.input_width)
+                depth_gt = np.array(depth_gt)
+                image = np.array(image)
+            else:
+                image = np.array(image)
 
-            #读取depth
-            depth_gt = np.load(depth_path)
-            depth_gt = np.expand_dims(depth_gt, axis=2)
+                #读取depth
+                depth_gt = np.load(depth_path)
+                depth_gt = np.expand_dims(depth_gt, axis=2)
+            if not self.uint8_transport:
+                image = image.astype(np.float32) / 255.0
 
             # print("depth_gt", depth_gt.shape)
             # print(image.shape, depth_gt.shape)
-            #图片太大需要裁剪
             #数据增强
-            image, depth_gt = self.train_preprocess(image, depth_gt)
+            if not self.device_augment:
+                image, depth_gt = self.train_preprocess(image, depth_gt)
             # image, depth_gt = self.Cut_Flip(image, depth_gt)
 
+            #padding
+            # after the augmentation, as DevicePreprocess does for --uint8_transport, so that the flipped image keeps
+            # its columns aligned with those of the depth
+            if not self.uint8_transport:
+                image = pad_image(image)
+
             sample = {'image': image, 'depth': depth_gt, 'focal': focal}
 
         else:
@@ -122,23 +149,23 @@ class DataLoadPreprocess(Dataset):
             else:
                 data_path = self.args.data_path
 
-            image_path = os.path.join(data_path, "./" + sample_path.split()[0])
+            image_path = os.path.join(data_path, "./" + self.filenames.field(idx, 0))
 
             image=Image.open(image_path)
             # image = np.asarray(Image.open(image_path), dtype=np.float32) / 255.0
 
-           # padding
-            border_width = (0, 0, 16, 8)  # 边框宽度
-            border_color = (0, 0, 0)  # 灰色填充
-            image = ImageOps.expand(image, border=border_width, fill=border_color)
-
-
-            image = np.asarray(image, dtype=np.float32) / 255.0
+            if self.uint8_transport:
+                image = np.array(image)
+            else:
+                # padding
+                border_color = (0, 0, 0)  # 灰色填充
+                image = ImageOps.expand(image, border=BORDER_WIDTH, fill=border_color)
+                image = np.asarray(image, dtype=np.float32) / 255.0
 
             # image = np.asarray(Image.open(image_path), dtype=np.float32) / 255.0
             if self.mode == 'online_eval':
                 gt_path = self.args.gt_path_eval
-                depth_path = os.path.join(gt_path, "./" + sample_path.split()[1])
+                depth_path = os.path.join(gt_path, "./" + self.filenames.field(idx, 1))
                 has_valid_depth = False
                 try:
                     depth_gt = np.load(depth_path)
@@ -189,6 +216,10 @@ class DataLoadPreprocess(Dataset):
         return image, depth_gt
 
     def augment_image(self, image):
+        if image.dtype == np.uint8:
+            image_aug = self.augment_image(image.astype(np.float32) / 255.0)
+            return np.round(image_aug * 255.0).astype(np.uint8)
+
         # gamma augmentation
         gamma = random.uniform(0.9, 1.1)
         image_aug = image ** gamma
@@ -215,24 +246,16 @@ class DataLoadPreprocess(Dataset):
         p = random.random()
         if p < 0.5:
             return image, depth
-        image_copy = copy.deepcopy(image)
-        depth_copy = copy.deepcopy(depth)
-        h, w, c = image.shape
-
-        N = 2
-        h_list = []
-        h_interval_list = []  # hight interval
-        for i in range(N - 1):
-            h_list.append(random.randint(int(0.2 * h), int(0.8 * h)))
-        h_list.append(h)
-        h_list.append(0)
-        h_list.sort()
-        h_list_inv = np.array([h] * (N + 1)) - np.array(h_list)
-        for i in range(len(h_list) - 1):
-            h_interval_list.append(h_list[i + 1] - h_list[i])
-        for i in range(N):
-            image[h_list[i]:h_list[i + 1], :, :] = image_copy[h_list_inv[i] - h_interval_list[i]:h_list_inv[i], :, :]
-            depth[h_list[i]:h_list[i + 1], :, :] = depth_copy[h_list_inv[i] - h_interval_list[i]:h_list_inv[i], :, :]
+        h = depth.shape[0]
+
+        # swapping the bands above and below a random cut is a cyclic shift of the rows by the cut height,
+        # i.e. one row gather instead of deep copies of both arrays; the rows of a bottom-padded image below
+        # those of the depth stay in place
+        cut = random.randint(int(0.2 * h), int(0.8 * h))
+        rows = np.arange(image.shape[0])
+        rows[:h] = (rows[:h] - cut) % h
+        image = image[rows]
+        depth = depth[rows[:h]]
 
         return image, depth
 
@@ -247,8 +270,12 @@ class ToTensor(object):
     def __call__(self, sample):
 
         image, focal = sample['image'], sample['focal']
-        image = self.to_tensor(image)
-        image = self.normalize(image)
+        if image.dtype == np.uint8:
+            # cast, normalised and padded on the device by DevicePreprocess
+            image = torch.from_numpy(image)
+        else:
+            image = self.to_tensor(image)
+            image = self.normalize(image)
 
         if self.mode == 'test':
             return {'image': image, 'focal': focal}
@@ -4,16 +4,27 @@ import torch.utils.data.distributed
 from torchvision import transforms
 
 import numpy as np
-from PIL import Image,ImageOps
+from PIL import Image
 import os
 import random
-import copy
 
 os.environ["OPENCV_IO_ENABLE_OPENEXR"] = "1"
 
 import cv2
 
 from utils import DistributedSamplerNoEvenlyDivisible
+from .split_index import SplitIndex
+from .thread_loader import make_loader
+from .feature_cache import FeatureCache
+from .packed_store import PackedStore
+
+# the images are padded by (left, top, right, bottom) so that their size is a multiple of the ViT patch size
+BORDER_WIDTH = (0, 0, 16, 8)
+
+
+def unpadded_size(size):
+    """Return the (H, W) of an image before padding by ``BORDER_WIDTH``."""
+    return (size[0] - BORDER_WIDTH[1] - BORDER_WIDTH[3], size[1] - BORDER_WIDTH[0] - BORDER_WIDTH[2])
 
 
 def _is_pil_image(img):
@@ -30,20 +41,31 @@ def preprocessing_transforms(mode):
     ])
 
 
+def pad_image(image):
+    """Pad a decoded (H, W, 3) image by ``BORDER_WIDTH``, scaled to [0, 1] if it is uint8."""
+    left, top, right, bottom = BORDER_WIDTH
+    image = np.pad(image, ((top, bottom), (left, right), (0, 0)), mode='constant', constant_values=0)
+    if image.dtype == np.uint8:
+        return image.astype(np.float32) / 255.0
+    return image
+
+
 class NewDataLoader(object):
     def __init__(self, args, mode):
         if mode == 'train':
-            self.training_samples = DataLoadPreprocess(args, mode, transform=preprocessing_transforms(mode))
+            # a packed store replaces the per-sample PNG and EXR decodes of the training split
+            dataset = PackedDataLoadPreprocess if getattr(args, 'packed_path', '') else DataLoadPreprocess
+            self.training_samples = dataset(args, mode, transform=preprocessing_transforms(mode))
             if args.distributed:
                 self.train_sampler = torch.utils.data.distributed.DistributedSampler(self.training_samples)
             else:
                 self.train_sampler = None
 
-            self.data = DataLoader(self.training_samples, args.batch_size,
-                                   shuffle=(self.train_sampler is None),
-                                   num_workers=args.num_threads,
-                                   pin_memory=True,
-                                   sampler=self.train_sampler)
+            self.data = make_loader(args, mode, self.training_samples, args.batch_size,
+                                     shuffle=(self.train_sampler is None),
+                                     num_workers=args.num_threads,
+                                     pin_memory=True,
+                                     sampler=self.train_sampler)
 
         elif mode == 'online_eval':
             self.testing_samples = DataLoadPreprocess(args, mode, transform=preprocessing_transforms(mode))
@@ -53,15 +75,15 @@ class NewDataLoader(object):
             else:
                 self.eval_sampler = None
 
-            self.data = DataLoader(self.testing_samples, 1,
-                                   shuffle=False,
-                                   num_workers=1,
-                                   pin_memory=True,
-                                   sampler=self.eval_sampler)
+            self.data = make_loader(args, mode, self.testing_samples, getattr(args, 'batch_size_eval', 1),
+                                     shuffle=False,
+                                     num_workers=getattr(args, 'num_threads_eval', 1),
+                                     pin_memory=True,
+                                     sampler=self.eval_sampler)
 
         elif mode == 'test':
             self.testing_samples = DataLoadPreprocess(args, mode, transform=preprocessing_transforms(mode))
-            self.data = DataLoader(self.testing_samples, 1, shuffle=False, num_workers=1)
+            self.data = make_loader(args, mode, self.testing_samples, 1, shuffle=False, num_workers=1)
 
         else:
             print('mode should be one of \'train, test\'. Got {}'.format(mode))
@@ -71,97 +93,101 @@ class DataLoadPreprocess(Dataset):
 
     def __init__(self, args, mode, transform=None, is_for_online_eval=False):
         self.args = args
-        if mode == 'online_eval':
-            with open(args.filenames_file_eval, 'r') as f:
-                self.filenames = f.readlines()
-        else:
-            with open(args.filenames_file, 'r') as f:
-                self.filenames = f.readlines()
+        filenames_file = args.filenames_file_eval if mode == 'online_eval' else args.filenames_file
+        self.filenames = SplitIndex.load(filenames_file, cache_dir=getattr(args, 'split_cache', ''))
 
         self.mode = mode
         self.transform = transform
         self.to_tensor = ToTensor
         self.is_for_online_eval = is_for_online_eval
+        # with --uint8_transport the images stay unpadded uint8, see dataloaders.device_preprocess
+        self.uint8_transport = getattr(args, 'uint8_transport', False)
+        # with --device_augment the flip, the photometric augmentation and Cut_Flip run on the batch, see
+        # dataloaders.device_augment
+        self.device_augment = getattr(args, 'device_augment', False)
+
+        self.feature_cache = None
+        if mode == 'train' and getattr(args, 'feature_cache', ''):
+            self.feature_cache = FeatureCache(args.feature_cache)
+            assert len(self.feature_cache) == len(self.filenames), \
+                'feature cache {} does not match {}'.format(args.feature_cache, args.filenames_file)
+
+    def image_path(self, idx):
+        data_path = self.args.data_path_eval if self.mode == 'online_eval' else self.args.data_path
+        return os.path.join(data_path, "./" + self.filenames.field(idx, 0))
+
+    def depth_path(self, idx):
+        gt_path = self.args.gt_path_eval if self.mode == 'online_eval' else self.args.gt_path
+        return os.path.join(gt_path, "./" + self.filenames.field(idx, 1))
+
+    def load_image(self, idx):
+        """Decode the (H, W, 3) uint8 image of sample ``idx``, without the border."""
+        return np.array(Image.open(self.image_path(idx)))
+
+    def load_depth(self, idx):
+        """Decode the (H, W, 1) depth of sample ``idx``, zeroed where its mask is unset."""
+        depth_path = self.depth_path(idx)
+        depth_gt = cv2.imread(depth_path, cv2.IMREAD_UNCHANGED)
+        mask_path = depth_path.replace("depths", "masks")
+        mask_path = mask_path.replace(".exr", ".png")
+        mask_image = np.array(cv2.imread(mask_path, cv2.COLOR_BGR2GRAY)) / 255.0
+        mask_image = mask_image < 0.5
+        depth_gt[mask_image] = 0
+        depth_gt = np.array(depth_gt)
+        return np.expand_dims(depth_gt, axis=2)
 
     def __getitem__(self, idx):
-        sample_path = self.filenames[idx]
         # focal = float(sample_path.split()[2])
         focal = 518.8579
 
         if self.mode == 'train':
-            rgb_file = sample_path.split()[0]
-            depth_file = sample_path.split()[1]
-
-            image_path = os.path.join(self.args.data_path, rgb_file)
-            depth_path = os.path.join(self.args.gt_path, depth_file)
-
-            image = Image.open(image_path)
-
-            #padding
-            # (left, top, right, bottom)
-            border_width = (0, 0, 16, 8)  # 边框宽度
-            border_color = (0, 0, 0)  # 灰色填充
-            image = ImageOps.expand(image, border=border_width, fill=border_color)
-
-            image = np.asarray(image, dtype=np.float32) / 255.0
+            # 读取depth
+            depth_gt = self.load_depth(idx)
 
+            if self.feature_cache is not None:
+                # cached features belong to the un-augmented image, so the flip is the only augmentation left
+                do_flip = random.random() > 0.5
+                if do_flip:
+                    depth_gt = (depth_gt[:, ::-1, :]).copy()
+                feats = self.feature_cache.read(idx, do_flip)
 
+                sample = {'feats': feats, 'depth': depth_gt, 'focal': focal}
+                if self.transform:
+                    sample = self.transform(sample)
+                return sample
 
-            # 读取depth
-            depth_gt = cv2.imread(depth_path, cv2.IMREAD_UNCHANGED)
-            mask_path = depth_path.replace("depths", "masks")
-            mask_path = mask_path.replace(".exr", ".png")
-            mask_image = np.array(cv2.imread(mask_path, cv2.COLOR_BGR2GRAY)) / 255.0
-            mask_image = mask_image < 0.5
-            depth_gt[mask_image] = 0
-            depth_gt = np.array(depth_gt)
-            depth_gt = np.expand_dims(depth_gt, axis=2)
+            image = self.load_image(idx)
+            if not self.uint8_transport:
+                image = image.astype(np.float32) / 255.0
 
             # 深度图进行数据增强，
-            image, depth_gt = self.train_preprocess(image, depth_gt)
-            image, depth_gt = self.Cut_Flip(image, depth_gt)
+            if not self.device_augment:
+                image, depth_gt = self.train_preprocess(image, depth_gt)
+                image, depth_gt = self.Cut_Flip(image, depth_gt)
+
+            #padding
+            # after the augmentation, as DevicePreprocess does for --uint8_transport, so that the flipped and cut
+            # image keeps its rows and columns aligned with those of the depth
+            if not self.uint8_transport:
+                image = pad_image(image)
 
             sample = {'image': image, 'depth': depth_gt, 'focal': focal, }
 
         else:
-            if self.mode == 'online_eval':
-                data_path = self.args.data_path_eval
-            else:
-                data_path = self.args.data_path
-
-            image_path = os.path.join(data_path, "./" + sample_path.split()[0])
-
-            image=Image.open(image_path)
-
             # padding
-            border_width = (0, 0, 16, 8)  # 边框宽度
-            border_color = (0, 0, 0)  # 灰色填充
-            image = ImageOps.expand(image, border=border_width, fill=border_color)
-
-            image = np.asarray(image, dtype=np.float32) / 255.0
+            image = self.load_image(idx)
+            if not self.uint8_transport:
+                image = pad_image(image)
 
             # depth
             if self.mode == 'online_eval':
-                gt_path = self.args.gt_path_eval
-                # print("depth_path", os.path.join(gt_path,"./"+ sample_path.split()[1]))
-                depth_path = os.path.join(gt_path, "./" + sample_path.split()[1])
-
                 has_valid_depth = False
                 try:
-                    depth_gt = cv2.imread(depth_path, cv2.IMREAD_UNCHANGED)
+                    depth_gt = self.load_depth(idx)
                     has_valid_depth = True
                 except IOError:
                     depth_gt = False
 
-                if has_valid_depth:
-                    mask_path = depth_path.replace("depths", "masks")
-                    mask_path = mask_path.replace(".exr", ".png")
-                    mask_image = np.array(cv2.imread(mask_path, cv2.COLOR_BGR2GRAY)) / 255.0
-                    mask_image = mask_image < 0.5
-                    depth_gt[mask_image] = 0
-                    depth_gt = np.array(depth_gt)
-                    depth_gt = np.expand_dims(depth_gt, axis=2)
-
             if self.mode == 'online_eval':
                 sample = {'image': image, 'depth': depth_gt, 'focal': focal, 'has_valid_depth': has_valid_depth}
             else:
@@ -204,6 +230,10 @@ class DataLoadPreprocess(Dataset):
         return image, depth_gt
 
     def augment_image(self, image):
+        if image.dtype == np.uint8:
+            image_aug = self.augment_image(image.astype(np.float32) / 255.0)
+            return np.round(image_aug * 255.0).astype(np.uint8)
+
         # gamma augmentation
         gamma = random.uniform(0.9, 1.1)
         image_aug = image ** gamma
@@ -230,24 +260,16 @@ class DataLoadPreprocess(Dataset):
         p = random.random()
         if p < 0.5:
             return image, depth
-        image_copy = copy.deepcopy(image)
-        depth_copy = copy.deepcopy(depth)
-        h, w, c = image.shape
-
-        N = 2
-        h_list = []
-        h_interval_list = []  # hight interval
-        for i in range(N - 1):
-            h_list.append(random.randint(int(0.2 * h), int(0.8 * h)))
-        h_list.append(h)
-        h_list.append(0)
-        h_list.sort()
-        h_list_inv = np.array([h] * (N + 1)) - np.array(h_list)
-        for i in range(len(h_list) - 1):
-            h_interval_list.append(h_list[i + 1] - h_list[i])
-        for i in range(N):
-            image[h_list[i]:h_list[i + 1], :, :] = image_copy[h_list_inv[i] - h_interval_list[i]:h_list_inv[i], :, :]
-            depth[h_list[i]:h_list[i + 1], :, :] = depth_copy[h_list_inv[i] - h_interval_list[i]:h_list_inv[i], :, :]
+        h = depth.shape[0]
+
+        # swapping the bands above and below a random cut is a cyclic shift of the rows by the cut height,
+        # i.e. one row gather instead of deep copies of both arrays; the rows of a bottom-padded image below
+        # those of the depth stay in place
+        cut = random.randint(int(0.2 * h), int(0.8 * h))
+        rows = np.arange(image.shape[0])
+        rows[:h] = (rows[:h] - cut) % h
+        image = image[rows]
+        depth = depth[rows[:h]]
 
         return image, depth
 
@@ -255,6 +277,22 @@ class DataLoadPreprocess(Dataset):
         return len(self.filenames)
 
 
+class PackedDataLoadPreprocess(DataLoadPreprocess):
+    """DataLoadPreprocess serving the decoded images and masked depths of ``args.packed_path``, see
+    ``anything_pack_dataset.py``."""
+    def __init__(self, args, mode, transform=None, is_for_online_eval=False):
+        super(PackedDataLoadPreprocess, self).__init__(args, mode, transform, is_for_online_eval)
+        self.packed = PackedStore(args.packed_path)
+        assert [line.strip() for line in self.packed.filenames] == list(self.filenames), \
+            'packed store {} does not match {}'.format(args.packed_path, args.filenames_file)
+
+    def load_image(self, idx):
+        return self.packed.read_image(idx)
+
+    def load_depth(self, idx):
+        return self.packed.read_depth(idx)[:, :, None]
+
+
 class ToTensor(object):
     def __init__(self, mode):
         self.mode = mode
@@ -262,9 +300,17 @@ class ToTensor(object):
 
     def __call__(self, sample):
 
+        if 'feats' in sample:
+            feats = [torch.from_numpy(feat) for feat in sample['feats']]
+            return {'feats': feats, 'depth': self.to_tensor(sample['depth']), 'focal': sample['focal']}
+
         image, focal = sample['image'], sample['focal']
-        image = self.to_tensor(image)
-        image = self.normalize(image)
+        if image.dtype == np.uint8:
+            # cast, normalised and padded on the device by DevicePreprocess
+            image = torch.from_numpy(image)
+        else:
+            image = self.to_tensor(image)
+            image = self.normalize(image)
 
         if self.mode == 'test':
             return {'image': image, 'focal': focal}
@@ -0,0 +1,71 @@
+import torch
+
+from .device_preprocess import resolve_device
+
+
+class DeviceAugment(object):
+    """Batched, on-device version of ``train_preprocess`` of the loaders for ``--device_augment``.
+
+    Every sample is flipped horizontally with probability 0.5 and, with probability 0.5, gamma, brightness and
+    colour jittered in [0.9, 1.1] and clipped, exactly as in ``augment_image``. The parameters are drawn per sample
+    from a CPU ``torch.Generator`` seeded with ``seed``, so the augmentation is reproducible on any device and
+    selecting the samples does not synchronise with the GPU. With ``cut_flip`` the rows are then also cut and
+    swapped as in ``Cut_Flip``.
+    """
+    def __init__(self, seed=0, device='cuda', cut_flip=False):
+        self.device = resolve_device(device)
+        self.cut_flip = cut_flip
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
+
+    def sample_params(self, batch_size):
+        """Return the flip and augment masks (B,), the gammas (B, 1, 1, 1) and the colour factors (B, 3, 1, 1)."""
+        u = torch.rand(batch_size, 7, generator=self.generator)
+        do_flip = u[:, 0] > 0.5
+        do_augment = u[:, 1] > 0.5
+        gamma = 0.9 + 0.2 * u[:, 2]
+        # brightness times the per-channel colour
+        factor = (0.9 + 0.2 * u[:, 3:4]) * (0.9 + 0.2 * u[:, 4:7])
+        return do_flip, do_augment, gamma.view(-1, 1, 1, 1), factor.view(-1, 3, 1, 1)
+
+    def __call__(self, image, depth):
+        """Augment a (B, 3, H, W) float image in [0, 1] and flip its (B, 1, H, W) depth alike, both in place."""
+        do_flip, do_augment, gamma, factor = self.sample_params(image.shape[0])
+
+        idx = do_augment.nonzero(as_tuple=True)[0]
+        if len(idx):
+            gamma = gamma[idx].to(image.device, non_blocking=True)
+            factor = factor[idx].to(image.device, non_blocking=True)
+            idx = idx.to(image.device, non_blocking=True)
+            # x ** gamma as exp(gamma * log(x)), which is exact at 0 and twice as fast
+            image[idx] = image[idx].log_().mul_(gamma).exp_().mul_(factor).clamp_(0, 1)
+
+        idx = do_flip.nonzero(as_tuple=True)[0]
+        if len(idx):
+            # the columns of a right-padded image beyond those of the depth stay in place
+            w = depth.shape[-1]
+            idx = idx.to(image.device, non_blocking=True)
+            image[idx, ..., :w] = image[idx, ..., :w].flip(-1)
+            depth[idx] = depth[idx].flip(-1)
+
+        if self.cut_flip:
+            image, depth = self.cut_flip_rows(image, depth)
+        return image, depth
+
+    def cut_flip_rows(self, image, depth):
+        """Batched ``Cut_Flip``: with probability 0.5 roll the rows of a sample by a cut drawn in [0.2, 0.8] of the
+        depth height, as one gather over the batch. The rows of a bottom-padded image below those of the depth stay
+        in place."""
+        b, h = depth.shape[0], depth.shape[-2]
+        do_cut = torch.rand(b, generator=self.generator) >= 0.5
+        cut = torch.randint(int(0.2 * h), int(0.8 * h) + 1, (b,), generator=self.generator) * do_cut
+        if not do_cut.any():
+            return image, depth
+
+        rows = torch.arange(image.shape[-2]).repeat(b, 1)
+        rows[:, :h] = (rows[:, :h] - cut[:, None]) % h
+        rows = rows.to(image.device, non_blocking=True)
+
+        def gather_rows(x, rows):
+            return x.gather(-2, rows[:, None, :, None].expand(-1, x.shape[1], -1, x.shape[-1]))
+        return gather_rows(image, rows), gather_rows(depth, rows[:, :h])
@@ -0,0 +1,52 @@
+import torch
+import torch.nn.functional as F
+
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def resolve_device(device):
+    """``device`` as a ``torch.device``; None, the ``args.gpu`` of a non-distributed run, is the current GPU."""
+    if device is None:
+        return torch.device('cuda', torch.cuda.current_device())
+    return torch.device(device)
+
+
+class DevicePreprocess(object):
+    """Device-side counterpart of the float32 path of the loaders for ``--uint8_transport``.
+
+    The workers then emit (B, H, W, 3) uint8 images, a quarter of the float32 size through the worker queue, pinned
+    memory and the host to device copy. This casts, pads by ``border`` (left, top, right, bottom) with black and
+    applies the ImageNet normalisation of ``ToTensor`` on the whole batch. Float images are returned unchanged.
+
+    The float path of the loaders also pads after the augmentation, so the flip and ``Cut_Flip`` see the same
+    unpadded image with either transport.
+    """
+    def __init__(self, border=(0, 0, 0, 0), device='cuda'):
+        self.border = tuple(border)
+        self.device = resolve_device(device)
+        # x / 255 normalised with mean and std, folded into one multiply-add
+        std = torch.tensor(IMAGENET_STD)
+        self.scale = (1.0 / (255.0 * std)).view(1, 3, 1, 1).to(self.device)
+        self.bias = (-torch.tensor(IMAGENET_MEAN) / std).view(1, 3, 1, 1).to(self.device)
+
+    def to_unit(self, image):
+        """Cast a (B, H, W, 3) uint8 batch to a (B, 3, H, W) float batch in [0, 1], e.g. for ``DeviceAugment``."""
+        return image.to(self.device, non_blocking=True).permute(0, 3, 1, 2).float().div_(255.0)
+
+    def pad_normalize(self, image):
+        """Pad and normalise a (B, 3, H, W) float batch in [0, 1]."""
+        left, top, right, bottom = self.border
+        if any(self.border):
+            image = F.pad(image, (left, right, top, bottom), mode='constant', value=0)
+        return torch.addcmul(self.bias, image, self.scale * 255.0).contiguous()
+
+    def __call__(self, image):
+        if image.dtype != torch.uint8:
+            return image.to(self.device, non_blocking=True)
+        image = image.to(self.device, non_blocking=True).permute(0, 3, 1, 2).float()
+        left, top, right, bottom = self.border
+        if any(self.border):
+            image = F.pad(image, (left, right, top, bottom), mode='constant', value=0)
+        return torch.addcmul(self.bias, image, self.scale).contiguous()
@@ -0,0 +1,71 @@
+import os
+import json
+
+import numpy as np
+
+
+class FeatureCache(object):
+    """Memory-mapped float16 store of the frozen DINOv2 intermediate layers.
+
+    Every sample of the split file is stored twice, once for the padded image and once for its horizontal flip.
+    Layout under ``root``: ``meta.json`` plus one ``layer{k}_shard{s}.npy`` per layer and shard, each of shape
+    (n, 2, C, h, w) where axis 1 is the flip.
+    """
+    def __init__(self, root, mode='r'):
+        self.root = root
+        self.mode = mode
+        with open(os.path.join(root, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.num_samples = self.meta['num_samples']
+        self.shard_size = self.meta['shard_size']
+        self.shapes = [tuple(shape) for shape in self.meta['shapes']]
+        # shards are mapped lazily so that every dataloader worker opens its own view
+        self._shards = {}
+
+    @classmethod
+    def create(cls, root, num_samples, shapes, shard_size=1024, **meta):
+        """Allocate an empty cache for ``num_samples`` samples whose layers have the (C, h, w) ``shapes``."""
+        if not os.path.exists(root):
+            os.makedirs(root)
+        num_shards = (num_samples + shard_size - 1) // shard_size
+        for s in range(num_shards):
+            n = min(shard_size, num_samples - s * shard_size)
+            for k, shape in enumerate(shapes):
+                np.lib.format.open_memmap(cls.shard_path(root, k, s), mode='w+', dtype=np.float16,
+                                          shape=(n, 2) + tuple(shape))
+        meta.update({'num_samples': num_samples, 'shard_size': shard_size, 'shapes': [list(s) for s in shapes]})
+        with open(os.path.join(root, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        return cls(root, mode='r+')
+
+    @staticmethod
+    def shard_path(root, layer, shard):
+        return os.path.join(root, 'layer{}_shard{}.npy'.format(layer, shard))
+
+    def _shard(self, layer, shard):
+        key = (layer, shard)
+        if key not in self._shards:
+            self._shards[key] = np.load(self.shard_path(self.root, layer, shard), mmap_mode=self.mode)
+        return self._shards[key]
+
+    def read(self, idx, flip):
+        """Return the four float16 feature maps of sample ``idx`` as (C, h, w) arrays."""
+        shard, offset = divmod(idx, self.shard_size)
+        return [np.array(self._shard(k, shard)[offset, int(flip)]) for k in range(len(self.shapes))]
+
+    def write(self, idx, flip, feats):
+        shard, offset = divmod(idx, self.shard_size)
+        for k, feat in enumerate(feats):
+            self._shard(k, shard)[offset, int(flip)] = feat.astype(np.float16)
+
+    def flush(self):
+        for shard in self._shards.values():
+            shard.flush()
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
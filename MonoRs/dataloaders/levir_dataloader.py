@@ -7,11 +7,15 @@ import numpy as np
 from PIL import Image, ImageOps
 import os
 import random
-import copy
 
 import cv2
 
 from utils import DistributedSamplerNoEvenlyDivisible
+from .split_index import SplitIndex
+from .thread_loader import make_loader
+
+# the LEVIR images are not padded
+BORDER_WIDTH = (0, 0, 0, 0)
 
 
 def _is_pil_image(img):
@@ -37,11 +41,11 @@ class NewDataLoader(object):
             else:
                 self.train_sampler = None
 
-            self.data = DataLoader(self.training_samples, args.batch_size,
-                                   shuffle=(self.train_sampler is None),
-                                   num_workers=args.num_threads,
-                                   pin_memory=True,
-                                   sampler=self.train_sampler)
+            self.data = make_loader(args, mode, self.training_samples, args.batch_size,
+                                     shuffle=(self.train_sampler is None),
+                                     num_workers=args.num_threads,
+                                     pin_memory=True,
+                                     sampler=self.train_sampler)
 
         elif mode == 'online_eval':
             self.testing_samples = DataLoadPreprocess(args, mode, transform=preprocessing_transforms(mode))
@@ -51,16 +55,16 @@ class NewDataLoader(object):
             else:
                 self.eval_sampler = None
 
-            self.data = DataLoader(self.testing_samples, 1,
-                                   shuffle=False,
-                                   num_workers=1,
-                                   pin_memory=True,
-                                   sampler=self.eval_sampler)
+            self.data = make_loader(args, mode, self.testing_samples, getattr(args, 'batch_size_eval', 1),
+                                     shuffle=False,
+                                     num_workers=getattr(args, 'num_threads_eval', 1),
+                                     pin_memory=True,
+                                     sampler=self.eval_sampler)
             # print("ok123")
 
         elif mode == 'test':
             self.testing_samples = DataLoadPreprocess(args, mode, transform=preprocessing_transforms(mode))
-            self.data = DataLoader(self.testing_samples, 1, shuffle=False, num_workers=1)
+            self.data = make_loader(args, mode, self.testing_samples, 1, shuffle=False, num_workers=1)
 
         else:
             print('mode should be one of \'train, test\'. Got {}'.format(mode))
@@ -71,24 +75,24 @@ class DataLoadPreprocess(Dataset):
     def __init__(self, args, mode, transform=None):
         self.args = args
 
-        if mode == 'online_eval':
-            with open(args.filenames_file_eval, 'r') as f:
-                self.filenames = f.readlines()
-        else:
-            with open(args.filenames_file, 'r') as f:
-                self.filenames = f.readlines()
+        filenames_file = args.filenames_file_eval if mode == 'online_eval' else args.filenames_file
+        self.filenames = SplitIndex.load(filenames_file, cache_dir=getattr(args, 'split_cache', ''))
 
         self.mode = mode
         self.transform = transform
         self.to_tensor = ToTensor
+        # with --uint8_transport the images stay uint8, see dataloaders.device_preprocess
+        self.uint8_transport = getattr(args, 'uint8_transport', False)
+        # with --device_augment the flip, the photometric augmentation and Cut_Flip run on the batch, see
+        # dataloaders.device_augment
+        self.device_augment = getattr(args, 'device_augment', False)
 
     def __getitem__(self, idx):
-        sample_path = self.filenames[idx]
         focal = 518.8579
 
         if self.mode == 'train':
-            rgb_file = sample_path.split()[0]
-            depth_file = sample_path.split()[1]
+            rgb_file = self.filenames.field(idx, 0)
+            depth_file = self.filenames.field(idx, 1)
 
             image_path = os.path.join(self.args.data_path, rgb_file)
             depth_path = os.path.join(self.args.gt_path, depth_file)
@@ -96,7 +100,10 @@ class DataLoadPreprocess(Dataset):
             image = Image.open(image_path)
             depth_gt = Image.open(depth_path)
 
-            image = np.asarray(image, dtype=np.float32) / 255.0
+            if self.uint8_transport:
+                image = np.array(image)
+            else:
+                image = np.asarray(image, dtype=np.float32) / 255.0
 
             # cams_path=depth_path.replace("Depths", "Cams")
             # cams_path=cams_path.replace(".tiff", ".txt")
@@ -113,8 +120,9 @@ class DataLoadPreprocess(Dataset):
             depth_gt = np.expand_dims(depth_gt, axis=2)
             # print("depth_gt", depth_gt.shape)
 
-            image, depth_gt = self.train_preprocess(image, depth_gt)
-            image, depth_gt = self.Cut_Flip(image, depth_gt)
+            if not self.device_augment:
+                image, depth_gt = self.train_preprocess(image, depth_gt)
+                image, depth_gt = self.Cut_Flip(image, depth_gt)
             sample = {'image': image, 'depth': depth_gt, 'focal': focal}
 
         else:
@@ -123,7 +131,7 @@ class DataLoadPreprocess(Dataset):
             else:
                 data_path = self.args.data_path
 
-            image_path = os.path.join(data_path, "./" + sample_path.split()[0])
+            image_path = os.path.join(data_path, "./" + self.filenames.field(idx, 0))
             image=Image.open(image_path)
 
 
@@ -133,7 +141,10 @@ class DataLoadPreprocess(Dataset):
             # border_color = (0, 0, 0)  # 灰色填充
             # image = ImageOps.expand(image, border=border_width, fill=border_color)
 
-            image = np.asarray(image, dtype=np.float32) / 255.0
+            if self.uint8_transport:
+                image = np.array(image)
+            else:
+                image = np.asarray(image, dtype=np.float32) / 255.0
             # print("image", image.shape)
 
             # cams_path = depth_path.replace("Depths", "Cams")
@@ -147,7 +158,7 @@ class DataLoadPreprocess(Dataset):
             # depth
             if self.mode == 'online_eval':
                 gt_path = self.args.gt_path_eval
-                depth_path = os.path.join(gt_path, "./" + sample_path.split()[1])
+                depth_path = os.path.join(gt_path, "./" + self.filenames.field(idx, 1))
                 has_valid_depth = False
                 try:
                     depth_gt = Image.open(depth_path)
@@ -200,6 +211,10 @@ class DataLoadPreprocess(Dataset):
         return image, depth_gt
 
     def augment_image(self, image):
+        if image.dtype == np.uint8:
+            image_aug = self.augment_image(image.astype(np.float32) / 255.0)
+            return np.round(image_aug * 255.0).astype(np.uint8)
+
         # gamma augmentation
         gamma = random.uniform(0.9, 1.1)
         image_aug = image ** gamma
@@ -226,24 +241,16 @@ class DataLoadPreprocess(Dataset):
         p = random.random()
         if p < 0.5:
             return image, depth
-        image_copy = copy.deepcopy(image)
-        depth_copy = copy.deepcopy(depth)
-        h, w, c = image.shape
-
-        N = 2
-        h_list = []
-        h_interval_list = []  # hight interval
-        for i in range(N - 1):
-            h_list.append(random.randint(int(0.2 * h), int(0.8 * h)))
-        h_list.append(h)
-        h_list.append(0)
-        h_list.sort()
-        h_list_inv = np.array([h] * (N + 1)) - np.array(h_list)
-        for i in range(len(h_list) - 1):
-            h_interval_list.append(h_list[i + 1] - h_list[i])
-        for i in range(N):
-            image[h_list[i]:h_list[i + 1], :, :] = image_copy[h_list_inv[i] - h_interval_list[i]:h_list_inv[i], :, :]
-            depth[h_list[i]:h_list[i + 1], :, :] = depth_copy[h_list_inv[i] - h_interval_list[i]:h_list_inv[i], :, :]
+        h = depth.shape[0]
+
+        # swapping the bands above and below a random cut is a cyclic shift of the rows by the cut height,
+        # i.e. one row gather instead of deep copies of both arrays; the rows of a bottom-padded image below
+        # those of the depth stay in place
+        cut = random.randint(int(0.2 * h), int(0.8 * h))
+        rows = np.arange(image.shape[0])
+        rows[:h] = (rows[:h] - cut) % h
+        image = image[rows]
+        depth = depth[rows[:h]]
 
         return image, depth
 
@@ -259,8 +266,12 @@ class ToTensor(object):
     def __call__(self, sample):
 
         image, focal = sample['image'], sample['focal']
-        image = self.to_tensor(image)
-        image = self.normalize(image)
+        if image.dtype == np.uint8:
+            # cast and normalised on the device by DevicePreprocess
+            image = torch.from_numpy(image)
+        else:
+            image = self.to_tensor(image)
+            image = self.normalize(image)
 
 
 
@@ -0,0 +1,79 @@
+import os
+import json
+
+import numpy as np
+
+
+class PackedStore(object):
+    """Memory-mapped store of decoded samples, so that a training sample is a slice instead of three decodes.
+
+    Layout under ``root``: ``meta.json`` (sizes, dtypes and the packed split lines) plus one ``images_shard{s}.npy``
+    of shape (n, H, W, 3) uint8 and one ``depths_shard{s}.npy`` of shape (n, H, W) with the masked depth per shard.
+    The images are stored without the loader border.
+    """
+    def __init__(self, root, mode='r'):
+        self.root = root
+        self.mode = mode
+        with open(os.path.join(root, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.num_samples = self.meta['num_samples']
+        self.shard_size = self.meta['shard_size']
+        self.filenames = self.meta['filenames']
+        # shards are mapped lazily so that every dataloader worker opens its own view
+        self._shards = {}
+
+    @classmethod
+    def create(cls, root, filenames, image_shape, depth_dtype='float16', shard_size=1024):
+        """Allocate an empty store for the split lines ``filenames`` with images of shape (H, W, 3)."""
+        if not os.path.exists(root):
+            os.makedirs(root)
+        num_samples = len(filenames)
+        num_shards = (num_samples + shard_size - 1) // shard_size
+        for s in range(num_shards):
+            n = min(shard_size, num_samples - s * shard_size)
+            np.lib.format.open_memmap(cls.shard_path(root, 'images', s), mode='w+', dtype=np.uint8,
+                                      shape=(n,) + tuple(image_shape))
+            np.lib.format.open_memmap(cls.shard_path(root, 'depths', s), mode='w+', dtype=np.dtype(depth_dtype),
+                                      shape=(n,) + tuple(image_shape[:2]))
+        meta = {'num_samples': num_samples, 'shard_size': shard_size, 'image_shape': list(image_shape),
+                'depth_dtype': depth_dtype, 'filenames': list(filenames)}
+        with open(os.path.join(root, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        return cls(root, mode='r+')
+
+    @staticmethod
+    def shard_path(root, kind, shard):
+        return os.path.join(root, '{}_shard{}.npy'.format(kind, shard))
+
+    def _shard(self, kind, shard):
+        key = (kind, shard)
+        if key not in self._shards:
+            self._shards[key] = np.load(self.shard_path(self.root, kind, shard), mmap_mode=self.mode)
+        return self._shards[key]
+
+    def read_image(self, idx):
+        """Return the (H, W, 3) uint8 image of sample ``idx``."""
+        shard, offset = divmod(idx, self.shard_size)
+        return np.array(self._shard('images', shard)[offset])
+
+    def read_depth(self, idx):
+        """Return the (H, W) masked float32 depth of sample ``idx``."""
+        shard, offset = divmod(idx, self.shard_size)
+        return self._shard('depths', shard)[offset].astype(np.float32)
+
+    def write(self, idx, image, depth):
+        shard, offset = divmod(idx, self.shard_size)
+        self._shard('images', shard)[offset] = image
+        self._shard('depths', shard)[offset] = depth
+
+    def flush(self):
+        for shard in self._shards.values():
+            shard.flush()
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
@@ -0,0 +1,95 @@
+import os
+import hashlib
+
+import numpy as np
+
+
+class SplitIndex(object):
+    """Split file parsed once into flat NumPy arrays instead of a list of line strings.
+
+    The whitespace separated fields of all lines are stored back to back as UTF-8 in ``buffer``; field ``j`` spans
+    ``buffer[field_offsets[j]:field_offsets[j + 1]]`` and line ``i`` holds fields ``line_offsets[i]`` to
+    ``line_offsets[i + 1]``. NumPy arrays carry no per-element reference counts, so the dataloader workers share
+    the pages of the parent (or of the memory-mapped cache) instead of copying them on first access.
+    """
+    names = ('buffer', 'field_offsets', 'line_offsets')
+
+    def __init__(self, buffer, field_offsets, line_offsets, root=None):
+        self.buffer = buffer
+        self.field_offsets = field_offsets
+        self.line_offsets = line_offsets
+        # directory of the .npy cache the arrays are mapped from, if any
+        self.root = root
+
+    @classmethod
+    def from_lines(cls, lines):
+        fields = [field.encode('utf-8') for line in lines for field in line.split()]
+        field_offsets = np.zeros(len(fields) + 1, dtype=np.int64)
+        np.cumsum([len(field) for field in fields], out=field_offsets[1:])
+        line_offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+        np.cumsum([len(line.split()) for line in lines], out=line_offsets[1:])
+        buffer = np.frombuffer(b''.join(fields), dtype=np.uint8).copy()
+        return cls(buffer, field_offsets, line_offsets)
+
+    @classmethod
+    def load(cls, path, cache_dir=None):
+        """Parse the split file ``path``, through a memory-mapped ``.npy`` cache under ``cache_dir`` if given."""
+        if not cache_dir:
+            with open(path, 'r') as f:
+                return cls.from_lines(f.readlines())
+
+        # the cache is keyed on the split file and invalidated when it changes
+        stat = os.stat(path)
+        key = '{}:{}:{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        root = os.path.join(cache_dir, '{}-{}'.format(os.path.basename(path),
+                                                     hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]))
+        if not os.path.exists(os.path.join(root, 'line_offsets.npy')):
+            with open(path, 'r') as f:
+                index = cls.from_lines(f.readlines())
+            if not os.path.exists(root):
+                os.makedirs(root, exist_ok=True)
+            # line_offsets is written last and atomically, so that a concurrent reader never sees a partial cache
+            for name in cls.names:
+                tmp = os.path.join(root, '{}.{}.tmp.npy'.format(name, os.getpid()))
+                np.save(tmp, getattr(index, name))
+                os.replace(tmp, os.path.join(root, name + '.npy'))
+        return cls.from_cache(root)
+
+    @classmethod
+    def from_cache(cls, root):
+        return cls(*[np.load(os.path.join(root, name + '.npy'), mmap_mode='r') for name in cls.names], root=root)
+
+    def num_fields(self, idx):
+        return int(self.line_offsets[idx + 1] - self.line_offsets[idx])
+
+    def field(self, idx, k):
+        """Return field ``k`` of line ``idx``, i.e. ``line.split()[k]``."""
+        if not 0 <= k < self.num_fields(idx):
+            raise IndexError('line {} has {} fields, no field {}'.format(idx, self.num_fields(idx), k))
+        j = self.line_offsets[idx] + k
+        return self.buffer[self.field_offsets[j]:self.field_offsets[j + 1]].tobytes().decode('utf-8')
+
+    def fields(self, idx):
+        return [self.field(idx, k) for k in range(self.num_fields(idx))]
+
+    def __getitem__(self, idx):
+        """Return line ``idx`` with its fields joined by single spaces."""
+        return ' '.join(self.fields(idx))
+
+    def __len__(self):
+        return len(self.line_offsets) - 1
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __getstate__(self):
+        # spawned workers map the cache again instead of receiving a pickled copy of the arrays
+        if self.root is None:
+            return self.__dict__.copy()
+        return {'root': self.root}
+
+    def __setstate__(self, state):
+        if set(state) == {'root'}:
+            state = SplitIndex.from_cache(state['root']).__dict__
+        self.__dict__.update(state)
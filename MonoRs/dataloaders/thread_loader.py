@@ -0,0 +1,112 @@
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from torch.utils.data import DataLoader
+
+try:
+    from torch.utils.data import default_collate
+except ImportError:
+    from torch.utils.data._utils.collate import default_collate
+
+
+class ThreadDataLoader(object):
+    """DataLoader replacement that decodes the samples with a thread pool of the main process.
+
+    PIL and OpenCV release the GIL while decoding, so threads parallelise the loaders without worker processes,
+    pickling or shared-memory IPC. Tensors are copied by the loading threads straight into a ring of
+    ``prefetch + 3`` pinned batch buffers; the batch handed out holds views of a buffer, which is refilled once two
+    further batches have been requested, so it must be copied to the device (e.g. ``.cuda(non_blocking=True)``)
+    before then. Values that are not tensors are collated as usual.
+    """
+    def __init__(self, dataset, batch_size=1, shuffle=False, sampler=None, num_threads=4, pin_memory=False,
+                 prefetch=2, drop_last=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.sampler = sampler
+        self.num_threads = num_threads
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.prefetch = prefetch
+        self.drop_last = drop_last
+        # the batch held by the caller, the previous one still being copied and the prefetched ones
+        self.ring = prefetch + 3
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def batches(self):
+        if self.sampler is not None:
+            indices = list(iter(self.sampler))
+        elif self.shuffle:
+            indices = torch.randperm(len(self.dataset)).tolist()
+        else:
+            indices = list(range(len(self.dataset)))
+        batches = [indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+        return batches
+
+    def __len__(self):
+        n = len(self.sampler) if self.sampler is not None else len(self.dataset)
+        return n // self.batch_size if self.drop_last else (n + self.batch_size - 1) // self.batch_size
+
+    def buffer(self, key, value):
+        with self.lock:
+            if key not in self.buffers:
+                self.buffers[key] = torch.empty((self.ring, self.batch_size) + tuple(value.shape), dtype=value.dtype,
+                                                pin_memory=self.pin_memory)
+        buffer = self.buffers[key]
+        if buffer.shape[2:] != value.shape or buffer.dtype != value.dtype:
+            raise ValueError('{} of shape {} and type {} does not fit the batch buffer of shape {} and type {}, '
+                             'use the process workers for samples of varying size'.format(
+                                 key, tuple(value.shape), value.dtype, tuple(buffer.shape[2:]), buffer.dtype))
+        return buffer
+
+    def load(self, slot, pos, idx):
+        """Load sample ``idx`` into position ``pos`` of buffer ``slot``; return its remaining values."""
+        sample = self.dataset[idx]
+        rest = {}
+        for key, value in sample.items():
+            if isinstance(value, torch.Tensor):
+                self.buffer(key, value)[slot, pos].copy_(value)
+            else:
+                rest[key] = value
+        return rest
+
+    def assemble(self, slot, keys, rests):
+        batch = default_collate(rests) if rests[0] else {}
+        for key in keys:
+            batch[key] = self.buffers[key][slot, :len(rests)]
+        return batch
+
+    def __iter__(self):
+        batches = self.batches()
+        with ThreadPoolExecutor(self.num_threads) as executor:
+            pending = collections.deque()
+
+            def submit(b):
+                slot = b % self.ring
+                futures = [executor.submit(self.load, slot, pos, idx) for pos, idx in enumerate(batches[b])]
+                pending.append((slot, futures))
+
+            for b in range(min(self.prefetch + 1, len(batches))):
+                submit(b)
+            for b in range(len(batches)):
+                slot, futures = pending.popleft()
+                rests = [future.result() for future in futures]
+                if b + self.prefetch + 1 < len(batches):
+                    submit(b + self.prefetch + 1)
+                with self.lock:
+                    keys = [key for key in self.buffers if key not in rests[0]]
+                yield self.assemble(slot, keys, rests)
+
+
+def make_loader(args, mode, dataset, batch_size, shuffle=False, sampler=None, num_workers=0, pin_memory=False):
+    """Build the loader of ``mode``: a ThreadDataLoader when ``mode`` is in ``--thread_loader_modes``, otherwise a
+    DataLoader with process workers."""
+    if mode in (getattr(args, 'thread_loader_modes', None) or []):
+        return ThreadDataLoader(dataset, batch_size, shuffle=shuffle, sampler=sampler,
+                                num_threads=args.loader_threads, pin_memory=pin_memory)
+    return DataLoader(dataset, batch_size, shuffle=shuffle, sampler=sampler, num_workers=num_workers,
+                      pin_memory=pin_memory)
@@ -9,7 +9,10 @@
 #   https://github.com/rwightman/pytorch-image-models/tree/master/timm/models/vision_transformer.py
 
 import logging
+from typing import Optional
 
+import torch
+import torch.nn.functional as F
 from torch import Tensor
 from torch import nn
 
@@ -25,8 +28,44 @@ except ImportError:
     logger.warning("xFormers not available")
     XFORMERS_AVAILABLE = False
 
+# fused flash / memory-efficient / math kernels of PyTorch >= 2.0
+SDPA_AVAILABLE = hasattr(F, "scaled_dot_product_attention")
+
+ATTENTION_BACKENDS = ("xformers", "sdpa", "math")
+
+
+def default_attention_backend() -> str:
+    if XFORMERS_AVAILABLE:
+        return "xformers"
+    return "sdpa" if SDPA_AVAILABLE else "math"
+
+
+def check_attention_backend(backend: str) -> str:
+    if backend not in ATTENTION_BACKENDS:
+        raise ValueError("attention backend must be one of {}, got {}".format(ATTENTION_BACKENDS, backend))
+    if backend == "xformers" and not XFORMERS_AVAILABLE:
+        raise ValueError("the xformers attention backend needs xFormers")
+    if backend == "sdpa" and not SDPA_AVAILABLE:
+        raise ValueError("the sdpa attention backend needs PyTorch >= 2.0")
+    return backend
+
+
+def set_attention_backend(model: nn.Module, backend: str) -> None:
+    """Run every attention layer of ``model`` with ``backend``, one of ``ATTENTION_BACKENDS``."""
+    check_attention_backend(backend)
+    for module in model.modules():
+        if isinstance(module, Attention):
+            module.backend = backend
+
 
 class Attention(nn.Module):
+    """Multi-head self-attention.
+
+    ``backend`` selects the kernel: xFormers ``memory_efficient_attention``, PyTorch's fused
+    ``scaled_dot_product_attention`` or the explicit softmax(q k^T) v, which materialises the (B, heads, N, N)
+    attention matrix. By default the first available of these.
+    """
+
     def __init__(
         self,
         dim: int,
@@ -35,49 +74,57 @@ class Attention(nn.Module):
         proj_bias: bool = True,
         attn_drop: float = 0.0,
         proj_drop: float = 0.0,
+        backend: Optional[str] = None,
     ) -> None:
         super().__init__()
         self.num_heads = num_heads
         head_dim = dim // num_heads
         self.scale = head_dim**-0.5
+        self.backend = default_attention_backend() if backend is None else check_attention_backend(backend)
 
         self.qkv = nn.Linear(dim, dim * 3, bias=qkv_bias)
         self.attn_drop = nn.Dropout(attn_drop)
         self.proj = nn.Linear(dim, dim, bias=proj_bias)
         self.proj_drop = nn.Dropout(proj_drop)
 
-    def forward(self, x: Tensor) -> Tensor:
-        B, N, C = x.shape
-        qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
+    def attend(self, q: Tensor, k: Tensor, v: Tensor, attn_bias: Optional[Tensor] = None) -> Tensor:
+        """softmax(q k^T / sqrt(head_dim) + attn_bias) v of (B, heads, N, head_dim) tensors."""
+        if self.backend == "sdpa":
+            dropout_p = self.attn_drop.p if self.training else 0.0
+            return F.scaled_dot_product_attention(q, k, v, attn_mask=attn_bias, dropout_p=dropout_p)
 
-        q, k, v = qkv[0] * self.scale, qkv[1], qkv[2]
-        attn = q @ k.transpose(-2, -1)
+        attn = (q * self.scale) @ k.transpose(-2, -1)
+        if attn_bias is not None:
+            attn = attn + attn_bias
 
         attn = attn.softmax(dim=-1)
         attn = self.attn_drop(attn)
+        return attn @ v
 
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
-        x = self.proj(x)
-        x = self.proj_drop(x)
-        return x
-
-
-class MemEffAttention(Attention):
     def forward(self, x: Tensor, attn_bias=None) -> Tensor:
-        if not XFORMERS_AVAILABLE:
-            assert attn_bias is None, "xFormers is required for nested tensors usage"
-            return super().forward(x)
-
         B, N, C = x.shape
         qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads)
 
-        q, k, v = unbind(qkv, 2)
+        if self.backend == "xformers":
+            q, k, v = unbind(qkv, 2)
+            x = memory_efficient_attention(q, k, v, attn_bias=attn_bias, p=self.attn_drop.p if self.training else 0.0)
+        else:
+            q, k, v = qkv.permute(2, 0, 3, 1, 4)
+            if attn_bias is None or isinstance(attn_bias, Tensor):
+                x = self.attend(q, k, v, attn_bias)
+            else:
+                # the block diagonal xFormers bias of nested tensors concatenated along N: each of them attends to
+                # itself only
+                starts = attn_bias.q_seqinfo.seqstart_py
+                x = torch.cat([self.attend(q[:, :, s:e], k[:, :, s:e], v[:, :, s:e])
+                               for s, e in zip(starts[:-1], starts[1:])], dim=2)
+            x = x.transpose(1, 2)
 
-        x = memory_efficient_attention(q, k, v, attn_bias=attn_bias)
         x = x.reshape([B, N, C])
-
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
 
-        
\ No newline at end of file
+
+class MemEffAttention(Attention):
+    """``Attention`` that also takes the ``attn_bias`` of nested tensors (see ``NestedTensorBlock``)."""
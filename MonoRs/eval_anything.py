@@ -1,15 +1,19 @@
 import torch
 import torch.backends.cudnn as cudnn
+import torch.nn.functional as F
 
 import os, sys
 import argparse
 import numpy as np
 from tqdm import tqdm
 
-from utils import post_process_depth, flip_lr, compute_errors
+from utils import compute_errors
+from tta import TestTimeAugmentation, DEFAULT_VIEWS
+from precision import autocast, PRECISIONS
 from networks.NewCRFDepth import NewCRFDepth
 
-from dataloaders.anywhu_dataloader import NewDataLoader
+from dataloaders.anywhu_dataloader import NewDataLoader, BORDER_WIDTH
+from dataloaders.device_preprocess import DevicePreprocess
 
 from depth_anything_v2.dpt import DepthAnythingV2
 
@@ -51,6 +55,13 @@ parser.add_argument('--max_depth_eval', type=float, help='maximum depth for eval
 parser.add_argument('--eigen_crop', help='if set, crops according to Eigen NIPS14', action='store_true')
 parser.add_argument('--garg_crop', help='if set, crops according to Garg  ECCV16', action='store_true')
 parser.add_argument('--input-size', type=int, default=518)
+parser.add_argument('--uint8_transport', help='if set, the loader workers emit uint8 images that are cast, '
+                                              'normalized and padded on the GPU', action='store_true')
+parser.add_argument('--tta_views', type=str, nargs='+', help='test-time augmentation views run as one batch, e.g. '
+                                                             'identity hflip vflip scale0.75',
+                    default=list(DEFAULT_VIEWS))
+parser.add_argument('--precision', type=str, help='autocast precision of the model', default='fp32',
+                    choices=PRECISIONS)
 
 
 
@@ -73,39 +84,34 @@ else:
 
 
 
+def depth_anything_predict(model, precision='fp32'):
+    """Wrap DepthAnythingV2 as a test-time augmentation ``predict(images, target_size)`` run under the autocast of
+    ``precision``."""
+    def predict(images, target_size):
+        with autocast(precision, images.device):
+            depth = model(images).unsqueeze(1).float()
+        if tuple(depth.shape[-2:]) != tuple(target_size):
+            depth = F.interpolate(depth, size=tuple(target_size), mode='bilinear', align_corners=False)
+        return depth, None
+    return predict
+
+
 def eval(model, dataloader_eval, post_process=False):
     eval_measures = torch.zeros(10).cuda()
+    # DepthAnythingV2 needs multiples of the 14 pixel patch size
+    tta = TestTimeAugmentation(depth_anything_predict(model, args.precision), views=args.tta_views if post_process else ['identity'],
+                               size_multiple=14)
+    preprocess = DevicePreprocess(BORDER_WIDTH, device='cuda')
 
     for _, eval_sample_batched in enumerate(tqdm(dataloader_eval.data)):
         with torch.no_grad():
-            image = torch.autograd.Variable(eval_sample_batched['image'])
-            image=image.squeeze()
+            image = torch.autograd.Variable(preprocess(eval_sample_batched['image']))
             gt_depth = eval_sample_batched['depth']
-            image=image.numpy().transpose(1,2,0)
             padding_height, padding_width = 420, 840
-            top_pad, left_pad = padding_height - image.shape[0], padding_width - image.shape[1]
-            image = np.lib.pad(image, ((top_pad, 0), (0, left_pad), (0, 0)),
-                             mode='constant', constant_values=0)
-
-
-
-            pred_depths_r_list = model.infer_image(image,args.input_size)
-
-            if post_process:
-
-                image = image.transpose(2,0,1)
-
-                image = torch.from_numpy(image)
-                image = image.unsqueeze(0)
-
-
-                image_flipped = flip_lr(image)
-                image_flipped = image_flipped.cuda()
-                pred_depths_flipped = model(image_flipped)
-                image = image.cuda()
-                pred_depth = model(image)
+            top_pad, left_pad = padding_height - image.shape[-2], padding_width - image.shape[-1]
+            image = F.pad(image, (0, left_pad, top_pad, 0), mode='constant', value=0)
 
-                pred_depth = post_process_depth(pred_depth.unsqueeze(1), pred_depths_flipped.unsqueeze(1))
+            pred_depth, _ = tta(image)
 
             pred_depth = pred_depth.cpu().numpy().squeeze()
             gt_depth = gt_depth.cpu().numpy().squeeze()
@@ -0,0 +1,101 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from tqdm import tqdm
+
+import utils
+from tta import TestTimeAugmentation, newcrf_predict
+from metrics import compute_errors, clip_prediction, METRIC_NAMES
+from dataloaders.anywhu_dataloader import BORDER_WIDTH
+from dataloaders.device_preprocess import DevicePreprocess
+
+
+def per_image_errors(gt_depth, pred_depth, min_depth, max_depth):
+    """The (B, 12) metrics of a (B, H, W) batch with ``utils.compute_errors``, image by image on the CPU."""
+    measures = []
+    for gt, pred in zip(gt_depth.cpu().numpy(), pred_depth.cpu().numpy()):
+        pred[pred < min_depth] = min_depth
+        pred[pred > max_depth] = max_depth
+        pred[np.isinf(pred)] = max_depth
+        pred[np.isnan(pred)] = min_depth
+
+        valid_mask = np.logical_and(gt > min_depth, gt < max_depth)
+        measures.append(utils.compute_errors(gt[valid_mask], pred[valid_mask]))
+    return torch.tensor(measures, dtype=torch.float64)
+
+
+def online_eval(model, dataloader_eval, gpu, args, group=None, post_process=False):
+    """Evaluate ``model`` on the online eval split; return the mean of the 12 metrics on the first process (None on
+    the others).
+
+    The metrics are those of ``utils.compute_errors``, per image; with ``--device_metrics`` they are computed for the
+    whole batch on the device by ``metrics.compute_errors``.
+    """
+    eval_measures = torch.zeros(13).cuda(device=gpu)
+    early_exit = None
+    if args.exit_threshold is not None:
+        early_exit = {'threshold': args.exit_threshold, 'min_delta': args.exit_min_delta, 'tile': args.exit_tile}
+    num_iters = []
+    preprocess = DevicePreprocess(BORDER_WIDTH, device=gpu)
+    tta = TestTimeAugmentation(newcrf_predict(model, precision=getattr(args, 'precision', 'fp32'),
+                                              early_exit=early_exit),
+                               views=args.tta_views if post_process else ['identity'])
+    for _, eval_sample_batched in enumerate(tqdm(dataloader_eval.data)):
+        with torch.no_grad():
+            image = torch.autograd.Variable(preprocess(eval_sample_batched['image']))
+            gt_depth = eval_sample_batched['depth']
+
+            # the ground truth is (B, H, W, 1)
+            pred_depth, iters = tta(image, target_size=gt_depth.shape[1:3])
+            if early_exit is not None:
+                num_iters.append(iters.mean().item())
+
+            if getattr(args, 'device_metrics', False):
+                # the metrics of the whole batch are computed per image on the device
+                pred_depth = clip_prediction(pred_depth[:, 0], args.min_depth_eval, args.max_depth_eval)
+                gt_depth = gt_depth.cuda(gpu, non_blocking=True)[..., 0]
+                valid_mask = torch.logical_and(gt_depth > args.min_depth_eval, gt_depth < args.max_depth_eval)
+
+                measures = compute_errors(gt_depth, pred_depth, valid_mask, new_thresholds=args.new_thresholds)
+            else:
+                measures = per_image_errors(gt_depth[..., 0], pred_depth[:, 0].float(), args.min_depth_eval,
+                                            args.max_depth_eval)
+
+        eval_measures[:12] += measures.sum(0).float().to(eval_measures.device)
+        eval_measures[12] += measures.shape[0]
+
+    if args.multiprocessing_distributed:
+
+        dist.all_reduce(tensor=eval_measures, op=dist.ReduceOp.SUM, group=group)
+
+    if not args.multiprocessing_distributed or gpu == 0:
+        eval_measures_cpu = eval_measures.cpu()
+        cnt = eval_measures_cpu[12].item()
+        eval_measures_cpu /= cnt
+        print('Computing errors for {} eval samples'.format(int(cnt)), ', post_process: ', post_process)
+        if early_exit is not None:
+            print('Average refinement iterations: {:.2f}'.format(np.mean(num_iters)))
+        print(', '.join('{:>7}'.format(name) for name in METRIC_NAMES))
+        for i in range(11):
+            print('{:7.4f}, '.format(eval_measures_cpu[i]), end='')
+        print('{:7.4f}'.format(eval_measures_cpu[11]))
+        return eval_measures_cpu
+
+    return None
+
+
+def write_eval_log(log_path, global_step, eval_measures):
+    """Append the metrics of ``global_step`` to the dated ``_logs.txt`` in ``log_path``."""
+    exp_name = '%s' % (datetime.now().strftime('%m%d'))
+    log_txt = os.path.join(log_path, exp_name + '_logs.txt')
+    with open(log_txt, 'a') as txtfile:
+        txtfile.write(">>>>>>>>>>>>>>>>>>>>>>>>>Step:%d>>>>>>>>>>>>>>>>>>>>>>>>>\n" % (int(global_step)))
+        txtfile.write(', '.join('{:>7}'.format(name) for name in METRIC_NAMES) + '\n')
+        txtfile.write("depth estimation\n")
+        line = ''
+        for i in range(12):
+            line += '{:7.4f}, '.format(eval_measures[i])
+        txtfile.write(line + '\n')
@@ -0,0 +1,71 @@
+import math
+
+import numpy as np
+import torch
+
+
+METRIC_NAMES = ('silog', 'abs_rel', 'log10', 'rms', 'sq_rel', 'log_rms', 'd1', 'd2', 'd3', 'd1_new', 'd2_new',
+                'd3_new')
+# max(gt / pred, pred / gt) thresholds of d1-d3 and, tighter for the high-altitude scenes, of d1_new-d3_new for
+# --device_metrics; the latter are set with --new_thresholds and should be those of utils.compute_errors, which the
+# per-image online eval uses and tests/test_metrics.py checks them against
+THRESHOLDS = (1.25, 1.25 ** 2, 1.25 ** 3)
+NEW_THRESHOLDS = (1.05, 1.05 ** 2, 1.05 ** 3)
+
+
+def compute_errors_reference(gt, pred, thresholds=THRESHOLDS, new_thresholds=NEW_THRESHOLDS):
+    """The 12 metrics of ``METRIC_NAMES`` of one image, from the NumPy arrays of its valid ``gt`` and ``pred``
+    pixels; the definition ``compute_errors`` is tested against."""
+    thresh = np.maximum((gt / pred), (pred / gt))
+    deltas = [(thresh < t).mean() for t in tuple(thresholds) + tuple(new_thresholds)]
+    rms = (gt - pred) ** 2
+    rms = np.sqrt(rms.mean())
+    log_rms = (np.log(gt) - np.log(pred)) ** 2
+    log_rms = np.sqrt(log_rms.mean())
+    abs_rel = np.mean(np.abs(gt - pred) / gt)
+    sq_rel = np.mean(((gt - pred) ** 2) / gt)
+    err = np.log(pred) - np.log(gt)
+    silog = np.sqrt(np.mean(err ** 2) - np.mean(err) ** 2) * 100
+    err = np.abs(np.log10(pred) - np.log10(gt))
+    log10 = np.mean(err)
+    return [silog, abs_rel, log10, rms, sq_rel, log_rms] + deltas
+
+
+def clip_prediction(pred, min_depth, max_depth):
+    """Clip as the per-image evaluation does: to [min_depth, max_depth], with inf at max_depth and nan at
+    min_depth."""
+    pred = torch.nan_to_num(pred, nan=min_depth, posinf=max_depth, neginf=min_depth)
+    return pred.clamp(min_depth, max_depth)
+
+
+def compute_errors(gt, pred, valid, thresholds=THRESHOLDS, new_thresholds=NEW_THRESHOLDS):
+    """Batched torch version of ``compute_errors_reference``.
+
+    ``gt``, ``pred`` and the boolean ``valid`` are (B, ...) tensors; the metrics of every image are computed over its
+    valid pixels only, so padding or missing ground truth never counts. Returns a (B, 12) float64 tensor in the order
+    of ``METRIC_NAMES`` on the device of the inputs. An image without valid pixels gets nan, as in the reference.
+    """
+    dims = tuple(range(1, gt.dim()))
+    valid = valid.to(torch.bool)
+    # invalid pixels are set to 1 in both, which zeroes their errors; the per-pixel terms are computed in the input
+    # precision like the reference and summed in float64
+    one = torch.ones((), dtype=gt.dtype, device=gt.device)
+    gt = torch.where(valid, gt, one)
+    pred = torch.where(valid, pred.to(gt.dtype), one)
+    n = valid.sum(dims).double()
+
+    def mean(x):
+        return x.sum(dims, dtype=torch.float64) / n
+
+    ratio = torch.max(gt / pred, pred / gt)
+    deltas = [mean((ratio < t) & valid) for t in tuple(thresholds) + tuple(new_thresholds)]
+
+    diff = gt - pred
+    err = torch.log(pred) - torch.log(gt)
+    rms = torch.sqrt(mean(diff ** 2))
+    log_rms = torch.sqrt(mean(err ** 2))
+    abs_rel = mean(diff.abs() / gt)
+    sq_rel = mean(diff ** 2 / gt)
+    silog = torch.sqrt(mean(err ** 2) - mean(err) ** 2) * 100
+    log10 = mean(err.abs()) / math.log(10)
+    return torch.stack([silog, abs_rel, log10, rms, sq_rel, log_rms] + deltas, dim=1)
@@ -103,6 +103,8 @@ class NewCRFDepth(nn.Module):
 
         self.encoder = encoder
         self.pretrained = DINOv2(model_name=encoder)
+        # set by freeze_backbone
+        self.backbone_frozen = False
 
         # self.backbone = SwinTransformer(**backbone_cfg)
         v_dim = decoder_cfg['num_classes'] * 4
@@ -209,13 +211,50 @@ class NewCRFDepth(nn.Module):
 
 
 
-    def forward(self, imgs, epoch=1, step=100):
-
+    def freeze_backbone(self):
+        """Freeze the DINOv2 trunk; ``forward_features`` then runs it with autograd disabled, so that only its
+        outputs, as constants, enter the graph of the head."""
+        for param in self.pretrained.parameters():
+            param.requires_grad = False
+        self.backbone_frozen = True
+
+    def forward_features(self, imgs):
+        """Run the DINOv2 trunk and return the four intermediate feature maps fed to ``projects``."""
+        with torch.set_grad_enabled(torch.is_grad_enabled() and not self.backbone_frozen):
+            feats = self.pretrained.get_intermediate_layers(imgs, self.intermediate_layer_idx[self.encoder],
+                                                            reshape=True)
+        return list(feats)
+
+    def upsample_output(self, x, size, mask=None):
+        """Upsample a refined map to ``size``, through the convex upsampling ``mask`` when ``up_mode`` is 'mask'."""
+        if mask is not None:
+            x = self.upsample_mask(x, mask)
+            if tuple(x.shape[-2:]) == tuple(size):
+                return x
+        return upsample2(x, size)
+
+    def forward(self, imgs, epoch=1, step=100, feats=None, inference=False, return_uncertainty=False,
+                early_exit=None, target_size=None):
+        """``feats`` may hold precomputed ``forward_features`` outputs (e.g. from a feature cache), in which case
+        ``imgs`` is not used and the backbone is skipped.
+
+        The outputs are upsampled to ``target_size`` (H, W), by default the resolution of ``imgs``, or the patch grid
+        of ``feats`` times the patch size when only the features are given.
+
+        With ``inference`` only the final refined depth is kept and upsampled, returned as
+        ``[depth_r], [], [uncertainty]``; the uncertainty list stays empty unless ``return_uncertainty`` is set.
+        ``early_exit`` (inference only) stops the refinement adaptively, see ``BasicUpdateBlockDepth.forward``;
+        the number of iterations run for every image is then returned as a fourth output.
+        """
 
         out = []
-        feats=self.pretrained.get_intermediate_layers(imgs, self.intermediate_layer_idx[self.encoder],reshape=True,return_class_token=True)
+        if feats is None:
+            feats = self.forward_features(imgs)
+        if target_size is None:
+            # cached features only give the patch grid of the image
+            target_size = tuple(imgs.shape[-2:]) if imgs is not None else \
+                [s * self.pretrained.patch_size for s in feats[0].shape[-2:]]
         for i,x in enumerate(feats):
-            x=x[0]
             x=self.projects[i](x)
             x=self.resize_layers[i](x)
             out.append(x)
@@ -248,24 +287,26 @@ class NewCRFDepth(nn.Module):
         context = out[0]
         gru_hidden = torch.tanh(self.project(e1))
         # print("ok")
-        pred_depths_r_list, pred_depths_c_list, uncertainty_maps_list = self.update(depth, context, gru_hidden,max_tree_depth, self.depth_num,self.min_depth, self.max_depth)
+        outputs = self.update(depth, context, gru_hidden,max_tree_depth, self.depth_num,self.min_depth, self.max_depth, inference=inference, early_exit=early_exit)
+        pred_depths_r_list, pred_depths_c_list, uncertainty_maps_list = outputs[:3]
         # print("ook")
-        if self.up_mode == 'mask':
-            for i in range(len(pred_depths_r_list)):
-                pred_depths_r_list[i] = self.upsample_mask(pred_depths_r_list[i], mask)
-            for i in range(len(pred_depths_c_list)):
-                pred_depths_c_list[i] = self.upsample_mask(pred_depths_c_list[i], mask.detach())
-            for i in range(len(uncertainty_maps_list)):
-                uncertainty_maps_list[i] = self.upsample_mask(uncertainty_maps_list[i], mask.detach())
-        else:
-            for i in range(len(pred_depths_r_list)):
-                # print(pred_depths_r_list[i].shape)
-                pred_depths_r_list[i] = upsample2(pred_depths_r_list[i])
-            for i in range(len(pred_depths_c_list)):
-                pred_depths_c_list[i] = upsample2(pred_depths_c_list[i])
-            for i in range(len(uncertainty_maps_list)):
-                uncertainty_maps_list[i] = upsample2(uncertainty_maps_list[i])
-
+        if inference:
+            pred_depths_c_list = []
+            if not return_uncertainty:
+                uncertainty_maps_list = []
+        if self.up_mode != 'mask':
+            mask = None
+        for i in range(len(pred_depths_r_list)):
+            pred_depths_r_list[i] = self.upsample_output(pred_depths_r_list[i], target_size, mask)
+        if mask is not None:
+            mask = mask.detach()
+        for i in range(len(pred_depths_c_list)):
+            pred_depths_c_list[i] = self.upsample_output(pred_depths_c_list[i], target_size, mask)
+        for i in range(len(uncertainty_maps_list)):
+            uncertainty_maps_list[i] = self.upsample_output(uncertainty_maps_list[i], target_size, mask)
+
+        if early_exit is not None:
+            return pred_depths_r_list, pred_depths_c_list, uncertainty_maps_list, outputs[3]
         return pred_depths_r_list, pred_depths_c_list, uncertainty_maps_list
 
 class DispHead(nn.Module):
@@ -291,7 +332,17 @@ class BasicUpdateBlockDepth(nn.Module):
         self.gru = SepConvGRU(hidden_dim=hidden_dim, input_dim=self.encoder.out_chs + context_dim)
         self.p_head = PHead(hidden_dim, hidden_dim)
 
-    def forward(self, depth, context, gru_hidden, seq_len, depth_num, min_depth, max_depth):
+    def forward(self, depth, context, gru_hidden, seq_len, depth_num, min_depth, max_depth, inference=False,
+                early_exit=None):
+        """With ``inference`` the intermediate iterations are not kept and each list only holds the last one.
+
+        ``early_exit`` is a dict with ``threshold`` and optionally ``min_delta`` and ``tile``. After every
+        iteration the mean uncertainty of each image (or of each ``tile`` x ``tile`` tile) is compared against
+        ``threshold``; an image or tile whose uncertainty drops below it, or improves by less than ``min_delta``,
+        is frozen at its current state. The refinement stops once every image is frozen, and the number of
+        iterations run for each image is returned as a fourth output.
+        """
+        assert early_exit is None or inference, 'early exit is only supported in inference mode'
         pred_depths_r_list = []
         pred_depths_c_list = []
         uncertainty_maps_list = []
@@ -309,6 +360,11 @@ class BasicUpdateBlockDepth(nn.Module):
         current_depths = 0.5 * (bin_edges[:, :-1] + bin_edges[:, 1:])  # (a(n)+a(n+1))/2 depth candidate
         index_iter = 0  # 迭代系数
 
+        if early_exit is not None:
+            num_iters = torch.zeros(b, dtype=torch.long, device=depth.device)
+            frozen = torch.zeros_like(depth, dtype=torch.bool)
+            prev_score = None
+
         for i in range(seq_len):
             input_features = self.encoder(current_depths.detach())
 
@@ -317,22 +373,24 @@ class BasicUpdateBlockDepth(nn.Module):
 
             gru_hidden = self.gru(gru_hidden, input_c)
 
-            pred_prob = self.p_head(gru_hidden)
+            # float32 under autocast: the bin probabilities weight the float32 bin centres
+            pred_prob = self.p_head(gru_hidden).float()
 
 
             depth_r = (pred_prob * current_depths.detach()).sum(1, keepdim=True)
 
-            pred_depths_r_list.append(depth_r)
-
 
             uncertainty_map = torch.sqrt((pred_prob * ((current_depths.detach() - depth_r.repeat(1, depth_num, 1, 1)) ** 2)).sum(1,keepdim=True))
-            uncertainty_maps_list.append(uncertainty_map)
 
             index_iter = index_iter + 1
 
             pred_label = get_label(torch.squeeze(depth_r, 1), bin_edges, depth_num).unsqueeze(1)
             depth_c = torch.gather(current_depths.detach(), 1, pred_label.detach())
-            pred_depths_c_list.append(depth_c)
+
+            if not inference:
+                pred_depths_r_list.append(depth_r)
+                uncertainty_maps_list.append(uncertainty_map)
+                pred_depths_c_list.append(depth_c)
 
             label_target_bin_left = pred_label
             target_bin_left = torch.gather(bin_edges, 1, label_target_bin_left)
@@ -341,8 +399,46 @@ class BasicUpdateBlockDepth(nn.Module):
 
             bin_edges, current_depths = update_sample(bin_edges, target_bin_left, target_bin_right, depth_r.detach(),pred_label.detach(), depth_num, min_depth, max_depth,uncertainty_map)
 
+            if early_exit is not None:
+                if i > 0:
+                    # frozen pixels keep the state of the iteration they stopped at
+                    gru_hidden, bin_edges, current_depths, depth_r, depth_c, uncertainty_map = [
+                        torch.where(frozen, old, new) for old, new in zip(frozen_state, (
+                            gru_hidden, bin_edges, current_depths, depth_r, depth_c, uncertainty_map))]
+                num_iters += ~frozen.flatten(1).all(1)
+
+                stop, prev_score = exit_mask(uncertainty_map, prev_score, **early_exit)
+                frozen = frozen | stop
+                frozen_state = (gru_hidden, bin_edges, current_depths, depth_r, depth_c, uncertainty_map)
+                if frozen.all():
+                    break
+
+        if early_exit is not None:
+            return [depth_r], [depth_c], [uncertainty_map], num_iters
+
+        if inference:
+            return [depth_r], [depth_c], [uncertainty_map]
+
         return pred_depths_r_list, pred_depths_c_list, uncertainty_maps_list
 
+def exit_mask(uncertainty_map, prev_score, threshold, min_delta=None, tile=None):
+    """Pixels of BasicUpdateBlockDepth that can stop refining, from the mean uncertainty of their image or tile."""
+    b, _, h, w = uncertainty_map.shape
+    if tile:
+        score = F.avg_pool2d(uncertainty_map, tile, ceil_mode=True)
+    else:
+        score = uncertainty_map.mean(dim=(1, 2, 3), keepdim=True)
+
+    stop = score < threshold
+    if min_delta is not None and prev_score is not None:
+        stop = stop | (prev_score - score < min_delta)
+
+    if tile:
+        stop = stop.repeat_interleave(tile, dim=2).repeat_interleave(tile, dim=3)[:, :, :h, :w]
+    else:
+        stop = stop.expand(b, 1, h, w)
+    return stop, score
+
 class PHead(nn.Module):
     def __init__(self, input_dim=128, hidden_dim=128):
         super(PHead, self).__init__()
@@ -420,12 +516,9 @@ def upsample1(x, scale_factor=2, mode="bilinear"):
     """
     return F.interpolate(x, scale_factor=scale_factor, mode=mode)
 
-def upsample2(x,  mode="bilinear", align_corners=False):
-    """Upsample input tensor by a factor of 2
+def upsample2(x, size, mode="bilinear", align_corners=False):
+    """Upsample input tensor to size (H, W)
     """
-    hight=384
-    width=768
-    target_size=(hight,width)
-    return F.interpolate(x, size=target_size, mode=mode, align_corners=align_corners)
+    return F.interpolate(x, size=tuple(size), mode=mode, align_corners=align_corners)
 
 
@@ -5,6 +5,8 @@ import copy
 def update_sample(bin_edges, target_bin_left, target_bin_right, depth_r, pred_label, depth_num, min_depth, max_depth, uncertainty_range):
     
     with torch.no_grad():    
+        # the bins stay in float32 under autocast: bf16 steps are 0.5 above 64, coarser than the refined bins
+        depth_r, uncertainty_range = depth_r.float(), uncertainty_range.float()
         b, _, h, w = bin_edges.shape
 
         mode = 'direct'
@@ -27,13 +29,12 @@ def update_sample(bin_edges, target_bin_left, target_bin_right, depth_r, pred_la
 def get_label(gt_depth_img, bin_edges, depth_num):
 
     with torch.no_grad():
-        gt_label = torch.zeros(gt_depth_img.size(), dtype=torch.int64, device=gt_depth_img.device) #创建一个和输入图像一样大小的tensor
-        for i in range(depth_num):
-            bin_mask = torch.ge(gt_depth_img, bin_edges[:, i])
-            bin_mask = torch.logical_and(bin_mask, 
-                torch.lt(gt_depth_img, bin_edges[:, i + 1]))
-            gt_label[bin_mask] = i
-        
-        return gt_label
+        # bin_edges is sorted along dim 1, so one batched binary search finds the bin of every pixel
+        edges = bin_edges.permute(0, 2, 3, 1).contiguous()  # (b, h, w, depth_num + 1)
+        gt_label = torch.searchsorted(edges, gt_depth_img.unsqueeze(-1).contiguous().to(edges.dtype), right=True)
+        gt_label = gt_label.squeeze(-1) - 1
+        # depths outside [bin_edges[:, 0], bin_edges[:, depth_num]) keep label 0
+        gt_label[(gt_label < 0) | (gt_label >= depth_num)] = 0
 
+        return gt_label
 
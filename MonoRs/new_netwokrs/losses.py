@@ -20,12 +20,29 @@ def LogDepth2Prob(Gt_depth, maxdepth=100.0, b=0.5):
 
 
 def Adaptive_Multi_Modal_Cross_Entropy_Loss(x, depth, mask, maxdepth=100.0, m=1, n=9, top_k=9, epsilon=3, min_samples=1):
+    target = Multi_Modal_Target(depth, mask, maxdepth=maxdepth, m=m, n=n, top_k=top_k, epsilon=epsilon,
+                                min_samples=min_samples)
+    loss = Multi_Modal_Cross_Entropy_Loss(x, target)
+    print(loss)
+    return loss
+
+
+def Multi_Modal_Target(depth, mask, maxdepth=100.0, m=1, n=9, top_k=9, epsilon=3, min_samples=1):
+    """Clustered soft target of Adaptive_Multi_Modal_Cross_Entropy_Loss.
+
+    The target only depends on the ground truth, so it is built once per batch and scored against every
+    refinement iteration with Multi_Modal_Cross_Entropy_Loss.
+
+    The prediction enters the loss as the same log-depth for every bin, so the target only needs the mass of the
+    weighted cluster distributions summed over the bins. Each cluster distribution (LogDepth2Prob of the cluster
+    depth) is a softmax over the bins that sums to one, so that mass is the sum of the cluster weights and the
+    (N, n, maxdepth, H, W) distribution is never built.
+    """
 
     assert depth.dim() == 4, "depth 应为 4D 张量 (N, C, H, W)"
     assert mask.dim() == 4, "mask 应为 4D 张量 (N, C, H, W)"
     
 
-    x=x.squeeze(1)
     depth = depth.squeeze(1)  # (N, C=1, H, W) → (N, H, W)
     mask = mask.squeeze(1)     # (N, C=1, H, W) → (N, H, W)
     
@@ -38,38 +55,15 @@ def Adaptive_Multi_Modal_Cross_Entropy_Loss(x, depth, mask, maxdepth=100.0, m=1,
         F.pad(depth.unsqueeze(1), (patch_w//2, patch_w//2, patch_h//2, patch_h//2), mode='reflect'),
         (patch_h, patch_w)
     ).view(N, patch_h*patch_w, H, W)
-    depth_unfold_clone = depth_unfold.clone()
-    
 
-    mask_cluster = torch.zeros((N, patch_h*patch_w, patch_h*patch_w, H, W), device=depth.device).bool()
-    for index in range(patch_h*patch_w):
-        if index == 0:
-            d_min = d_max = depth.unsqueeze(1)  # (N, 1, H, W)
-        else:
-            depth_unfold = depth_unfold * ~mask_cluster[:, index-1, ...]
-            d_min = d_max = torch.max(depth_unfold, dim=1, keepdim=True)[0]
-        
-        mask_cluster[:, index, ...] = (depth_unfold > (d_min - epsilon).clamp(min=0)) & (depth_unfold < (d_max + epsilon).clamp(max=maxdepth))
-        while True:
-            d_min = torch.min(depth_unfold * mask_cluster[:, index, ...] + ~mask_cluster[:, index, ...] * maxdepth, dim=1, keepdim=True)[0]
-            d_max = torch.max(depth_unfold * mask_cluster[:, index, ...], dim=1, keepdim=True)[0]
-            mask_new = (depth_unfold > (d_min - epsilon).clamp(min=0)) & (depth_unfold < (d_max + epsilon).clamp(max=maxdepth))
-            if torch.equal(mask_new, mask_cluster[:, index, ...]):
-                break
-            mask_cluster[:, index, ...] = mask_new
-    
+    cluster = Depth_Clusters(depth_unfold, depth, maxdepth=maxdepth, epsilon=epsilon)  # (N, patch_h*patch_w, H, W)
+    in_cluster = (cluster >= 0).float()
+    cluster = cluster.clamp(min=0)
 
-    depth_cluster = torch.mean(
-        depth_unfold_clone.unsqueeze(1).repeat(1, patch_h*patch_w, 1, 1, 1) * mask_cluster, 
-        dim=2
-    ) * (patch_h*patch_w) / torch.sum(mask_cluster, dim=2).clamp(min=1)  # (N, patch_h*patch_w, H, W)
-    
-    GT = torch.zeros((N, patch_h*patch_w, int(maxdepth), H, W), device=depth.device)
-    for index in range(patch_h*patch_w):
-        GT[:, index, ...] = LogDepth2Prob(depth_cluster[:, index, ...], maxdepth)  # (N, maxdepth, H, W)
+    mask_cluster = torch.zeros_like(depth_unfold).scatter_add_(1, cluster, in_cluster)  # (N, patch_h*patch_w, H, W)
+    num_clusters = (mask_cluster > 0).sum(dim=1)  # (N, H, W)
     
-
-    mask_cluster = torch.sum(mask_cluster, dim=2, keepdim=True)  # (N, patch_h*patch_w, 1, H, W)
+    mask_cluster = mask_cluster.unsqueeze(2)  # (N, patch_h*patch_w, 1, H, W)
     mask_cluster[mask_cluster < min_samples] = 0
     
     w_cluster = 0.4 / (mask_cluster.sum(dim=1, keepdim=True) - 1).clamp(min=1) * mask_cluster  # (N, patch_h*patch_w, 1, H, W)
@@ -81,15 +75,80 @@ def Adaptive_Multi_Modal_Cross_Entropy_Loss(x, depth, mask, maxdepth=100.0, m=1,
     w_cluster = w_cluster / w_cluster.sum(dim=1, keepdim=True).clamp(min=1)  # (N, patch_h*patch_w, 1, H, W)
     
 
-    GT = (GT * w_cluster).sum(dim=1)  # (N, maxdepth, H, W)
-    GT = GT.detach()
+    # only the valid pixels are kept
+    mass = w_cluster.sum(dim=1).squeeze(1)[mask].detach()  # (M,)
 
-    x = x.unsqueeze(1).repeat(1, int(maxdepth), 1, 1)  # (N, maxdepth, H, W)
-    x = torch.log(x + 1e-30)
+    # the clusters used to be grown one after the other, this is how many of those steps the batch needs
+    cluster_steps = num_clusters.max()
 
-    mask = mask.unsqueeze(1).repeat(1, int(maxdepth), 1, 1)  # (N, maxdepth, H, W)
-    num = mask.sum()
+    return {'mass': mass, 'mask': mask, 'num': mass.numel() * int(maxdepth), 'cluster_steps': cluster_steps}
 
-    loss = -(GT[mask] * x[mask]).sum() / num
-    print(loss)
+
+def Depth_Clusters(depth_unfold, depth, maxdepth=100.0, epsilon=3):
+    """Cluster the depth neighbourhood of every pixel in one pass.
+
+    Matches growing the clusters one after the other: cluster 0 starts from the centre depth, each following
+    cluster from the largest depth not clustered yet, and a cluster absorbs every value in (0, maxdepth) closer
+    than ``epsilon`` to it until it stops changing. Once the neighbourhood is sorted a cluster is a run of
+    consecutive values with gaps below ``epsilon``, so the runs are found with a cumulative sum instead of
+    iterating until convergence.
+
+    Args:
+        depth_unfold: (N, P, H, W) neighbourhood of every pixel.
+        depth: (N, H, W) centre depth.
+
+    Returns:
+        (N, P, H, W) cluster index of every neighbour, -1 if it is in no cluster.
+    """
+    P = depth_unfold.shape[1]
+    index = torch.arange(P, device=depth_unfold.device).view(1, P, 1, 1)
+
+    valid = (depth_unfold > 0) & (depth_unfold < maxdepth)
+    values, order = torch.sort(torch.where(valid, depth_unfold, torch.full_like(depth_unfold, float('inf'))), dim=1)
+    valid = torch.gather(valid, 1, order)
+
+    # links between neighbours in sorted order, tested the way a cluster grows upwards and downwards
+    up = torch.zeros_like(valid)
+    down = torch.zeros_like(valid)
+    up[:, 1:] = values[:, 1:] < values[:, :-1] + epsilon
+    down[:, 1:] = values[:, :-1] > values[:, 1:] - epsilon
+    run_up = torch.cumsum(~up, dim=1)
+    run_down = torch.cumsum(~down, dim=1)
+
+    # cluster 0: the values around the centre depth, grown in both directions
+    d = depth.unsqueeze(1)
+    window = valid & (values > (d - epsilon).clamp(min=0)) & (values < (d + epsilon).clamp(max=maxdepth))
+    lo = torch.where(window, index, torch.full_like(index, P)).min(dim=1, keepdim=True)[0]
+    hi = torch.where(window, index, torch.full_like(index, -1)).max(dim=1, keepdim=True)[0]
+    in_first = window.any(dim=1, keepdim=True) & valid & (
+        ((index <= lo) & (run_down == torch.gather(run_down, 1, lo.clamp(max=P - 1)))) |
+        ((index >= lo) & (index <= hi)) |
+        ((index >= hi) & (run_up == torch.gather(run_up, 1, hi.clamp(min=0)))))
+
+    # the following clusters are the remaining runs, largest values first
+    rest = valid & ~in_first
+    after_first = torch.zeros_like(in_first)
+    after_first[:, 1:] = in_first[:, :-1]
+    start = rest & (~down | after_first)
+    rank = start.sum(dim=1, keepdim=True) - torch.cumsum(start, dim=1)  # runs above
+    cluster = torch.where(rest, 1 + rank, torch.full_like(rank, -1))
+
+    # a neighbour at maxdepth is never clustered but stays the largest value, so it seeds every following
+    # cluster: only the top run can still be reached, and only if it comes within epsilon of maxdepth
+    at_max = (depth_unfold >= maxdepth).any(dim=1, keepdim=True)
+    top = torch.where(rest, values, torch.full_like(values, -float('inf'))).max(dim=1, keepdim=True)[0]
+    reach = top > (torch.full_like(top, maxdepth) - epsilon).clamp(min=0)
+    cluster = torch.where(at_max & ~((rank == 0) & reach), torch.full_like(cluster, -1), cluster)
+
+    cluster = torch.where(in_first, torch.zeros_like(cluster), cluster)
+    cluster[cluster >= P] = -1  # cluster 0 was empty and the last run has no slot left
+    return torch.empty_like(cluster).scatter_(1, order, cluster)
+
+
+def Multi_Modal_Cross_Entropy_Loss(x, target):
+    """Cross entropy of the prediction ``x`` (N, 1, H, W) against a target from Multi_Modal_Target."""
+    x = x.squeeze(1)[target['mask']]  # (M,)
+    x = torch.log(x + 1e-30)
+
+    loss = -(target['mass'] * x).sum() / target['num']
     return loss
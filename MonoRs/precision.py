@@ -0,0 +1,27 @@
+import torch
+
+
+PRECISIONS = ('fp32', 'bf16', 'fp16')
+DTYPES = {'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+def autocast(precision='fp32', device='cuda'):
+    """Autocast context of ``--precision`` on ``device``; a disabled one for fp32.
+
+    The backbone, the CRFs and the GRU then run in bf16 or fp16. ``BasicUpdateBlockDepth`` keeps the bin
+    probabilities, the bin edges and their ``cumsum`` in float32, and the callers compute the losses and metrics
+    on float32 outputs.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError('precision must be one of {}, got {}'.format(PRECISIONS, precision))
+    device_type = torch.device(device).type if device is not None else 'cuda'
+    if precision == 'fp32':
+        return torch.autocast(device_type, enabled=False)
+    if precision == 'fp16' and device_type != 'cuda':
+        raise ValueError('fp16 autocast needs a GPU, use bf16 on the CPU')
+    return torch.autocast(device_type, dtype=DTYPES[precision])
+
+
+def grad_scaler(precision='fp32'):
+    """Loss scaler for ``--precision``: only fp16 needs one, for bf16 and fp32 it passes the loss through."""
+    return torch.cuda.amp.GradScaler(enabled=precision == 'fp16')
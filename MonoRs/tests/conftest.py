@@ -0,0 +1,4 @@
+import os, sys
+
+# the tests import the model and loader code from the MonoRs directory, as the scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,106 @@
+import random
+
+import numpy as np
+import pytest
+import torch
+
+# the loaders import their distributed sampler from utils
+pytest.importorskip('utils')
+from dataloaders import anywhu_dataloader, anything_wild_dataloader, levir_dataloader
+from dataloaders.device_augment import DeviceAugment
+
+# 384x384 depth, image padded by 8 rows and 16 columns as BORDER_WIDTH of the WHU and WildUAV loaders
+DEPTH_SIZE = (384, 384)
+IMAGE_SIZE = (392, 400)
+
+
+def row_coded(depth_size, image_size):
+    """Image and depth whose value is the row index, -1 in the padding of the image."""
+    h, w = depth_size
+    depth = np.repeat(np.arange(h, dtype=np.float32)[:, None, None], w, axis=1)
+    image = np.full(image_size + (3,), -1, dtype=np.float32)
+    image[:h, :w] = depth
+    return image, depth
+
+
+@pytest.mark.parametrize('module', [anywhu_dataloader, anything_wild_dataloader, levir_dataloader])
+@pytest.mark.parametrize('image_size', [DEPTH_SIZE, IMAGE_SIZE])
+def test_cut_flip_keeps_rows_aligned(module, image_size):
+    dataset = module.DataLoadPreprocess.__new__(module.DataLoadPreprocess)
+    random.seed(0)
+    for _ in range(20):
+        image, depth = row_coded(DEPTH_SIZE, image_size)
+        image, depth = dataset.Cut_Flip(image, depth)
+        assert image.shape[:2] == image_size and depth.shape[:2] == DEPTH_SIZE
+        np.testing.assert_array_equal(image[:DEPTH_SIZE[0], :DEPTH_SIZE[1], 0], depth[..., 0])
+        assert (image[DEPTH_SIZE[0]:] == -1).all()
+        assert sorted(depth[:, 0, 0]) == list(range(DEPTH_SIZE[0]))
+
+
+@pytest.mark.parametrize('image_size', [DEPTH_SIZE, IMAGE_SIZE])
+def test_device_cut_flip_keeps_rows_aligned(image_size):
+    image, depth = row_coded(DEPTH_SIZE, image_size)
+    image = torch.from_numpy(image).permute(2, 0, 1)[None].repeat(8, 1, 1, 1)
+    depth = torch.from_numpy(depth).permute(2, 0, 1)[None].repeat(8, 1, 1, 1)
+    image, depth = DeviceAugment(seed=0, device='cpu').cut_flip_rows(image, depth)
+    assert (depth[:, 0, :, 0] != torch.arange(DEPTH_SIZE[0])).any()
+    assert torch.equal(image[:, :, :DEPTH_SIZE[0], :DEPTH_SIZE[1]], depth.expand(-1, 3, -1, -1))
+    assert (image[:, :, DEPTH_SIZE[0]:] == -1).all()
+
+
+class CodedSamples(anywhu_dataloader.DataLoadPreprocess):
+    """Training samples whose image encodes the row and column of each pixel (modulo 256) in its first two
+    channels, and whose depth encodes them as ``1000 * row + column``."""
+    def __init__(self, uint8_transport):
+        self.mode = 'train'
+        self.transform = None
+        self.feature_cache = None
+        self.uint8_transport = uint8_transport
+        self.device_augment = False
+
+    def load_image(self, idx):
+        rows, cols = np.indices(DEPTH_SIZE)
+        return np.stack([rows % 256, cols % 256, np.zeros_like(rows)], axis=-1).astype(np.uint8)
+
+    def load_depth(self, idx):
+        rows, cols = np.indices(DEPTH_SIZE)
+        return (1000 * rows + cols).astype(np.float32)[..., None]
+
+    def augment_image(self, image):
+        return image
+
+
+@pytest.mark.parametrize('uint8_transport', [False, True])
+def test_train_sample_keeps_rows_and_columns_aligned(uint8_transport):
+    dataset = CodedSamples(uint8_transport)
+    random.seed(0)
+    for _ in range(20):
+        sample = dataset[0]
+        image, depth = sample['image'], sample['depth'][..., 0]
+        if not uint8_transport:
+            # padded by BORDER_WIDTH at the bottom and on the right
+            assert image.shape[:2] == IMAGE_SIZE
+            assert (image[DEPTH_SIZE[0]:] == 0).all() and (image[:, DEPTH_SIZE[1]:] == 0).all()
+            image = np.round(image[:DEPTH_SIZE[0], :DEPTH_SIZE[1]] * 255)
+        np.testing.assert_array_equal(image[..., 0], (depth // 1000) % 256)
+        np.testing.assert_array_equal(image[..., 1], (depth % 1000) % 256)
+
+
+class FlipOnly(DeviceAugment):
+    """DeviceAugment without the photometric augmentation, which would change the coded values."""
+    def sample_params(self, batch_size):
+        do_flip, do_augment, gamma, factor = super(FlipOnly, self).sample_params(batch_size)
+        return do_flip, torch.zeros_like(do_augment), gamma, factor
+
+
+@pytest.mark.parametrize('image_size', [DEPTH_SIZE, IMAGE_SIZE])
+def test_device_augment_keeps_rows_and_columns_aligned(image_size):
+    rows, cols = torch.meshgrid(torch.arange(DEPTH_SIZE[0]), torch.arange(DEPTH_SIZE[1]), indexing='ij')
+    image = torch.full((8, 2) + image_size, -1.0)
+    image[:, 0, :DEPTH_SIZE[0], :DEPTH_SIZE[1]] = rows.float()
+    image[:, 1, :DEPTH_SIZE[0], :DEPTH_SIZE[1]] = cols.float()
+    depth = (1000 * rows + cols).float()[None, None].repeat(8, 1, 1, 1)
+    image, depth = FlipOnly(seed=0, device='cpu', cut_flip=True)(image, depth)
+    assert torch.equal(image[:, 0, :DEPTH_SIZE[0], :DEPTH_SIZE[1]], depth[:, 0] // 1000)
+    assert torch.equal(image[:, 1, :DEPTH_SIZE[0], :DEPTH_SIZE[1]], depth[:, 0] % 1000)
+    assert (image[:, :, DEPTH_SIZE[0]:] == -1).all() and (image[..., DEPTH_SIZE[1]:] == -1).all()
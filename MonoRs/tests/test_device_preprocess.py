@@ -0,0 +1,26 @@
+import numpy as np
+import torch
+
+from dataloaders import device_preprocess
+from dataloaders.device_preprocess import DevicePreprocess, IMAGENET_MEAN, IMAGENET_STD
+
+
+def test_none_device_holds_the_constants_on_the_resolved_device(monkeypatch):
+    # None, the args.gpu of a non-distributed run, resolves to the current GPU; the meta device stands in for it
+    monkeypatch.setattr(device_preprocess, 'resolve_device',
+                        lambda device: torch.device('meta') if device is None else torch.device(device))
+    preprocess = DevicePreprocess((0, 0, 16, 8), device=None)
+    assert preprocess.device == torch.device('meta')
+    assert preprocess.scale.device == preprocess.device
+    assert preprocess.bias.device == preprocess.device
+
+
+def test_uint8_batch_is_padded_and_normalised():
+    image = torch.randint(0, 256, (2, 24, 32, 3), dtype=torch.uint8)
+    out = DevicePreprocess((0, 0, 16, 8), device='cpu')(image)
+    assert out.shape == (2, 3, 32, 48)
+    mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+    expected = (image.permute(0, 3, 1, 2).float() / 255.0 - mean) / std
+    np.testing.assert_allclose(out[:, :, :24, :32].numpy(), expected.numpy(), atol=1e-5)
+    np.testing.assert_allclose(out[:, :, 24:].numpy(), (-mean / std).expand(2, 3, 8, 48).numpy(), atol=1e-6)
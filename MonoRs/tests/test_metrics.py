@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import torch
+
+from metrics import compute_errors, compute_errors_reference, clip_prediction, METRIC_NAMES
+
+MIN_DEPTH, MAX_DEPTH = 10, 80
+
+
+def random_batch(batch_size=4, height=48, width=96):
+    """Ground truth with a zero padded band and predictions with a few non-finite values, as in online_eval."""
+    rng = np.random.RandomState(0)
+    shape = (batch_size, height, width)
+    gt = rng.uniform(0, 100, shape).astype(np.float32)
+    gt[:, :, -16:] = 0
+    pred = (gt * rng.uniform(0.8, 1.25, shape) + rng.uniform(0, 5, shape)).astype(np.float32)
+    pred.reshape(-1)[rng.randint(0, pred.size, 20)] = np.inf
+    pred.reshape(-1)[rng.randint(0, pred.size, 20)] = np.nan
+    return gt, pred
+
+
+def per_image(gt, pred, errors=compute_errors_reference):
+    """The per-image loop of online_eval before batching."""
+    measures = []
+    for g, p in zip(gt, pred):
+        p = p.copy()
+        p[p < MIN_DEPTH] = MIN_DEPTH
+        p[p > MAX_DEPTH] = MAX_DEPTH
+        p[np.isinf(p)] = MAX_DEPTH
+        p[np.isnan(p)] = MIN_DEPTH
+        valid_mask = np.logical_and(g > MIN_DEPTH, g < MAX_DEPTH)
+        measures.append(errors(g[valid_mask], p[valid_mask]))
+    return np.array(measures, dtype=np.float64)
+
+
+def test_batched_metrics_match_the_per_image_reference():
+    gt, pred = random_batch()
+    g = torch.from_numpy(gt)
+    p = clip_prediction(torch.from_numpy(pred), MIN_DEPTH, MAX_DEPTH)
+    out = compute_errors(g, p, torch.logical_and(g > MIN_DEPTH, g < MAX_DEPTH)).numpy()
+    ref = per_image(gt, pred)
+    assert out.shape == (len(gt), len(METRIC_NAMES))
+    # the deltas are counts and match exactly, the other metrics up to the float32 rounding of the reference
+    np.testing.assert_array_equal(out[:, 6:], ref[:, 6:])
+    np.testing.assert_allclose(out[:, :6], ref[:, :6], rtol=1e-5)
+
+
+def test_reference_matches_utils_compute_errors():
+    utils = pytest.importorskip('utils')
+    if not hasattr(utils, 'compute_errors'):
+        pytest.skip('utils has no compute_errors')
+    gt, pred = random_batch()
+    expected = per_image(gt, pred, utils.compute_errors)
+    # the older evaluation scripts report the first nine metrics only
+    np.testing.assert_allclose(per_image(gt, pred)[:, :expected.shape[1]], expected, rtol=1e-6)
+
+
+def test_device_metrics_match_the_default_per_image_online_eval():
+    pytest.importorskip('utils')
+    from evaluation import per_image_errors
+    gt, pred = random_batch()
+    g = torch.from_numpy(gt)
+    p = clip_prediction(torch.from_numpy(pred), MIN_DEPTH, MAX_DEPTH)
+    out = compute_errors(g, p, torch.logical_and(g > MIN_DEPTH, g < MAX_DEPTH)).numpy()
+    expected = per_image_errors(g, torch.from_numpy(pred), MIN_DEPTH, MAX_DEPTH).numpy()
+    np.testing.assert_allclose(out[:, :expected.shape[1]], expected, rtol=1e-5)
@@ -0,0 +1,63 @@
+import argparse
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip('utils')
+from dataloaders import anything_wild_dataloader
+
+SCENE_SIZE = (120, 200)
+CROP_SIZE = (48, 80)
+
+
+@pytest.fixture
+def scene(tmp_path):
+    """A WildUAV split of one scene whose image encodes the row and column of each pixel (modulo 256) in its first
+    two channels, and whose .npy depth encodes them as ``1000 * row + column``."""
+    rows, cols = np.indices(SCENE_SIZE)
+    image = np.stack([rows % 256, cols % 256, np.zeros_like(rows)], axis=-1).astype(np.uint8)
+    Image.fromarray(image).save(str(tmp_path / 'image.png'))
+    np.save(str(tmp_path / 'depth.npy'), (1000 * rows + cols).astype(np.float32))
+    (tmp_path / 'split.txt').write_text('image.png depth.npy\n')
+    return tmp_path
+
+
+def make_dataset(root, uint8_transport):
+    args = argparse.Namespace(data_path=str(root), gt_path=str(root), filenames_file=str(root / 'split.txt'),
+                              input_height=CROP_SIZE[0], input_width=CROP_SIZE[1], do_random_crop=True,
+                              uint8_transport=uint8_transport, device_augment=True)
+    return anything_wild_dataloader.DataLoadPreprocess(args, 'train')
+
+
+@pytest.mark.parametrize('uint8_transport', [False, True])
+def test_random_crop_reads_a_window_of_the_memory_mapped_depth(scene, monkeypatch, uint8_transport):
+    load = np.load
+    mmap_modes = []
+
+    def recording_load(path, *args, **kwargs):
+        mmap_modes.append(kwargs.get('mmap_mode'))
+        return load(path, *args, **kwargs)
+    monkeypatch.setattr(anything_wild_dataloader.np, 'load', recording_load)
+
+    dataset = make_dataset(scene, uint8_transport)
+    random.seed(0)
+    offsets = set()
+    for _ in range(10):
+        sample = dataset[0]
+        image, depth = sample['image'], sample['depth'][..., 0]
+        assert depth.shape == CROP_SIZE
+        if not uint8_transport:
+            # padded by BORDER_WIDTH at the bottom and on the right
+            left, top, right, bottom = anything_wild_dataloader.BORDER_WIDTH
+            assert image.shape[:2] == (CROP_SIZE[0] + top + bottom, CROP_SIZE[1] + left + right)
+            image = np.round(image[:CROP_SIZE[0], :CROP_SIZE[1]] * 255)
+        y, x = divmod(int(depth[0, 0]), 1000)
+        rows, cols = np.indices(CROP_SIZE)
+        np.testing.assert_array_equal(depth, 1000 * (rows + y) + cols + x)
+        np.testing.assert_array_equal(image[..., 0], (rows + y) % 256)
+        np.testing.assert_array_equal(image[..., 1], (cols + x) % 256)
+        offsets.add((y, x))
+    assert len(offsets) > 1
+    assert mmap_modes == ['r'] * 10
@@ -0,0 +1,101 @@
+import numpy as np
+import torch
+
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def tile_starts(length, tile, stride):
+    """Start offsets of tiles of size ``tile`` covering ``length`` with the given stride, the last tile flush with
+    the end."""
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    return starts + [length - tile]
+
+
+def feather(tile, overlap):
+    """1-D blending weights of a tile, ramping linearly over ``overlap`` pixels at both ends."""
+    i = np.arange(tile, dtype=np.float32)
+    return np.minimum(1.0, np.minimum(i + 1, tile - i) / float(overlap + 1))
+
+
+class TiledInference(object):
+    """Sliding-window inference over scenes too large to run as one frame.
+
+    The scene is split into overlapping ``tile_size`` tiles, which are run ``batch_size`` at a time through
+    ``predict(images, target_size)`` (see ``tta.newcrf_predict``; a ``tta.TestTimeAugmentation`` also fits) and
+    blended with separable feathered weights. The depth is accumulated into ``out``, e.g. a ``np.memmap``, so that
+    peak memory depends on the tile size rather than on the scene size.
+    """
+    def __init__(self, predict, tile_size=(392, 784), overlap=(56, 112), batch_size=4, size_multiple=28,
+                 device='cuda'):
+        if tile_size[0] % size_multiple or tile_size[1] % size_multiple:
+            raise ValueError('tile size {} must be a multiple of {}'.format(tile_size, size_multiple))
+        if overlap[0] >= tile_size[0] or overlap[1] >= tile_size[1]:
+            raise ValueError('overlap {} must be smaller than the tile size {}'.format(overlap, tile_size))
+        self.predict = predict
+        self.tile_size = tuple(tile_size)
+        self.overlap = tuple(overlap)
+        self.batch_size = batch_size
+        self.device = device
+        self.weights = [feather(t, o) for t, o in zip(self.tile_size, self.overlap)]
+        self.mean = torch.tensor(IMAGENET_MEAN, device=device).view(1, 3, 1, 1)
+        self.std = torch.tensor(IMAGENET_STD, device=device).view(1, 3, 1, 1)
+
+    def tiles(self, height, width):
+        th, tw = self.tile_size
+        ys = tile_starts(height, th, th - self.overlap[0])
+        xs = tile_starts(width, tw, tw - self.overlap[1])
+        return ys, xs
+
+    def load_tile(self, image, y, x):
+        """Crop a tile as float32 in [0, 1], zero padded (as the loaders do) when the scene is smaller than a tile."""
+        th, tw = self.tile_size
+        crop = np.asarray(image[y:y + th, x:x + tw])
+        scale = 255.0 if crop.dtype == np.uint8 else 1.0
+        tile = np.zeros((th, tw, 3), dtype=np.float32)
+        tile[:crop.shape[0], :crop.shape[1]] = crop[..., :3].astype(np.float32) / scale
+        return tile
+
+    def run_batch(self, image, coords, out, wy, wx):
+        th, tw = self.tile_size
+        batch = np.stack([self.load_tile(image, y, x) for y, x in coords], axis=0)
+        batch = torch.from_numpy(batch).to(self.device).permute(0, 3, 1, 2)
+        batch = (batch - self.mean) / self.std
+        with torch.no_grad():
+            depth, _ = self.predict(batch, self.tile_size)
+        depth = depth[:, 0].float() * torch.from_numpy(np.outer(wy, wx)).to(depth.device)
+        depth = depth.cpu().numpy()
+        for d, (y, x) in zip(depth, coords):
+            h, w = min(th, out.shape[0] - y), min(tw, out.shape[1] - x)
+            out[y:y + h, x:x + w] += d[:h, :w]
+
+    def __call__(self, image, out=None):
+        """Predict the (H, W) depth of an (H, W, 3) uint8 or [0, 1] float ``image``, which may be memory-mapped."""
+        height, width = image.shape[:2]
+        if out is None:
+            out = np.zeros((height, width), dtype=np.float32)
+        else:
+            out[...] = 0
+        ys, xs = self.tiles(height, width)
+        wy, wx = self.weights
+
+        # the weights are separable and the tiles form a grid, so their sum is the outer product of two 1-D sums
+        norm_y = np.zeros(height, dtype=np.float32)
+        for y in ys:
+            n = min(len(wy), height - y)
+            norm_y[y:y + n] += wy[:n]
+        norm_x = np.zeros(width, dtype=np.float32)
+        for x in xs:
+            n = min(len(wx), width - x)
+            norm_x[x:x + n] += wx[:n]
+
+        coords = [(y, x) for y in ys for x in xs]
+        for i in range(0, len(coords), self.batch_size):
+            self.run_batch(image, coords[i:i + self.batch_size], out, wy, wx)
+
+        for y in range(0, height, self.tile_size[0]):
+            out[y:y + self.tile_size[0]] /= np.outer(norm_y[y:y + self.tile_size[0]], norm_x)
+        return out
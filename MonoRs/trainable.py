@@ -0,0 +1,56 @@
+def trainable_parameters(model):
+    """The parameters of ``model`` with ``requires_grad``, in ``model.parameters()`` order."""
+    return [p for p in model.parameters() if p.requires_grad]
+
+
+def unused_parameters(model):
+    """Names of the trainable parameters of ``model`` that got no gradient from the last backward pass."""
+    return [name for name, p in model.named_parameters() if p.requires_grad and p.grad is None]
+
+
+def unused_modules(model):
+    """The modules owning ``unused_parameters(model)``, e.g. ``disp_head1`` rather than each of its weights.
+
+    A module is reported whole when none of its trainable parameters got a gradient.
+    """
+    unused = set(unused_parameters(model))
+    modules = []
+    for name, module in model.named_modules():
+        params = [name + '.' + n if name else n for n, p in module.named_parameters() if p.requires_grad]
+        if params and all(p in unused for p in params):
+            # the parent is reported instead of its submodules
+            if not any(name.startswith(m + '.') for m in modules):
+                modules.append(name)
+    return modules
+
+
+def optimizer_param_names(model):
+    """Names of ``trainable_parameters(model)``, saved with the optimizer state so that it can be remapped."""
+    return [name for name, p in model.named_parameters() if p.requires_grad]
+
+
+def load_optimizer_state(optimizer, state, model, param_names=None):
+    """Load ``state`` into a single-group optimizer built over ``trainable_parameters(model)``.
+
+    ``param_names`` names the parameters of the saved state (``optimizer_param_names`` at save time), which are
+    remapped by name; parameters that were not trainable then start without state. Without ``param_names`` the
+    state is either of the same parameters or, as in older checkpoints, of all ``model.parameters()``.
+    """
+    names = optimizer_param_names(model)
+    if len(state['param_groups']) != 1 or len(optimizer.param_groups) != 1:
+        raise ValueError('only single parameter group optimizers are remapped')
+    saved_ids = state['param_groups'][0]['params']
+    if param_names is None:
+        if len(saved_ids) == len(names):
+            optimizer.load_state_dict(state)
+            return
+        param_names = [name for name, _ in model.named_parameters()]
+        if len(saved_ids) != len(param_names):
+            raise ValueError('optimizer state of {} parameters does not fit {} trainable of {} parameters'.format(
+                len(saved_ids), len(names), len(param_names)))
+
+    index = {name: i for i, name in enumerate(names)}
+    new_ids = {saved_id: index[name] for saved_id, name in zip(saved_ids, param_names) if name in index}
+    group = dict(state['param_groups'][0], params=list(range(len(names))))
+    optimizer.load_state_dict({'state': {new_ids[i]: s for i, s in state['state'].items() if i in new_ids},
+                               'param_groups': [group]})
@@ -0,0 +1,89 @@
+import torch
+import torch.nn.functional as F
+
+from utils import post_process_depth
+from precision import autocast
+
+
+DEFAULT_VIEWS = ('identity', 'hflip')
+
+
+def parse_view(view):
+    """Split a view such as 'identity', 'hflip', 'vflip', 'scale0.75' or 'scale0.75+hflip' into
+    (scale, hflip, vflip)."""
+    scale, hflip, vflip = 1.0, False, False
+    for op in view.split('+'):
+        if op == 'identity':
+            continue
+        elif op == 'hflip':
+            hflip = True
+        elif op == 'vflip':
+            vflip = True
+        elif op.startswith('scale'):
+            scale = float(op[len('scale'):])
+        else:
+            raise ValueError('Unknown test-time augmentation {} in view {}'.format(op, view))
+    return scale, hflip, vflip
+
+
+def flip(x, hflip, vflip):
+    dims = [d for d, f in ((-1, hflip), (-2, vflip)) if f]
+    return torch.flip(x, dims) if dims else x
+
+
+def newcrf_predict(model, precision='fp32', **kwargs):
+    """Wrap NewCRFDepth as a ``predict(images, target_size)`` returning the final float32 depth and the number of
+    refinement iterations (None without ``early_exit``), run under the autocast of ``precision``."""
+    def predict(images, target_size):
+        with autocast(precision, images.device):
+            outputs = model(images, inference=True, target_size=target_size, **kwargs)
+        return outputs[0][-1].float(), outputs[3] if len(outputs) > 3 else None
+    return predict
+
+
+class TestTimeAugmentation(object):
+    """Test-time augmentation that runs all views of the same input size as one batch.
+
+    ``predict(images, target_size)`` returns a (B, 1, H, W) depth at ``target_size`` and optionally a per-sample
+    tensor of refinement iterations. Every view is flipped back on the model's device; the views are merged with
+    ``post_process_depth`` for the usual identity + hflip pair and averaged otherwise. Scaled inputs are resized to a
+    multiple of ``size_multiple``.
+    """
+    def __init__(self, predict, views=DEFAULT_VIEWS, size_multiple=28):
+        self.predict = predict
+        self.views = list(views)
+        self.parsed = [parse_view(view) for view in self.views]
+        self.size_multiple = size_multiple
+        # views of the same scale share one forward pass
+        self.groups = {}
+        for i, (scale, _, _) in enumerate(self.parsed):
+            self.groups.setdefault(scale, []).append(i)
+
+    def scaled_size(self, size, scale):
+        m = self.size_multiple
+        return [max(m, int(round(s * scale / m)) * m) for s in size]
+
+    def __call__(self, image, target_size=None):
+        """Return the merged (B, 1, H, W) depth and the per-sample mean number of refinement iterations (or None)."""
+        b = image.shape[0]
+        if target_size is None:
+            target_size = image.shape[-2:]
+        preds = [None] * len(self.views)
+        num_iters = []
+        for scale, indices in self.groups.items():
+            x = image
+            if scale != 1.0:
+                x = F.interpolate(image, size=self.scaled_size(image.shape[-2:], scale), mode='bilinear',
+                                  align_corners=False)
+            batch = torch.cat([flip(x, *self.parsed[i][1:]) for i in indices], dim=0)
+            depth, iters = self.predict(batch, target_size)
+            for k, i in enumerate(indices):
+                preds[i] = depth[k * b:(k + 1) * b]
+            if iters is not None:
+                num_iters.append(iters.float().view(len(indices), b).sum(0))
+        num_iters = sum(num_iters) / len(self.views) if num_iters else None
+
+        if [p[1:] for p in self.parsed] == [(False, False), (True, False)] and self.parsed[0][0] == self.parsed[1][0]:
+            return post_process_depth(preds[0], preds[1]), num_iters
+        preds = [flip(pred, *parsed[1:]) for pred, parsed in zip(preds, self.parsed)]
+        return torch.stack(preds, dim=0).mean(0), num_iters